@@ -0,0 +1,281 @@
+"""Check every evidence entry and image file, without the GUI.
+
+For each evidence entry of every node and edge:
+- localPath and evidenceUrl must name the same file,
+- that file must exist inside public/images and decode completely with PIL,
+- the resized web variants listed for it must exist.
+Files in public/images that no evidence references are reported as orphans.
+
+Images are decoded in a process pool. Results are kept in
+public/images/.audit.json by file mtime and size, so a rerun only
+decodes images that changed. The report is printed as JSON (or written to
+--output), and the exit status is 1 if anything is wrong.
+
+--fix repairs what can be repaired and saves it with one write per table:
+paths that disagree are pointed at the file that exists, images outside
+public/images are copied in, and missing variants are dropped from the
+entry. --drop-broken removes entries whose image is missing or cannot
+be decoded, and changes nothing else unless --fix is given too.
+--delete-orphans deletes the orphaned files.
+
+    python audit_evidence.py
+    python audit_evidence.py --fix --output audit.json
+    python audit_evidence.py --db evidence.db --workers 8
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+from PIL import Image
+
+from data_manager import DataManager, evidence_paths
+from repository import decode_evidence
+from storage import SqliteBackend
+from graph_bundle import refresh_bundle
+
+CACHE_FILENAME = '.audit.json'  # Decode results, kept inside the images directory
+CACHE_FORMAT = 1
+
+# Problems, in the order they are checked for an entry
+NO_PATH = 'no_path'  # Neither localPath nor evidenceUrl
+PATH_MISMATCH = 'path_mismatch'  # localPath and evidenceUrl name different files
+MISSING_FILE = 'missing_file'
+OUTSIDE_IMAGES = 'outside_images'  # Exists, but the web view cannot load it from there
+UNREADABLE = 'unreadable'  # PIL could not decode it completely
+MISSING_VARIANT = 'missing_variant'
+
+
+def _absolute(path):
+    return Path(os.path.abspath(path)).as_posix()
+
+
+def evidence_files(evidence):
+    """Absolute paths of the files named by an entry's localPath and evidenceUrl (None if unset or remote)"""
+    local = (evidence.get('localPath') or '').replace('\\', '/')
+    url = evidence.get('evidenceUrl') or ''
+    url_file = None if not url or url.startswith(('http://', 'https://')) else _absolute(url.lstrip('/'))
+    return (_absolute(local) if local else None), url_file
+
+
+def decode_image(path):
+    """Fully decode one image (runs in a worker process); returns (path, error or None)"""
+    try:
+        with Image.open(path) as img:
+            img.load()
+        return path, None
+    except Exception as e:
+        return path, f"{type(e).__name__}: {e}"
+
+
+class AuditCache:
+    """Decode results per image file, valid while its mtime and size are unchanged"""
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.results = {}  # absolute path -> [mtime_ns, size, error or None]
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            if data.get('format') == CACHE_FORMAT:
+                self.results = data['results']
+        except (FileNotFoundError, ValueError, KeyError, AttributeError):
+            pass
+
+    def lookup(self, path, st):
+        cached = self.results.get(path)
+        if cached and cached[0] == st.st_mtime_ns and cached[1] == st.st_size:
+            return True, cached[2]
+        return False, None
+
+    def store(self, path, st, error):
+        self.results[path] = [st.st_mtime_ns, st.st_size, error]
+
+    def save(self, keep):
+        """Write the cache, forgetting files no longer in keep"""
+        self.results = {path: result for path, result in self.results.items() if path in keep}
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(prefix=f"{CACHE_FILENAME}.", suffix='.tmp', dir=self.path.parent)
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump({'format': CACHE_FORMAT, 'results': self.results}, f)
+        os.replace(tmp_path, self.path)
+
+
+def check_files(paths, cache, workers=None, progress=True):
+    """Decode errors of the existing files among paths; returns ({path: error or None}, decoded count)"""
+    results, pending, stats = {}, [], {}
+    for path in sorted(paths):
+        try:
+            stats[path] = os.stat(path)
+        except OSError:
+            continue
+        hit, error = cache.lookup(path, stats[path])
+        if hit:
+            results[path] = error
+        else:
+            pending.append(path)
+
+    if pending:
+        started = last_report = time.monotonic()
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            for done, (path, error) in enumerate(executor.map(decode_image, pending, chunksize=8), start=1):
+                results[path] = error
+                cache.store(path, stats[path], error)
+                now = time.monotonic()
+                if progress and (now - last_report >= 1.0 or done == len(pending)):
+                    last_report = now
+                    print(f"Decoded {done}/{len(pending)} images ({done / max(now - started, 1e-9):.1f}/s)",
+                          file=sys.stderr)
+    return results, len(pending)
+
+
+def entry_problems(evidence, images_dir, file_errors):
+    """Problems of one evidence entry as a list of (problem, detail)"""
+    local_file, url_file = evidence_files(evidence)
+    if local_file is None and url_file is None:
+        return [(NO_PATH, None)] if not evidence.get('evidenceUrl') else []  # Remote images are not checked
+    problems = []
+    if local_file and url_file and local_file != url_file:
+        problems.append((PATH_MISMATCH, f"{local_file} != {url_file}"))
+    path = local_file or url_file
+    if path not in file_errors:
+        problems.append((MISSING_FILE, path))
+        return problems
+    if Path(path).parent != images_dir:
+        problems.append((OUTSIDE_IMAGES, path))
+    if file_errors[path]:
+        problems.append((UNREADABLE, file_errors[path]))
+    for variant in evidence.get('variants') or []:
+        if not os.path.exists(variant.get('url', '').lstrip('/')):
+            problems.append((MISSING_VARIANT, variant.get('url')))
+    return problems
+
+
+def fixed_entry(evidence, problems, data_manager, fix, drop_broken):
+    """The repaired entry, None to drop it, or the entry itself if nothing can or may be done.
+
+    Paths and variants are only repaired with fix; drop_broken only drops entries.
+    """
+    kinds = {kind for kind, _ in problems}
+    if kinds & {MISSING_FILE, UNREADABLE, NO_PATH}:
+        local_file, url_file = evidence_files(evidence)
+        # A mismatch where only the other path exists is repairable below
+        if not (MISSING_FILE in kinds and PATH_MISMATCH in kinds and url_file and os.path.exists(url_file)):
+            return None if drop_broken else evidence
+    if not fix:
+        return evidence
+    fixed = dict(evidence)
+    if kinds & {PATH_MISMATCH, OUTSIDE_IMAGES}:
+        local_file, url_file = evidence_files(evidence)
+        path = local_file if local_file and os.path.exists(local_file) else url_file
+        stored_path = Path(path)
+        if stored_path.parent != Path(os.path.abspath(data_manager.images_dir)):
+            stored_path, _ = data_manager.blobs.put(path)
+        stored_path = Path(os.path.relpath(stored_path))
+        paths = evidence_paths(stored_path)
+        if paths['localPath'] != evidence.get('localPath'):
+            fixed.pop('variants', None)  # They belong to the old file
+        fixed.update(paths)
+    if MISSING_VARIANT in kinds:
+        fixed.pop('variants', None)
+    return fixed
+
+
+def run_audit(data_manager, workers=None, fix=False, drop_broken=False, delete_orphans=False, progress=True):
+    """Audit all evidence; returns the report dict"""
+    images_dir = Path(os.path.abspath(data_manager.images_dir))
+    entries = []  # (item_type, item ID, index, evidence)
+    for item_type in ('node', 'edge'):
+        for record in data_manager.iter_items(item_type, ['ID', 'EvidenceData']):
+            entries.extend((item_type, record['ID'], index, evidence)
+                           for index, evidence in enumerate(record.evidence))
+
+    files = {path for _, _, _, evidence in entries for path in evidence_files(evidence) if path}
+    cache = AuditCache(images_dir / CACHE_FILENAME)
+    file_errors, decoded = check_files(files, cache, workers, progress)
+    cache.save(files)
+
+    problems, fixes = [], {}
+    for item_type, item_id, index, evidence in entries:
+        found = entry_problems(evidence, images_dir, file_errors)
+        problems.extend({'type': item_type, 'id': item_id, 'index': index, 'problem': kind, 'detail': detail}
+                        for kind, detail in found)
+        if found and (fix or drop_broken):
+            replacement = fixed_entry(evidence, found, data_manager, fix, drop_broken)
+            if replacement is not evidence:
+                fixes.setdefault(item_type, {}).setdefault(item_id, {})[
+                    json.dumps(evidence, sort_keys=True)] = replacement
+
+    fixed = 0
+    for item_type, by_item in fixes.items():
+        items, base = [], []
+        for item_id, replacements in by_item.items():
+            item = data_manager.get_item(item_id, item_type)
+            if not item:
+                continue
+            original = dict(item)
+            evidence_data = []
+            for evidence in decode_evidence(item.get('EvidenceData')):
+                key = json.dumps(evidence, sort_keys=True)
+                if key in replacements:
+                    fixed += 1
+                    evidence = replacements[key]
+                if evidence is not None:
+                    evidence_data.append(evidence)
+            item['EvidenceData'] = json.dumps(evidence_data)
+            items.append(item)
+            base.append(original)
+        if items and not data_manager.update_items(items, item_type, base):
+            raise RuntimeError(f"Failed to write the {item_type} fixes")
+    if fixed:
+        if not data_manager.compact():
+            raise RuntimeError("Failed to write the CSV files")
+        refresh_bundle(data_manager)
+
+    orphans = data_manager.collect_garbage(dry_run=not delete_orphans)
+    return {
+        'items': len({(item_type, item_id) for item_type, item_id, _, _ in entries}),
+        'evidence': len(entries),
+        'files': len(files),
+        'decoded': decoded,
+        'cached': len(file_errors) - decoded,
+        'problems': problems,
+        'orphans': orphans,
+        'orphans_deleted': delete_orphans,
+        'fixed': fixed,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check evidence paths and images and find orphaned files")
+    parser.add_argument('--db', help="Use this SQLite database instead of the CSV files")
+    parser.add_argument('--workers', type=int, default=None, help="Worker processes (default: CPU count)")
+    parser.add_argument('--output', help="Write the JSON report to this file instead of stdout")
+    parser.add_argument('--fix', action='store_true', help="Repair paths and variants, saved in one batch")
+    parser.add_argument('--drop-broken', action='store_true',
+                        help="Remove entries whose image is missing or unreadable")
+    parser.add_argument('--delete-orphans', action='store_true', help="Delete image files no evidence references")
+    parser.add_argument('--quiet', action='store_true', help="Don't print progress")
+    args = parser.parse_args()
+
+    backend = SqliteBackend.from_csv(args.db) if args.db else None
+    report = run_audit(DataManager(backend=backend), args.workers, args.fix, args.drop_broken,
+                       args.delete_orphans, not args.quiet)
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+    if not args.quiet:
+        print(f"{report['evidence']} evidence entries, {len(report['problems'])} problems, "
+              f"{len(report['orphans'])} orphaned files, {report['fixed']} entries fixed", file=sys.stderr)
+    sys.exit(1 if report['problems'] or (report['orphans'] and not args.delete_orphans) else 0)
+
+
+if __name__ == "__main__":
+    main()
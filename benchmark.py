@@ -0,0 +1,418 @@
+"""Benchmark DataManager operations on synthetic datasets, without the GUI.
+
+Generate a dataset once, then run the benchmarks against it. The dataset
+directory holds Nodes.csv, Edges.csv and public/images like the real
+project, so DataManager runs on it unchanged. Evidence images are real
+JPEG/PNG files of different sizes.
+
+    python benchmark.py generate bench/10k --nodes 10000
+    python benchmark.py run bench/10k --output results.json
+    python benchmark.py run bench/10k --db --output results-sqlite.json
+    python benchmark.py compare results-old.json results.json
+
+Each benchmark reports the number of calls, throughput, latency percentiles
+and the peak memory allocated by one call. The run also records the
+process's peak resident memory. The startup benchmarks time importing the
+data layer and the first read in fresh interpreters, and warn if that
+loaded PIL, tkinter or NumPy, which only image processing, the editor and
+the layout need. Runs write to the dataset (edits, added and
+removed evidence), so regenerate it to compare runs exactly.
+"""
+import os
+import sys
+import csv
+import json
+import math
+import time
+import random
+import shutil
+import argparse
+import platform
+import tracemalloc
+import subprocess
+from datetime import datetime, timezone
+from pathlib import Path
+
+from PIL import Image
+
+from blob_store import BlobStore
+from data_manager import DataManager, IMAGES_SUBDIR, THUMBNAIL_SIZE, evidence_paths
+from storage import CsvBackend, SqliteBackend, NODE_COLUMNS, EDGE_COLUMNS
+
+try:
+    import resource
+except ImportError:  # Not available on Windows; peak RSS is left out there
+    resource = None
+
+RESULTS_FORMAT = 1
+DATASET_INFO = 'dataset.json'  # Generator settings, stored in the dataset directory
+SOURCE_IMAGES = 'source_images'  # Images used as add_evidence input
+IMAGE_SIZES = [(320, 240), (1280, 960), (4032, 3024)]  # Small web image, screenshot, phone photo
+NODE_TYPES = ['Person', 'Organisation', 'Product', 'Event']
+EDGE_LABELS = ['Funds', 'Owns', 'Promotes', 'Directs', 'Invented']
+WORDS = ('vaccine funding foundation analysis network grant revenue promotion stake research '
+         'consortium data ministry company report contract shares board policy trial').split()
+PERCENTILES = [50, 90, 99]
+REGRESSION_THRESHOLD = 1.10  # compare flags benchmarks whose p50 grew by more than this factor
+STARTUP_RUNS = 10  # Fresh interpreters started per startup benchmark
+HEADLESS_MODULES = ('PIL', 'tkinter', 'numpy')  # Must not be loaded just to read the data
+
+# Run by the startup benchmarks in a fresh interpreter: argv is the node to read, 'csv' or 'db', then the
+# modules to look for. Prints the timings, peak allocations (under -X tracemalloc) and modules loaded
+STARTUP_SCRIPT = '''
+import sys, json, time, tracemalloc
+start = time.perf_counter()
+from data_manager import DataManager
+from storage import SqliteBackend
+imported = time.perf_counter()
+import_peak = tracemalloc.get_traced_memory()[1]
+tracemalloc.reset_peak()
+data_manager = DataManager(backend=SqliteBackend.from_csv('benchmark.db') if sys.argv[2] == 'db' else None)
+data_manager.get_item(sys.argv[1], 'node')
+done = time.perf_counter()
+print(json.dumps({'import_s': imported - start, 'first_read_s': done - imported, 'import_peak': import_peak,
+                  'first_read_peak': tracemalloc.get_traced_memory()[1],
+                  'modules': [name for name in sys.argv[3:] if name in sys.modules]}))
+'''
+
+
+def _text(rng, words):
+    return ' '.join(rng.choice(WORDS) for _ in range(words))
+
+
+def _make_image(path, size, rng):
+    """Write a noisy gradient image, which compresses about as badly as a photo"""
+    # Noise in 4x4 blocks keeps the files photo-sized without making generation slow
+    noise = Image.effect_noise((size[0] // 4, size[1] // 4), rng.randint(20, 80)).resize(size)
+    gradient = Image.linear_gradient('L').resize(size)
+    img = Image.merge('RGB', (noise, gradient, gradient.transpose(Image.Transpose.FLIP_LEFT_RIGHT)))
+    if path.suffix == '.jpg':
+        img.save(path, quality=85)
+    else:
+        img.save(path, compress_level=1)
+
+
+def generate_dataset(directory, nodes=1000, edges_per_node=2.0, evidence_per_item=2, images=30, seed=1):
+    """Write a synthetic dataset into directory and return its settings"""
+    rng = random.Random(seed)
+    directory = Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+
+    # A pool of real images, shared between items as in the real data
+    source_dir = directory / SOURCE_IMAGES
+    source_dir.mkdir(exist_ok=True)
+    blobs = BlobStore(directory / 'public' / IMAGES_SUBDIR)
+    blobs.directory.mkdir(parents=True, exist_ok=True)
+    stored = []
+    for i in range(images):
+        size = IMAGE_SIZES[i % len(IMAGE_SIZES)]
+        source = source_dir / f"image_{i}{'.jpg' if i % 2 else '.png'}"
+        if not source.exists():
+            _make_image(source, size, rng)
+        stored.append(evidence_paths(blobs.put(source)[0]))
+
+    def evidence():
+        return json.dumps([{
+            **rng.choice(stored),
+            "sourceUrl": f"https://example.org/source/{rng.randrange(10 ** 6)}",
+            "sourceLabel": _text(rng, 3),
+        } for _ in range(evidence_per_item)])
+
+    with open(directory / 'Nodes.csv', 'w', newline='', encoding='utf-8') as f:
+        writer = csv.DictWriter(f, fieldnames=NODE_COLUMNS)
+        writer.writeheader()
+        for i in range(nodes):
+            writer.writerow({
+                'ID': f"n{i}",
+                'Label': _text(rng, 2).title(),
+                'Type': rng.choice(NODE_TYPES),
+                'Details': _text(rng, rng.randint(10, 80)),
+                'EvidenceData': evidence(),
+                'ImageUrl': '',
+            })
+
+    edge_count = int(nodes * edges_per_node)
+    with open(directory / 'Edges.csv', 'w', newline='', encoding='utf-8') as f:
+        writer = csv.DictWriter(f, fieldnames=EDGE_COLUMNS)
+        writer.writeheader()
+        for i in range(edge_count):
+            writer.writerow({
+                'ID': f"e{i}",
+                'From': f"n{rng.randrange(nodes)}",
+                'To': f"n{rng.randrange(nodes)}",
+                'Label': rng.choice(EDGE_LABELS),
+                'Details': _text(rng, rng.randint(5, 40)),
+                'EvidenceData': evidence(),
+            })
+
+    info = {
+        'nodes': nodes,
+        'edges': edge_count,
+        'evidence_per_item': evidence_per_item,
+        'images': images,
+        'seed': seed,
+    }
+    with open(directory / DATASET_INFO, 'w', encoding='utf-8') as f:
+        json.dump(info, f, indent=2)
+    return info
+
+
+def percentile(sorted_samples, pct):
+    """Nearest-rank percentile of an already sorted list"""
+    rank = math.ceil(pct / 100 * len(sorted_samples))
+    return sorted_samples[min(max(rank, 1), len(sorted_samples)) - 1]
+
+
+def summarize(samples, peak_bytes):
+    samples = sorted(samples)
+    total = sum(samples)
+    summary = {
+        'calls': len(samples),
+        'total_s': total,
+        'ops_per_s': len(samples) / total if total else None,
+        'mean_ms': total / len(samples) * 1000,
+        'min_ms': samples[0] * 1000,
+        'max_ms': samples[-1] * 1000,
+    }
+    for pct in PERCENTILES:
+        summary[f"p{pct}_ms"] = percentile(samples, pct) * 1000
+    summary['peak_alloc_bytes'] = peak_bytes
+    return summary
+
+
+def measure(calls, setup=None):
+    """Time calls, a list of zero-argument functions, and return their summary.
+
+    setup, if given, runs untimed before each call with the call's index.
+    One extra call is made with tracemalloc on to find its peak allocation,
+    so tracing does not distort the timings.
+    """
+    samples = []
+    for i, call in enumerate(calls):
+        if setup is not None:
+            setup(i)
+        start = time.perf_counter()
+        call()
+        samples.append(time.perf_counter() - start)
+
+    if setup is not None:
+        setup(0)
+    tracemalloc.start()
+    try:
+        calls[0]()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return summarize(samples, peak)
+
+
+def measure_startup(item_id, use_db, runs=STARTUP_RUNS):
+    """Time importing the data layer and reading one item, each run in a fresh interpreter.
+
+    Returns the summaries of the import and of the first read. As in measure(),
+    one extra run with tracemalloc on finds the peak allocations.
+    """
+    repo_dir = os.path.dirname(os.path.abspath(__file__))
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [repo_dir, os.environ.get('PYTHONPATH')])))
+
+    def start(*options):
+        command = [sys.executable, *options, '-c', STARTUP_SCRIPT, item_id, 'db' if use_db else 'csv',
+                   *HEADLESS_MODULES]
+        return json.loads(subprocess.run(command, capture_output=True, text=True, env=env, check=True).stdout)
+
+    samples = [start() for _ in range(runs)]
+    traced = start('-X', 'tracemalloc')
+    modules = sorted({name for sample in samples for name in sample['modules']})
+    import_summary = summarize([sample['import_s'] for sample in samples], traced['import_peak'])
+    read_summary = summarize([sample['first_read_s'] for sample in samples], traced['first_read_peak'])
+    import_summary['modules'] = read_summary['modules'] = modules
+    return import_summary, read_summary
+
+
+def make_backend(use_db):
+    return SqliteBackend.from_csv('benchmark.db') if use_db else None
+
+
+def run_benchmarks(repeat=200, use_db=False, seed=1, progress=True):
+    """Run every benchmark in the current directory (a generated dataset); returns the results"""
+    rng = random.Random(seed)
+    results = {}
+
+    def report(name, summary):
+        results[name] = summary
+        if progress:
+            print(f"{name:<24} {summary['calls']:>6} calls  p50 {summary['p50_ms']:9.3f} ms  "
+                  f"p99 {summary['p99_ms']:9.3f} ms  peak {summary['peak_alloc_bytes'] / 1e6:8.1f} MB",
+                  file=sys.stderr)
+
+    # Parsing Nodes.csv from scratch, as on startup
+    report('load_nodes_csv', measure([lambda: CsvBackend('Nodes.csv', 'Edges.csv').tables['node'].all()] * 3))
+
+    data_manager = DataManager(backend=make_backend(use_db))
+    node_ids = [item['ID'] for item in data_manager.get_items('node')]
+    sample_ids = [rng.choice(node_ids) for _ in range(repeat)]
+
+    # Opening the data in a new process, as every script and the editor do
+    import_summary, read_summary = measure_startup(sample_ids[0], use_db)
+    report('startup_import', import_summary)
+    report('startup_first_read', read_summary)
+    if progress and import_summary['modules']:
+        print(f"Warning: reading the data loaded {', '.join(import_summary['modules'])}", file=sys.stderr)
+
+    report('get_items', measure([lambda: data_manager.get_items('node')] * max(3, repeat // 20)))
+    report('get_item', measure([lambda item_id=item_id: data_manager.get_item(item_id, 'node')
+                                for item_id in sample_ids]))
+
+    def update(item_id):
+        item = data_manager.get_item(item_id, 'node')
+        item['Details'] = _text(rng, 20)
+        assert data_manager.update_item(item, 'node')
+    report('update_item', measure([lambda item_id=item_id: update(item_id) for item_id in sample_ids]))
+
+    # Adding then removing an image keeps the dataset the same size between runs
+    sources = sorted(Path(SOURCE_IMAGES).iterdir())
+    added = []
+
+    def add(item_id, source):
+        assert data_manager.add_evidence(item_id, 'node', str(source), 'https://example.org', 'benchmark')
+        added.append(item_id)
+
+    def remove():
+        item_id = added.pop()
+        count = len(json.loads(data_manager.get_item(item_id, 'node')['EvidenceData']))
+        assert data_manager.remove_evidence(item_id, 'node', count - 1)
+
+    report('add_evidence', measure([lambda item_id=item_id: add(item_id, rng.choice(sources))
+                                    for item_id in sample_ids]))
+    data_manager.wait_for_images()  # Thumbnails and web variants are made in the background, off the clock
+    report('remove_evidence', measure([remove] * len(sample_ids)))
+    added.clear()
+
+    # The evidence panel's image preparation (ImageLoader's work, minus the Tk PhotoImage)
+    thumbnails = data_manager.thumbnails
+    image_paths = [evidence['localPath'] for item_id in sample_ids[:max(3, repeat // 10)]
+                   for evidence in json.loads(data_manager.get_item(item_id, 'node')['EvidenceData'])]
+
+    def drop_thumbnail(i):
+        path = image_paths[i]
+        thumbnails.thumbnail_path(thumbnails.source_hash(path), THUMBNAIL_SIZE).unlink(missing_ok=True)
+
+    prepare = [lambda path=path: thumbnails.load(path, THUMBNAIL_SIZE) for path in image_paths]
+    report('image_prep_cold', measure(prepare, setup=drop_thumbnail))
+    report('image_prep_warm', measure(prepare))
+
+    report('compact', measure([data_manager.compact]))
+    data_manager.backend.close()
+    return results
+
+
+def _git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(dataset, output=None, repeat=200, use_db=False, seed=1, progress=True):
+    """Run the benchmarks on a generated dataset and optionally save the results as JSON"""
+    dataset = Path(dataset).resolve()
+    with open(dataset / DATASET_INFO, 'r', encoding='utf-8') as f:
+        info = json.load(f)
+    output = Path(output).resolve() if output else None
+
+    cwd = os.getcwd()
+    os.chdir(dataset)  # DataManager works on the files in the current directory
+    try:
+        if use_db and os.path.exists('benchmark.db'):
+            os.remove('benchmark.db')
+        results = run_benchmarks(repeat, use_db, seed, progress)
+    finally:
+        os.chdir(cwd)
+
+    report = {
+        'format': RESULTS_FORMAT,
+        'created': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'commit': _git_commit(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'backend': 'sqlite' if use_db else 'csv',
+        'dataset': info,
+        'repeat': repeat,
+        # ru_maxrss is in KiB on Linux and bytes on macOS
+        'max_rss_bytes': (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss *
+                          (1 if sys.platform == 'darwin' else 1024)) if resource else None,
+        'results': results,
+    }
+    if output:
+        with open(output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+    return report
+
+
+def compare(old_path, new_path):
+    """Print the p50 latency change of every benchmark; returns the names that regressed"""
+    with open(old_path, 'r', encoding='utf-8') as f:
+        old = json.load(f)
+    with open(new_path, 'r', encoding='utf-8') as f:
+        new = json.load(f)
+    if old['dataset'] != new['dataset'] or old['backend'] != new['backend']:
+        print("Warning: the results were measured on different datasets or backends")
+
+    regressions = []
+    print(f"{'benchmark':<24} {'old p50 ms':>12} {'new p50 ms':>12} {'change':>8}")
+    for name, result in new['results'].items():
+        if name not in old['results']:
+            continue
+        before, after = old['results'][name]['p50_ms'], result['p50_ms']
+        ratio = after / before if before else float('inf')
+        flag = ''
+        if ratio > REGRESSION_THRESHOLD:
+            regressions.append(name)
+            flag = '  slower'
+        print(f"{name:<24} {before:12.3f} {after:12.3f} {ratio:7.2f}x{flag}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark DataManager on synthetic datasets")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    generate = commands.add_parser('generate', help="Write a synthetic dataset")
+    generate.add_argument('directory')
+    generate.add_argument('--nodes', type=int, default=1000, help="Number of nodes (default: 1000)")
+    generate.add_argument('--edges-per-node', type=float, default=2.0, help="Edges per node (default: 2)")
+    generate.add_argument('--evidence', type=int, default=2, help="Evidence entries per item (default: 2)")
+    generate.add_argument('--images', type=int, default=30, help="Distinct evidence images (default: 30)")
+    generate.add_argument('--seed', type=int, default=1)
+    generate.add_argument('--force', action='store_true', help="Replace an existing dataset")
+
+    bench = commands.add_parser('run', help="Run the benchmarks on a dataset")
+    bench.add_argument('directory')
+    bench.add_argument('--output', help="Save the results to this JSON file")
+    bench.add_argument('--repeat', type=int, default=200, help="Calls per benchmark (default: 200)")
+    bench.add_argument('--db', action='store_true', help="Benchmark the SQLite backend instead of the CSV files")
+    bench.add_argument('--seed', type=int, default=1)
+
+    diff = commands.add_parser('compare', help="Compare two result files")
+    diff.add_argument('old')
+    diff.add_argument('new')
+
+    args = parser.parse_args()
+    if args.command == 'generate':
+        if (Path(args.directory) / DATASET_INFO).exists():
+            if not args.force:
+                parser.error(f"{args.directory} already holds a dataset; pass --force to replace it")
+            shutil.rmtree(args.directory)
+        info = generate_dataset(args.directory, args.nodes, args.edges_per_node, args.evidence, args.images, args.seed)
+        print(f"Wrote {info['nodes']} nodes and {info['edges']} edges to {args.directory}")
+    elif args.command == 'run':
+        run(args.directory, args.output, args.repeat, args.db, args.seed)
+        if args.output:
+            print(f"Saved results to {args.output}")
+    else:
+        sys.exit(1 if compare(args.old, args.new) else 0)
+
+
+if __name__ == "__main__":
+    main()
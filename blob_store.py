@@ -0,0 +1,96 @@
+import os
+import shutil
+import hashlib
+import tempfile
+from pathlib import Path
+
+from instrumentation import timed, count
+
+FICLONE = 0x40049409  # Linux ioctl that makes a copy-on-write clone of a file
+
+
+def file_sha256(path, chunk_size=1024 * 1024):
+    """Return the hex SHA-256 of a file's contents"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _reflink(source_path, target_path):
+    """Clone source_path to target_path without copying data, where the filesystem supports it"""
+    try:
+        import fcntl
+    except ImportError:
+        return False
+    try:
+        with open(source_path, 'rb') as src, open(target_path, 'wb') as dst:
+            fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+    except OSError:
+        if os.path.exists(target_path):
+            os.remove(target_path)
+        return False
+    shutil.copystat(source_path, target_path)
+    return True
+
+
+class BlobStore:
+    """Directory of files named by the SHA-256 of their contents.
+
+    Storing the same image twice returns the existing file. New files are
+    created as a reflink where the filesystem supports it, otherwise copied.
+    A file that is already inside the directory (e.g. one stored under its
+    old name) is hardlinked instead, if use_links. Files from elsewhere are
+    never linked: editing the original in place would change the stored
+    file behind its hash.
+    """
+
+    def __init__(self, directory, use_links=True):
+        self.directory = Path(directory)
+        self.use_links = use_links
+
+    def path_for(self, digest, ext):
+        return self.directory / f"{digest}{ext.lower()}"
+
+    def contains(self, path):
+        """Whether path is a file directly inside the store's directory"""
+        return Path(os.path.abspath(path)).parent == Path(os.path.abspath(self.directory))
+
+    @timed(log=False)
+    def put(self, source_path):
+        """Store a file; returns (stored_path, created) where created is False for a duplicate"""
+        target = self.path_for(file_sha256(source_path), Path(source_path).suffix)
+        if target.exists():
+            return target, False
+
+        self.directory.mkdir(parents=True, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(prefix='.blob.', suffix='.tmp', dir=self.directory)
+        os.close(fd)
+        os.remove(tmp_path)
+        try:
+            if not _reflink(source_path, tmp_path):
+                linked = False
+                if self.use_links and self.contains(source_path):
+                    try:
+                        os.link(source_path, tmp_path)
+                        linked = True
+                    except OSError:
+                        pass  # Different filesystem, or links not supported
+                if not linked:
+                    shutil.copy2(source_path, tmp_path)
+            try:
+                # Fails instead of overwriting if the same content was stored concurrently
+                os.link(tmp_path, target)
+                created = True
+            except FileExistsError:
+                created = False
+            except OSError:
+                os.replace(tmp_path, target)
+                created = True
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        if created:
+            count('bytes_stored', target.stat().st_size)
+        return target, created
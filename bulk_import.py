@@ -0,0 +1,206 @@
+"""Attach evidence images listed in a manifest, without the GUI.
+
+The manifest is a CSV file with a header, or a JSONL file, with the fields
+item_id, type (node/edge), image_path, source_url and label. Relative image
+paths are resolved against the manifest's directory.
+
+Images are validated, stored, thumbnailed and resized for the web view in
+a process pool. Finished images are recorded in a checkpoint file next to
+the manifest, so an interrupted import resumes where it stopped. All
+evidence is then added through DataManager with one write per table.
+Evidence an item already has is skipped, so running the same manifest
+twice is harmless.
+
+    python bulk_import.py drop.csv
+    python bulk_import.py drop.jsonl --db evidence.db --workers 8
+"""
+import os
+import sys
+import csv
+import json
+import time
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+from PIL import Image
+
+from blob_store import BlobStore
+from data_manager import DataManager, THUMBNAIL_SIZE, WEB_IMAGES_URL, evidence_paths
+from storage import SqliteBackend
+from graph_bundle import refresh_bundle
+from thumbnails import ThumbnailCache, THUMBNAIL_DIRNAME
+from web_images import WebImages, WEB_IMAGES_DIRNAME
+
+CHECKPOINT_SUFFIX = '.checkpoint'  # Checkpoint file is "<manifest>.checkpoint"
+PROGRESS_INTERVAL = 1.0  # Seconds between progress lines
+
+# Per-process stores, set up by _init_worker
+_blobs = None
+_thumbnails = None
+_web_images = None
+
+
+def read_manifest(path):
+    """Read manifest entries from a CSV or JSONL file"""
+    base = Path(path).parent
+    with open(path, 'r', newline='', encoding='utf-8') as f:
+        if Path(path).suffix.lower() in ('.jsonl', '.ndjson'):
+            records = [json.loads(line) for line in f if line.strip()]
+        else:
+            records = list(csv.DictReader(f))
+
+    entries = []
+    for record in records:
+        image_path = Path(record.get('image_path') or '')
+        if not image_path.is_absolute():
+            image_path = base / image_path
+        entries.append({
+            'item_id': (record.get('item_id') or '').strip(),
+            'type': (record.get('type') or '').strip().lower(),
+            'image_path': str(image_path),
+            'source_url': record.get('source_url') or '',
+            'label': record.get('label') or record.get('source_label') or '',
+        })
+    return entries
+
+
+def _init_worker(images_dir):
+    global _blobs, _thumbnails, _web_images
+    _blobs = BlobStore(images_dir)
+    _thumbnails = ThumbnailCache(Path(images_dir) / THUMBNAIL_DIRNAME)
+    _web_images = WebImages(Path(images_dir) / WEB_IMAGES_DIRNAME, WEB_IMAGES_URL)
+
+
+def prepare_image(image_path):
+    """Validate, store, thumbnail and resize one image (runs in a worker process).
+
+    Returns (image_path, stored_path, web variants, error).
+    """
+    try:
+        with Image.open(image_path) as img:
+            img.verify()
+        stored_path, _ = _blobs.put(image_path)
+        _thumbnails.generate(stored_path, THUMBNAIL_SIZE, digest=stored_path.stem)
+        variants = _web_images.generate(stored_path)
+        return image_path, stored_path.as_posix(), variants, None
+    except Exception as e:
+        return image_path, None, None, f"{type(e).__name__}: {e}"
+
+
+def load_checkpoint(path):
+    """(stored path, web variants) of images prepared by an earlier, interrupted run"""
+    prepared = {}
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    continue  # Interrupted write
+                if os.path.exists(record['stored_path']):
+                    prepared[record['image_path']] = (record['stored_path'], record.get('variants'))
+    except FileNotFoundError:
+        pass
+    return prepared
+
+
+def run_import(manifest_path, data_manager, workers=None, checkpoint_path=None, progress=True):
+    """Import a manifest; returns a summary dict"""
+    checkpoint_path = checkpoint_path or f"{manifest_path}{CHECKPOINT_SUFFIX}"
+    entries = read_manifest(manifest_path)
+    errors = []
+
+    # Skip entries that cannot be attached before doing any image work
+    valid = []
+    for line, entry in enumerate(entries, start=1):
+        if entry['type'] not in ('node', 'edge'):
+            errors.append({'line': line, 'error': f"Unknown type {entry['type']!r}"})
+        elif entry['item_id'] not in data_manager.get_table(entry['type']):
+            errors.append({'line': line, 'error': f"Unknown {entry['type']} {entry['item_id']!r}"})
+        else:
+            valid.append((line, entry))
+
+    prepared = load_checkpoint(checkpoint_path)
+    pending = sorted({entry['image_path'] for _, entry in valid} - set(prepared))
+    image_errors = {}
+
+    started = last_report = time.monotonic()
+    with open(checkpoint_path, 'a', encoding='utf-8') as checkpoint, \
+            ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                initargs=(str(data_manager.images_dir),)) as executor:
+        if checkpoint.tell():
+            checkpoint.write('\n')  # Ends a line cut short by the interruption; load_checkpoint skips it
+        for done, (image_path, stored_path, variants, error) in enumerate(
+                executor.map(prepare_image, pending, chunksize=8), start=1):
+            if error:
+                image_errors[image_path] = error
+            else:
+                prepared[image_path] = (stored_path, variants)
+                checkpoint.write(json.dumps({'image_path': image_path, 'stored_path': stored_path,
+                                             'variants': variants}) + '\n')
+                checkpoint.flush()
+            now = time.monotonic()
+            if progress and (now - last_report >= PROGRESS_INTERVAL or done == len(pending)):
+                last_report = now
+                rate = done / max(now - started, 1e-9)
+                print(f"Prepared {done}/{len(pending)} images ({rate:.1f}/s, {len(image_errors)} failed)",
+                      file=sys.stderr)
+
+    # Group the evidence per item, keeping manifest order
+    evidence_by_type = {'node': {}, 'edge': {}}
+    for line, entry in valid:
+        if entry['image_path'] in image_errors:
+            errors.append({'line': line, 'error': image_errors[entry['image_path']]})
+            continue
+        evidence_by_type[entry['type']].setdefault(entry['item_id'], []).append({
+            **evidence_paths(*prepared[entry['image_path']]),
+            "sourceUrl": entry['source_url'],
+            "sourceLabel": entry['label'],
+        })
+
+    requested = sum(len(evidence) for by_item in evidence_by_type.values() for evidence in by_item.values())
+    added = 0
+    for item_type, evidence_by_item in evidence_by_type.items():
+        if not evidence_by_item:
+            continue
+        count = data_manager.add_stored_evidence(item_type, evidence_by_item)
+        if count is None:
+            raise RuntimeError(f"Failed to write {item_type} evidence; rerun to resume from the checkpoint")
+        added += count
+
+    if not data_manager.compact():
+        raise RuntimeError("Failed to write the CSV files")
+    refresh_bundle(data_manager)
+    os.remove(checkpoint_path)
+
+    return {
+        'entries': len(entries),
+        'added': added,
+        'skipped': requested - added,
+        'errors': errors,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Attach evidence images listed in a CSV or JSONL manifest")
+    parser.add_argument('manifest', help="Manifest with item_id, type, image_path, source_url and label")
+    parser.add_argument('--db', help="Use this SQLite database instead of the CSV files")
+    parser.add_argument('--workers', type=int, default=None, help="Worker processes (default: CPU count)")
+    parser.add_argument('--checkpoint', help=f"Checkpoint file (default: <manifest>{CHECKPOINT_SUFFIX})")
+    parser.add_argument('--quiet', action='store_true', help="Don't print progress")
+    args = parser.parse_args()
+
+    backend = SqliteBackend.from_csv(args.db) if args.db else None
+    data_manager = DataManager(backend=backend)
+    summary = run_import(args.manifest, data_manager, args.workers, args.checkpoint, not args.quiet)
+
+    for error in summary['errors']:
+        print(f"Line {error['line']}: {error['error']}", file=sys.stderr)
+    print(f"Added {summary['added']} evidence entries; "
+          f"{summary['skipped']} already present, {len(summary['errors'])} failed")
+    sys.exit(1 if summary['errors'] else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,472 @@
+import os
+import json
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from repository import Record, normalize_evidence_json, decode_evidence, evidence_key
+from storage import CsvBackend
+from blob_store import BlobStore
+from graph_index import GraphIndex
+from instrumentation import timed, report_error
+from thumbnails import ThumbnailCache, THUMBNAIL_DIRNAME, THUMBNAIL_MAX_BYTES
+from web_images import WebImages, WEB_IMAGES_DIRNAME
+
+IMAGES_SUBDIR = "images"  # Subdirectory name for images
+WEB_IMAGES_URL = f"/public/{IMAGES_SUBDIR}/{WEB_IMAGES_DIRNAME}"  # Web URL of the resized variants
+THUMBNAIL_SIZE = (600, 400)  # Max width/height of evidence images in the evidence panel
+FILE_IO_WORKERS = 8  # Threads used to copy or delete evidence files in batch operations
+
+def evidence_paths(stored_path, variants=None):
+    """Web URL and local path of an image in the images directory, plus its resized web variants"""
+    stored_path = Path(stored_path)
+    # Store both the web URL and file path - use forward slashes for consistency
+    paths = {
+        "evidenceUrl": f"/public/{IMAGES_SUBDIR}/{stored_path.name}",  # Web URL path
+        "localPath": stored_path.as_posix(),  # Local file path with forward slashes
+    }
+    if variants:
+        paths["variants"] = variants  # [{"url", "width", "height"}], smallest first, for srcset
+    return paths
+
+class DataManager:
+    def __init__(self, thumbnail_max_bytes=THUMBNAIL_MAX_BYTES, backend=None):
+        # Nothing is read or created here: the directories are made when the first image is
+        # stored and the tables are loaded on first use, so opening the data is instant
+        self.public_dir = Path('public')
+        self.images_dir = self.public_dir / IMAGES_SUBDIR
+
+        # Evidence images are stored once, named by their content hash
+        self.blobs = BlobStore(self.images_dir)
+
+        # Pre-scaled copies of evidence images for the evidence panel
+        self.thumbnails = ThumbnailCache(self.images_dir / THUMBNAIL_DIRNAME, thumbnail_max_bytes)
+
+        # Resized, metadata-free WebP copies the web view picks from with srcset
+        self.web_images = WebImages(self.images_dir / WEB_IMAGES_DIRNAME, WEB_IMAGES_URL)
+
+        # Thumbnails and web variants of new images are made on a background thread,
+        # so adding evidence never waits for an image to be decoded or encoded
+        self._image_worker = None  # Created on first use
+        
+        self.nodes_csv = 'Nodes.csv'
+        self.edges_csv = 'Edges.csv'
+
+        # Storage for nodes and edges. The default keeps them in the CSV files as cached,
+        # ID-indexed tables whose edits go to an append-only journal; SqliteBackend keeps
+        # them in a database and exports the CSV files for the web view
+        self.backend = backend if backend is not None else CsvBackend(self.nodes_csv, self.edges_csv)
+        self.tables = self.backend.tables
+
+        # Callbacks run as listener(item_type, items) after every successful save,
+        # e.g. to re-export the web bundle or update the search index
+        self.change_listeners = []
+
+        # Which edges touch which nodes; built on the first graph query
+        self.graph = GraphIndex(self)
+
+        # Number of evidence entries referencing each image file, kept in step with our own writes
+        self._references = None
+        self._reference_versions = None
+        self._write_lock = threading.RLock()  # Writes also come from the image worker
+
+    def get_table(self, item_type):
+        """Get the cached table for the specified type"""
+        return self.tables['node' if item_type == 'node' else 'edge']
+
+    @timed
+    def get_items(self, item_type, fields=None):
+        """Get all items of specified type, as dicts with only the given fields if fields is set"""
+        if fields is None:
+            return self.get_table(item_type).all()
+        return [{name: record.get(name, '') for name in fields}
+                for record in self.get_table(item_type).records(fields)]
+
+    @timed
+    def iter_items(self, item_type, fields=None):
+        """All items of specified type as shared, read-only Records (no copies are made).
+
+        fields lets backends that can skip columns read only those.
+        """
+        return self.get_table(item_type).records(fields)
+
+    def stream_items(self, item_type, fields=None):
+        """Yield the items of specified type from storage without caching them"""
+        return self.get_table(item_type).stream(fields)
+
+    @timed
+    def get_item(self, item_id, item_type):
+        """Get specific item by ID and type"""
+        return self.get_table(item_type).get(item_id)
+
+    @timed
+    def update_item(self, item, item_type, base=None):
+        """Update item basic information.
+
+        Pass the item as it was read before editing as base to have changes
+        someone else saved since then merged in rather than overwritten (see
+        update_items).
+        """
+        return self.update_items([item], item_type, None if base is None else [base])
+
+    @timed
+    def update_items(self, items, item_type, base=None):
+        """Update several items of one type in a single write.
+
+        base, if given, holds each item as get_item returned it before it was
+        edited (or None to overwrite that one). Other fields and evidence saved
+        meanwhile by another editor or process are merged in, and the items are
+        updated in place to the merged rows. If both sides changed the same
+        field differently ConflictError is raised and nothing is written.
+        """
+        # Ensure evidence data is properly formatted before saving
+        for item in items:
+            item['EvidenceData'] = normalize_evidence_json(item.get('EvidenceData'))
+        table = self.get_table(item_type)
+        with self._write_lock:
+            previous = [table.get(item['ID']) for item in items]
+            versions = self.table_versions()
+            if not table.replace_many(items, base):
+                return False
+
+            # Adjust the reference counts instead of recounting everything, unless
+            # someone else changed the tables in the meantime
+            new_versions = self.table_versions()
+            if (None not in previous and self._reference_versions == versions
+                    and sum(new_versions) == sum(versions) + 1):
+                for old_item, item in zip(previous, items):
+                    self._references.subtract(self._evidence_files(old_item))
+                    self._references.update(self._evidence_files(item))
+                self._reference_versions = new_versions
+
+        for listener in self.change_listeners:
+            listener(item_type, items)
+        return True
+
+    @timed
+    def compact(self):
+        """Bring the CSV files up to date with all saved changes"""
+        try:
+            self.backend.compact()
+            return True
+        except Exception as e:
+            report_error(f"Error writing {self.nodes_csv}/{self.edges_csv}: {e}")
+            return False
+
+    @timed
+    def export_csv(self, nodes_csv=None, edges_csv=None):
+        """Write the nodes and edges to CSV files in the layout js/main.js reads"""
+        try:
+            self.backend.export_csv(nodes_csv or self.nodes_csv, edges_csv or self.edges_csv)
+            return True
+        except Exception as e:
+            report_error(f"Error exporting CSV files: {e}")
+            return False
+
+    def _load_evidence(self, item):
+        """Parse an item's evidence list"""
+        if isinstance(item, Record):
+            return item.evidence
+        return decode_evidence(item.get('EvidenceData'))
+
+    def _evidence_file(self, evidence):
+        """Normalised local path of an evidence entry's image, used as its reference key"""
+        image_path = evidence.get('localPath')
+        if not image_path:  # Fall back to old path format for compatibility
+            image_path = evidence.get('evidenceUrl', '').lstrip('/')
+        return Path(os.path.abspath(image_path)).as_posix() if image_path else None
+
+    def _evidence_files(self, item):
+        """Image files referenced by an item's evidence"""
+        return [path for path in map(self._evidence_file, self._load_evidence(item)) if path]
+
+    def table_versions(self):
+        """Version of each table, which changes whenever its rows do"""
+        for table in self.tables.values():
+            table.refresh()
+        return tuple(table.version for table in self.tables.values())
+
+    @timed
+    def evidence_references(self):
+        """Count the evidence entries referencing each image file across all nodes and edges"""
+        with self._write_lock:
+            versions = self.table_versions()
+            if self._reference_versions != versions:
+                references = Counter()
+                for item_type in self.tables:
+                    for item in self.iter_items(item_type, ['EvidenceData']):
+                        references.update(self._evidence_files(item))
+                self._references = references
+                self._reference_versions = versions
+            return self._references
+
+    @timed(log=False)
+    def _copy_image(self, image_path):
+        """Store an image in the images directory and return its evidence paths"""
+        # Identical images share one file named by its content hash. If the image was
+        # stored before, its web variants are usually there already (a header read)
+        stored_path, created = self.blobs.put(image_path)
+        variants = None if created else self.web_images.variants(stored_path)
+        return evidence_paths(stored_path, variants), created
+
+    def _queue_images(self, new_images, missing_variants, items):
+        """Have the background worker make the thumbnails of new images and the missing web variants.
+
+        items are the (item type, item ID) of the rows whose evidence shows the images.
+        """
+        if self._image_worker is None:
+            self._image_worker = ThreadPoolExecutor(max_workers=1, thread_name_prefix="image-worker")
+        self._image_worker.submit(self._create_images, sorted(set(new_images)), sorted(set(missing_variants)),
+                                  list(items))
+
+    @timed(log=False)
+    def _create_images(self, new_images, missing_variants, items):
+        """Create thumbnails, then write web variants and add them to the evidence of items.
+
+        Runs on the image worker, after the evidence was saved.
+        """
+        for image_path in new_images:
+            self._create_thumbnail(image_path)
+        variants_by_path = {}
+        for stored_path in missing_variants:
+            variants = self._create_web_images(stored_path)
+            if variants:
+                variants_by_path[self._evidence_file({'localPath': stored_path})] = variants
+        if variants_by_path and self.set_web_variants(variants_by_path, items) is None:
+            report_error("Error recording web images; optimize_images.py can add them")
+
+    def wait_for_images(self):
+        """Block until the thumbnails and web variants queued so far are done"""
+        if self._image_worker is not None:
+            # One worker runs the jobs in order, so this one finishes last
+            self._image_worker.submit(lambda: None).result()
+
+    @timed(log=False)
+    def _create_web_images(self, stored_path):
+        """Write the resized web variants of a stored image; returns their evidence entries"""
+        try:
+            return self.web_images.generate(stored_path)
+        except Exception as e:
+            # Not fatal, the web view falls back to the original and optimize_images.py can retry
+            report_error(f"Error creating web images for {stored_path}: {e}")
+            return None
+
+    @timed(log=False)
+    def _create_thumbnail(self, image_path):
+        """Pre-generate the evidence panel thumbnail for an image"""
+        try:
+            self.thumbnails.generate(image_path, THUMBNAIL_SIZE)
+        except Exception as e:
+            # Not fatal, the thumbnail is created on first view instead
+            report_error(f"Error creating thumbnail for {image_path}: {e}")
+
+    @timed(log=False)
+    def _remove_files(self, paths):
+        """Delete image files concurrently, ignoring failures"""
+        def remove(path):
+            self.thumbnails.invalidate(path)
+            self.web_images.remove(path)
+            try:
+                os.remove(Path(path))
+            except Exception as e:
+                report_error(f"Error removing image file: {e}")
+
+        with ThreadPoolExecutor(max_workers=FILE_IO_WORKERS) as executor:
+            list(executor.map(remove, paths))
+
+    @timed
+    def add_evidence(self, item_id, item_type, image_path, source_url=None, source_label=None):
+        """Add evidence to an item"""
+        return self.add_evidence_many(item_id, item_type, [(image_path, source_url, source_label)])
+
+    @timed
+    def add_evidence_many(self, item_id, item_type, entries):
+        """Add several (image_path, source_url, source_label) evidence entries in one write"""
+        entries = list(entries)
+        if not entries or not all(os.path.exists(image_path) for image_path, _, _ in entries):
+            return False
+
+        item = self.get_item(item_id, item_type)
+        if not item:
+            return False
+        base = dict(item)
+
+        # Copy all images concurrently
+        with ThreadPoolExecutor(max_workers=FILE_IO_WORKERS) as executor:
+            futures = [executor.submit(self._copy_image, image_path) for image_path, _, _ in entries]
+        copied, created, failed = [], [], False
+        for future in futures:
+            try:
+                paths, is_new = future.result()
+            except Exception as e:
+                report_error(f"Error copying image: {e}")
+                failed = True
+                continue
+            copied.append(paths)
+            if is_new:
+                created.append(paths['localPath'])
+        if failed:
+            self._remove_files(created)
+            return False
+
+        evidence_data = self._load_evidence(item)
+        for paths, (_, source_url, source_label) in zip(copied, entries):
+            evidence_data.append({
+                **paths,
+                "sourceUrl": source_url if source_url else "",
+                "sourceLabel": source_label if source_label else ""
+            })
+        item['EvidenceData'] = json.dumps(evidence_data)
+
+        # Evidence another editor adds while the images are copied is merged, not lost
+        if self.update_item(item, item_type, base):
+            missing_variants = [paths['localPath'] for paths in copied if 'variants' not in paths]
+            if created or missing_variants:
+                self._queue_images(created, missing_variants, [(item_type, item_id)])
+            return True
+        # Don't leave orphaned copies behind if the write failed. Someone else may have stored
+        # the same image meanwhile, so only remove files nothing references
+        references = self.evidence_references()
+        self._remove_files([path for path in set(created)
+                            if not references[self._evidence_file({'localPath': path})]])
+        return False
+
+    @timed
+    def add_stored_evidence(self, item_type, evidence_by_item):
+        """Append evidence for images already in the images directory to many items in one write.
+
+        evidence_by_item maps item IDs to lists of evidence dicts. Entries an item
+        already has are skipped, so re-running an import does not duplicate them.
+        Returns the number of evidence entries added, or None if the write failed.
+        """
+        items, base, added = [], [], 0
+        for item_id, new_evidence in evidence_by_item.items():
+            item = self.get_item(item_id, item_type)
+            if not item:
+                return None
+            original = dict(item)
+            evidence_data = self._load_evidence(item)
+            existing = {evidence_key(evidence) for evidence in evidence_data}
+            count = len(evidence_data)
+            for evidence in new_evidence:
+                key = evidence_key(evidence)
+                if key not in existing:
+                    existing.add(key)
+                    evidence_data.append(evidence)
+            if len(evidence_data) > count:
+                added += len(evidence_data) - count
+                item['EvidenceData'] = json.dumps(evidence_data)
+                items.append(item)
+                base.append(original)
+        if items and not self.update_items(items, item_type, base):
+            return None
+        return added
+
+    @timed
+    def set_web_variants(self, variants_by_path, items=None):
+        """Record resized web variants on every evidence entry showing one of the images.
+
+        variants_by_path maps absolute image paths (as in evidence_references) to
+        their variant entries. items limits the rows looked at to these (item type,
+        item ID) pairs; by default every row is. Returns the number of evidence
+        entries changed, or None if a write failed.
+        """
+        changed = 0
+        for item_type in self.tables:
+            if items is None:
+                item_ids = [record['ID'] for record in self.iter_items(item_type, ['ID', 'EvidenceData'])
+                            if any(self._evidence_file(evidence) in variants_by_path for evidence in record.evidence)]
+            else:
+                item_ids = list(dict.fromkeys(item_id for row_type, item_id in items if row_type == item_type))
+            updated_items, base = [], []
+            for item_id in item_ids:
+                item = self.get_item(item_id, item_type)
+                if not item:
+                    continue
+                original = dict(item)
+                evidence_data = self._load_evidence(item)
+                updated = 0
+                for evidence in evidence_data:
+                    variants = variants_by_path.get(self._evidence_file(evidence))
+                    if variants is not None and evidence.get('variants') != variants:
+                        evidence['variants'] = variants
+                        updated += 1
+                if updated:
+                    item['EvidenceData'] = json.dumps(evidence_data)
+                    updated_items.append(item)
+                    base.append(original)
+                    changed += updated
+            if updated_items and not self.update_items(updated_items, item_type, base):
+                return None
+        return changed
+
+    @timed
+    def remove_evidence(self, item_id, item_type, evidence_index):
+        """Remove evidence from an item"""
+        return self.remove_evidence_many(item_id, item_type, [evidence_index])
+
+    @timed
+    def remove_evidence_many(self, item_id, item_type, evidence_indices, base=None):
+        """Remove several evidence entries from an item in one write.
+
+        The indices refer to the evidence of base, the item as the caller read
+        it, if given, so entries another editor added or removed since do not
+        shift them; otherwise to the item as stored now.
+        """
+        item = dict(base) if base is not None else self.get_item(item_id, item_type)
+        if not item:
+            return False
+        base = dict(item)
+
+        try:
+            evidence_data = self._load_evidence(item)
+            indices = set(evidence_indices)
+            if not indices or not all(0 <= idx < len(evidence_data) for idx in indices):
+                return False
+
+            removed = [evidence_data[idx] for idx in sorted(indices)]
+            item['EvidenceData'] = json.dumps(
+                [evidence for idx, evidence in enumerate(evidence_data) if idx not in indices])
+            if not self.update_item(item, item_type, base):
+                return False
+
+            # Remove image files once no item references them any more
+            references = self.evidence_references()
+            self._remove_files({path for path in map(self._evidence_file, removed)
+                                if path and not references[path]})
+            return True
+
+        except Exception as e:
+            report_error(f"Error removing evidence: {e}")
+
+        return False
+
+    @timed
+    def collect_garbage(self, dry_run=False):
+        """Delete image files in the images directory that no evidence entry references.
+
+        Returns the list of orphaned files (deleted unless dry_run).
+        """
+        if not self.images_dir.is_dir():
+            return []  # No image has been stored yet
+        references = self.evidence_references()
+        orphans = []
+        for entry in os.scandir(self.images_dir):
+            # Skip the thumbnail cache and temporary files
+            if entry.name.startswith('.') or not entry.is_file():
+                continue
+            path = Path(os.path.abspath(entry.path)).as_posix()
+            if not references[path]:
+                orphans.append(path)
+        if not dry_run:
+            self._remove_files(orphans)
+        # Web variants left behind by a source file deleted some other way
+        stale_variants = self.web_images.orphans(self.images_dir)
+        if not dry_run:
+            for path in stale_variants:
+                try:
+                    os.remove(path)
+                except OSError as e:
+                    report_error(f"Error removing image file: {e}")
+        return orphans + stale_variants
@@ -1,29 +1,65 @@
 import os
-import shutil
-import csv
-import json
-import uuid
+import argparse
+import time
+import queue
 import webbrowser
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 import tkinter as tk
 from tkinter import ttk, filedialog, messagebox
-from PIL import Image, ImageTk
+
+from data_manager import DataManager, THUMBNAIL_SIZE
+from storage import SqliteBackend
+from repository import ConflictError, decode_evidence
+from graph_bundle import GraphBundleExporter
+from search_index import SearchIndex
+from instrumentation import timed, count, report_error
 
 # Add these constants at the top
-WEB_URL_BASE = "http://localhost:8000"  # Base URL for web display
-IMAGES_SUBDIR = "images"  # Subdirectory name for images
+WINDOW_TITLE = "Network Evidence Manager"
+DATA_LOADER_POLL_MS = 50  # How often the Tk main thread checks whether the data has been loaded
+WEB_URL_BASE = "http://localhost:8000"  # Base URL for web display, as served by web_server.py
+EVIDENCE_ROW_HEIGHT = 480  # Fixed row height of the virtualized evidence list (image + checkbox + link)
+VIRTUAL_LIST_THRESHOLD = 20  # Evidence lists longer than this are virtualized
+VIRTUAL_LIST_OVERSCAN = 2  # Rows kept built above and below the viewport
+IMAGE_LOADER_WORKERS = 4  # Threads decoding evidence images for the evidence panel
+IMAGE_LOADER_POLL_MS = 15  # How often the Tk main thread checks for decoded images
+IMAGE_LOADER_FRAME_BUDGET = 0.008  # Seconds of main-thread work per poll, about half a frame
+SEARCH_DELAY_MS = 100  # Typing pause before the search box queries the index
+SEARCH_MIN_CHARS = 2  # Shorter queries match most items and are not worth showing
+SEARCH_RESULTS = 10  # Matches listed under the search box
 
 class EvidenceManagerGUI:
-    def __init__(self, root):
+    def __init__(self, root, db_path=None):
         self.root = root
-        self.root.title("Network Evidence Manager")
+        self.root.title(WINDOW_TITLE)
         self.root.geometry("1000x800")  # Made window larger to accommodate images
         
         # Store image references to prevent garbage collection
         self.image_refs = {}
-        
-        # Initialize data manager
-        self.data_manager = DataManager()
+
+        # Decodes evidence images off the Tk main thread
+        self.image_loader = ImageLoader(root, self.load_thumbnail)
+
+        # Evidence list state, kept apart from the widgets so rows can be recycled
+        self.evidence_data = []
+        self.selected_evidence = set()
+        self.evidence_labels = {}  # evidence index -> image label currently showing it
+        self.image_errors = {}
+        self.loading_images = set()
+        self.virtual_mode = False
+        self.virtual_rows = []  # Pooled row frames of the virtualized list
+        self.virtual_bound = {}  # evidence index -> pooled row showing it
+        
+        # The data is opened on a worker thread once the window is up; see load_data
+        self.data_manager = None
+        self.bundle_exporter = None
+        self.search_index = None
+        self.data_loader = ThreadPoolExecutor(max_workers=1, thread_name_prefix="data-loader")
+        self.data_controls = []  # Widgets that stay disabled until the data is loaded
+        self.search_job = None
+        self.search_results = []
+        self.item_values = {}  # item type -> (table versions, item combobox values)
         
         # Create main container with padding
         self.main_frame = ttk.Frame(root, padding="10")
@@ -46,30 +82,53 @@ class EvidenceManagerGUI:
         
         # Initialize variables
         self.current_item = None
+        self.item_base = None
         self.current_type = None
         
-        # Load initial data
-        self.refresh_data()
+        # Load the data in the background, so the window shows at once
+        self.start_loading(db_path)
+
+        # Flush pending edits into the CSV files before exiting
+        self.root.protocol("WM_DELETE_WINDOW", self.on_close)
 
     def setup_top_panel(self):
         """Setup the top panel with item selection and basic info"""
+        # Search box; matches are listed underneath while typing
+        ttk.Label(self.top_frame, text="Search:").grid(row=0, column=0, sticky=tk.W, pady=5)
+        self.search_var = tk.StringVar()
+        self.search_entry = ttk.Entry(self.top_frame, textvariable=self.search_var)
+        self.search_entry.grid(row=0, column=1, sticky=(tk.W, tk.E), pady=5)
+        self.data_controls.append(self.search_entry)
+        self.search_var.trace_add('write', self.on_search_changed)
+        self.search_entry.bind('<Down>', lambda e: self.focus_search_results())
+        self.search_entry.bind('<Return>', lambda e: self.open_search_result(0))
+        self.search_entry.bind('<Escape>', lambda e: self.search_var.set(''))
+        self.search_list = tk.Listbox(self.top_frame, height=SEARCH_RESULTS, activestyle='dotbox')
+        self.search_list.grid(row=1, column=1, sticky=(tk.W, tk.E))
+        self.search_list.grid_remove()
+        self.search_list.bind('<Double-Button-1>', lambda e: self.open_search_result())
+        self.search_list.bind('<Return>', lambda e: self.open_search_result())
+        self.search_list.bind('<Escape>', lambda e: self.search_var.set(''))
+
         # Item type selection
-        ttk.Label(self.top_frame, text="Select Type:").grid(row=0, column=0, sticky=tk.W, pady=5)
+        ttk.Label(self.top_frame, text="Select Type:").grid(row=2, column=0, sticky=tk.W, pady=5)
         self.type_var = tk.StringVar()
         type_combo = ttk.Combobox(self.top_frame, textvariable=self.type_var, values=['Node', 'Edge'])
-        type_combo.grid(row=0, column=1, sticky=(tk.W, tk.E), pady=5)
+        type_combo.grid(row=2, column=1, sticky=(tk.W, tk.E), pady=5)
         type_combo.bind('<<ComboboxSelected>>', self.on_type_selected)
+        self.data_controls.append(type_combo)
         
         # Item selection
-        ttk.Label(self.top_frame, text="Select Item:").grid(row=1, column=0, sticky=tk.W, pady=5)
+        ttk.Label(self.top_frame, text="Select Item:").grid(row=3, column=0, sticky=tk.W, pady=5)
         self.item_var = tk.StringVar()
         self.item_combo = ttk.Combobox(self.top_frame, textvariable=self.item_var)
-        self.item_combo.grid(row=1, column=1, sticky=(tk.W, tk.E), pady=5)
+        self.item_combo.grid(row=3, column=1, sticky=(tk.W, tk.E), pady=5)
         self.item_combo.bind('<<ComboboxSelected>>', self.on_item_selected)
+        self.data_controls.append(self.item_combo)
         
         # Basic info frame
         info_frame = ttk.LabelFrame(self.top_frame, text="Basic Information", padding="5")
-        info_frame.grid(row=2, column=0, columnspan=2, sticky=(tk.W, tk.E, tk.N, tk.S), pady=10)
+        info_frame.grid(row=4, column=0, columnspan=2, sticky=(tk.W, tk.E, tk.N, tk.S), pady=10)
         
         # ID
         ttk.Label(info_frame, text="ID:").grid(row=0, column=0, sticky=tk.W)
@@ -108,9 +167,10 @@ class EvidenceManagerGUI:
         # Create canvas and scrollbar for evidence
         self.evidence_canvas = tk.Canvas(evidence_frame)
         scrollbar = ttk.Scrollbar(evidence_frame, orient="vertical", command=self.evidence_canvas.yview)
+        self.evidence_scrollbar = scrollbar
         
-        # Configure canvas
-        self.evidence_canvas.configure(yscrollcommand=scrollbar.set)
+        # Configure canvas; scrolling also updates which rows of a virtualized list exist
+        self.evidence_canvas.configure(yscrollcommand=self.on_evidence_scroll)
         
         # Create frame inside canvas for evidence items
         self.evidence_list_frame = ttk.Frame(self.evidence_canvas)
@@ -131,28 +191,144 @@ class EvidenceManagerGUI:
         button_frame.pack(side="bottom", fill="x", pady=10)
         
         ttk.Button(button_frame, text="Add Evidence", command=self.add_evidence).pack(side=tk.LEFT, padx=5)
+        ttk.Button(button_frame, text="Add Multiple...", command=self.add_multiple_evidence).pack(side=tk.LEFT, padx=5)
         ttk.Button(button_frame, text="Remove Selected", command=self.remove_evidence).pack(side=tk.LEFT, padx=5)
+        cleanup_button = ttk.Button(button_frame, text="Clean Up Images", command=self.collect_garbage)
+        cleanup_button.pack(side=tk.RIGHT, padx=5)
+        self.data_controls.append(cleanup_button)
 
     def on_frame_configure(self, event=None):
         """Reset the scroll region to encompass the inner frame"""
+        if self.virtual_mode:
+            return  # The virtualized list sets its own scroll region
         self.evidence_canvas.configure(scrollregion=self.evidence_canvas.bbox("all"))
 
     def on_canvas_configure(self, event):
         """When canvas is resized, resize the inner frame to match"""
         width = event.width
         self.evidence_canvas.itemconfig(self.canvas_frame, width=width)
+        if self.virtual_mode:
+            self.evidence_canvas.configure(
+                scrollregion=(0, 0, width, len(self.evidence_data) * EVIDENCE_ROW_HEIGHT))
+            for row in self.virtual_rows:
+                self.evidence_canvas.itemconfig(row.window_id, width=width)
+            self.update_virtual_rows()
+
+    def on_evidence_scroll(self, first, last):
+        """Keep the scrollbar in sync and build rows that scrolled into view"""
+        self.evidence_scrollbar.set(first, last)
+        if self.virtual_mode:
+            self.update_virtual_rows()
+
+    def start_loading(self, db_path):
+        """Open the data on the loader thread and enable the controls once it is ready"""
+        for widget in self.data_controls:
+            widget.configure(state='disabled')
+        self.root.title(f"{WINDOW_TITLE} - loading...")
+        self.load_future = self.data_loader.submit(self.load_data, db_path)
+        self.root.after(DATA_LOADER_POLL_MS, self.on_data_loaded)
+
+    @timed
+    def load_data(self, db_path):
+        """Open the data and read what the first selection and search need (runs on the loader thread)"""
+        backend = SqliteBackend.from_csv(db_path) if db_path else None
+        data_manager = DataManager(backend=backend)
+
+        # Keep the web view's pre-parsed bundle in step with saved changes
+        bundle_exporter = GraphBundleExporter(data_manager)
+        data_manager.change_listeners.append(lambda item_type, items: bundle_exporter.schedule())
+
+        # Type-ahead search over all nodes and edges, updated as items are saved.
+        # Building it reads both tables, so item lists and lookups are fast afterwards
+        search_index = SearchIndex(data_manager)
+        search_index.rebuild()
+        return data_manager, bundle_exporter, search_index
+
+    def on_data_loaded(self):
+        """Take over the loaded data on the main thread, or check again shortly"""
+        if not self.load_future.done():
+            self.root.after(DATA_LOADER_POLL_MS, self.on_data_loaded)
+            return
+        try:
+            self.data_manager, self.bundle_exporter, self.search_index = self.load_future.result()
+        except Exception as e:
+            report_error(f"Error loading data: {e}")
+            messagebox.showerror("Error", f"Failed to load the data: {e}")
+            self.root.destroy()
+            return
+        self.root.title(WINDOW_TITLE)
+        for widget in self.data_controls:
+            widget.configure(state='normal')
+        self.refresh_data()
 
     def refresh_data(self):
         """Refresh the data in the UI"""
         if self.type_var.get():
-            items = self.data_manager.get_items(self.type_var.get().lower())
-            self.item_combo['values'] = [f"{item['ID']} - {item['Label']}" for item in items]
+            item_type = self.type_var.get().lower()
+            # Rebuilding the list is only needed when the table changed since it was built
+            versions = self.data_manager.table_versions()
+            cached = self.item_values.get(item_type)
+            if cached is None or cached[0] != versions:
+                items = self.data_manager.iter_items(item_type, ['ID', 'Label'])
+                cached = self.item_values[item_type] = (versions, [f"{item['ID']} - {item['Label']}" for item in items])
+            self.item_combo['values'] = cached[1]
+
+    def on_search_changed(self, *args):
+        """Search again once typing pauses"""
+        if self.search_job is not None:
+            self.root.after_cancel(self.search_job)
+        self.search_job = self.root.after(SEARCH_DELAY_MS, self.update_search_results)
+
+    @timed
+    def update_search_results(self):
+        """List the best matches for the search box, limited to the selected type if there is one"""
+        self.search_job = None
+        query = self.search_var.get().strip()
+        item_type = self.type_var.get().lower() or None
+        self.search_results = (self.search_index.search(query, item_type, SEARCH_RESULTS)
+                               if len(query) >= SEARCH_MIN_CHARS else [])
+        self.search_list.delete(0, tk.END)
+        for result_type, item_id, label in self.search_results:
+            self.search_list.insert(tk.END, f"{result_type.title()}: {item_id} - {label}")
+        if self.search_results:
+            self.search_list.configure(height=len(self.search_results))
+            self.search_list.grid()
+        else:
+            self.search_list.grid_remove()
+
+    def focus_search_results(self):
+        """Move from the search box into the result list"""
+        if self.search_results:
+            self.search_list.focus_set()
+            self.search_list.selection_clear(0, tk.END)
+            self.search_list.selection_set(0)
+            self.search_list.activate(0)
+
+    def open_search_result(self, index=None):
+        """Select the chosen search result as the current item"""
+        if index is None:
+            selection = self.search_list.curselection()
+            index = selection[0] if selection else 0
+        if self.search_job is not None:
+            # Enter pressed before the pending search ran
+            self.root.after_cancel(self.search_job)
+            self.update_search_results()
+        if index >= len(self.search_results):
+            return
+        item_type, item_id, label = self.search_results[index]
+        if self.type_var.get().lower() != item_type:
+            self.type_var.set(item_type.title())
+            self.refresh_data()
+        self.item_var.set(f"{item_id} - {label}")
+        self.search_var.set('')
+        self.on_item_selected(None)
 
     def on_type_selected(self, event):
         """Handle type selection"""
         self.refresh_data()
         self.clear_item_info()
 
+    @timed
     def on_item_selected(self, event):
         """Handle item selection"""
         if not self.item_var.get():
@@ -161,6 +337,8 @@ class EvidenceManagerGUI:
         item_id = self.item_var.get().split(' - ')[0]
         self.current_type = self.type_var.get().lower()
         self.current_item = self.data_manager.get_item(item_id, self.current_type)
+        # The item as loaded, so saves merge with edits other curators made meanwhile
+        self.item_base = dict(self.current_item) if self.current_item else None
         
         if self.current_item:
             # Update basic info
@@ -172,86 +350,203 @@ class EvidenceManagerGUI:
             # Update evidence list
             self.refresh_evidence_list()
 
+    @timed
     def refresh_evidence_list(self):
         """Refresh the evidence list with images and source links"""
-        # Clear existing evidence items and image references
+        # Drop image loads still pending for the previously shown item
+        self.image_loader.cancel_all()
+
+        # Clear existing evidence items, image references and selection
         for widget in self.evidence_list_frame.winfo_children():
             widget.destroy()
         self.image_refs.clear()
+        self.image_errors.clear()
+        self.evidence_labels.clear()
+        self.loading_images.clear()
+        self.selected_evidence.clear()
+        self.clear_virtual_rows()
+        self.evidence_data = []
             
         if not self.current_item:
             return
             
-        evidence_data = []
-        if self.current_item.get('EvidenceData'):
-            try:
-                evidence_data = json.loads(self.current_item['EvidenceData'])
-            except json.JSONDecodeError:
-                evidence_data = []
+        self.evidence_data = decode_evidence(self.current_item.get('EvidenceData'))
+
+        # Long lists only get widgets for the rows in or near the viewport
+        if len(self.evidence_data) > VIRTUAL_LIST_THRESHOLD:
+            self.show_virtual_rows()
+            return
+
+        self.evidence_canvas.itemconfig(self.canvas_frame, state='normal')
                 
         # Create evidence items
-        for idx, evidence in enumerate(evidence_data):
+        for idx, evidence in enumerate(self.evidence_data):
             # Create frame for this evidence item
             item_frame = ttk.Frame(self.evidence_list_frame)
             item_frame.pack(fill=tk.X, padx=5, pady=10)
-            
-            # Selection checkbox (top right)
-            var = tk.BooleanVar()
-            check = ttk.Checkbutton(item_frame, variable=var)
-            check.pack(side=tk.TOP, anchor=tk.E)
-            
-            # Store reference to checkbox variable
-            item_frame.evidence_idx = idx
-            item_frame.selected = var
-            
-            # Load and display image using local path
-            image_path = evidence.get('localPath')
-            if not image_path:  # Fall back to old path format for compatibility
-                image_path = evidence.get('evidenceUrl', '')
-                if image_path.startswith('/'):
-                    image_path = image_path.lstrip('/')
-                image_path = Path(image_path)
-
-            if image_path and os.path.exists(image_path):
-                try:
-                    # Open and resize image
-                    img = Image.open(image_path)
-                    
-                    # Calculate new size maintaining aspect ratio
-                    display_width = 600  # Reduced max width for better display
-                    display_height = 400  # Reduced max height for better display
-                    
-                    # Calculate resize ratio
-                    ratio = min(display_width/img.width, display_height/img.height)
-                    new_size = (int(img.width * ratio), int(img.height * ratio))
-                    img = img.resize(new_size, Image.Resampling.LANCZOS)
-                    
-                    # Convert to PhotoImage
-                    photo = ImageTk.PhotoImage(img)
-                    self.image_refs[idx] = photo  # Keep reference
-                    
-                    # Create and pack label with image
-                    img_label = ttk.Label(item_frame, image=photo)
-                    img_label.pack(pady=5)
-                    
-                    # Add source link if available
-                    if evidence.get('sourceUrl'):
-                        source_label = evidence.get('sourceLabel', 'Source')
-                        source_link = ttk.Label(item_frame, text=source_label, 
-                                              foreground="blue", cursor="hand2")
-                        source_link.pack(pady=5)
-                        source_link.bind("<Button-1>", 
-                                       lambda e, url=evidence['sourceUrl']: webbrowser.open(url))
-                    
-                except Exception as e:
-                    print(f"Error loading image {image_path}: {e}")
-                    ttk.Label(item_frame, text=f"Error loading image: {e}").pack()
-            else:
-                ttk.Label(item_frame, text=f"Image not found: {image_path}").pack()
+            self.build_evidence_row(item_frame)
+            self.bind_evidence_row(item_frame, idx)
             
             # Add separator
             ttk.Separator(self.evidence_list_frame, orient='horizontal').pack(fill=tk.X, pady=5)
 
+    @timed(log=False)
+    def build_evidence_row(self, item_frame):
+        """Create the widgets of one evidence row; bind_evidence_row fills them in"""
+        count('evidence_rows_built')
+        # Selection checkbox (top right); the selection itself lives in self.selected_evidence
+        item_frame.selected = tk.BooleanVar()
+        check = ttk.Checkbutton(item_frame, variable=item_frame.selected,
+                                command=lambda: self.on_evidence_checked(item_frame))
+        check.pack(side=tk.TOP, anchor=tk.E)
+        item_frame.evidence_idx = None
+
+        # Image, or a placeholder until the image has been decoded in the background
+        item_frame.img_label = ttk.Label(item_frame)
+        item_frame.img_label.pack(pady=5)
+
+        # Source link, only shown if the evidence has a source URL
+        item_frame.source_link = ttk.Label(item_frame, foreground="blue", cursor="hand2")
+        item_frame.source_link.bind("<Button-1>", lambda e: self.open_source(item_frame))
+
+    def bind_evidence_row(self, item_frame, idx):
+        """Show evidence entry idx in a (possibly recycled) row"""
+        evidence = self.evidence_data[idx]
+        item_frame.evidence_idx = idx
+        item_frame.selected.set(idx in self.selected_evidence)
+        self.evidence_labels[idx] = item_frame.img_label
+
+        # Load and display image using local path
+        image_path = self.evidence_image_path(evidence)
+        if idx in self.image_refs:
+            item_frame.img_label.configure(image=self.image_refs[idx], text='')
+        else:
+            item_frame.img_label.configure(image='', text=self.image_errors.get(idx, "Loading image..."))
+            if idx not in self.image_errors and idx not in self.loading_images:
+                self.loading_images.add(idx)
+                self.image_loader.submit(
+                    idx, image_path,
+                    lambda idx, img, error, path=image_path: self.on_image_loaded(idx, img, error, path))
+
+        # Add source link if available
+        if evidence.get('sourceUrl'):
+            item_frame.source_link.configure(text=evidence.get('sourceLabel', 'Source'))
+            item_frame.source_link.pack(pady=5)
+        else:
+            item_frame.source_link.pack_forget()
+
+    def evidence_image_path(self, evidence):
+        """Local file path of an evidence image"""
+        image_path = evidence.get('localPath')
+        if not image_path:  # Fall back to old path format for compatibility
+            image_path = evidence.get('evidenceUrl', '')
+            if image_path.startswith('/'):
+                image_path = image_path.lstrip('/')
+            image_path = Path(image_path)
+        return image_path
+
+    def on_evidence_checked(self, item_frame):
+        """Record a checkbox change in the selection model"""
+        if item_frame.evidence_idx is None:
+            return
+        if item_frame.selected.get():
+            self.selected_evidence.add(item_frame.evidence_idx)
+        else:
+            self.selected_evidence.discard(item_frame.evidence_idx)
+
+    def open_source(self, item_frame):
+        """Open the source URL of the evidence shown in a row"""
+        if item_frame.evidence_idx is not None:
+            url = self.evidence_data[item_frame.evidence_idx].get('sourceUrl')
+            if url:
+                webbrowser.open(url)
+
+    def show_virtual_rows(self):
+        """Switch the evidence canvas to the virtualized list"""
+        self.virtual_mode = True
+        self.evidence_canvas.itemconfig(self.canvas_frame, state='hidden')
+        self.evidence_canvas.configure(
+            scrollregion=(0, 0, self.evidence_canvas.winfo_width(), len(self.evidence_data) * EVIDENCE_ROW_HEIGHT))
+        self.evidence_canvas.yview_moveto(0)
+        self.update_virtual_rows()
+
+    @timed(log=False)
+    def update_virtual_rows(self):
+        """Bind pooled rows to the entries in or near the viewport and recycle the rest"""
+        top = self.evidence_canvas.canvasy(0)
+        bottom = top + self.evidence_canvas.winfo_height()
+        first = max(0, int(top // EVIDENCE_ROW_HEIGHT) - VIRTUAL_LIST_OVERSCAN)
+        last = min(len(self.evidence_data), int(bottom // EVIDENCE_ROW_HEIGHT) + 1 + VIRTUAL_LIST_OVERSCAN)
+        wanted = range(first, last)
+
+        # Release rows that moved out of range, along with their images
+        for idx, row in list(self.virtual_bound.items()):
+            if idx not in wanted:
+                self.evidence_canvas.itemconfig(row.window_id, state='hidden')
+                row.evidence_idx = None
+                del self.virtual_bound[idx]
+                self.evidence_labels.pop(idx, None)
+                self.image_refs.pop(idx, None)
+                if idx in self.loading_images and self.image_loader.cancel(idx):
+                    self.loading_images.discard(idx)
+
+        free_rows = [row for row in self.virtual_rows if row.evidence_idx is None]
+        for idx in wanted:
+            if idx in self.virtual_bound:
+                continue
+            if free_rows:
+                row = free_rows.pop()
+            else:
+                row = ttk.Frame(self.evidence_canvas, padding=(5, 10))
+                self.build_evidence_row(row)
+                ttk.Separator(row, orient='horizontal').pack(side=tk.BOTTOM, fill=tk.X)
+                row.window_id = self.evidence_canvas.create_window(
+                    0, 0, window=row, anchor="nw",
+                    width=self.evidence_canvas.winfo_width(), height=EVIDENCE_ROW_HEIGHT)
+                self.virtual_rows.append(row)
+            self.bind_evidence_row(row, idx)
+            self.evidence_canvas.coords(row.window_id, 0, idx * EVIDENCE_ROW_HEIGHT)
+            self.evidence_canvas.itemconfig(row.window_id, state='normal')
+            self.virtual_bound[idx] = row
+
+    def clear_virtual_rows(self):
+        """Leave virtualized mode and destroy its pooled rows"""
+        for row in self.virtual_rows:
+            self.evidence_canvas.delete(row.window_id)
+            row.destroy()
+        self.virtual_rows = []
+        self.virtual_bound = {}
+        self.virtual_mode = False
+
+    @timed(log=False)
+    def load_thumbnail(self, image_path):
+        """Decode the evidence panel image for a file (runs on a worker thread)"""
+        if not image_path or not os.path.exists(image_path):
+            raise FileNotFoundError(image_path)
+        return self.data_manager.thumbnails.load(image_path, THUMBNAIL_SIZE)
+
+    @timed(log=False)
+    def on_image_loaded(self, idx, img, error, image_path):
+        """Show a decoded evidence image in its placeholder label"""
+        self.loading_images.discard(idx)
+        img_label = self.evidence_labels.get(idx)
+        if img_label is None:
+            return  # The row scrolled out of view while loading
+        if isinstance(error, FileNotFoundError):
+            self.image_errors[idx] = f"Image not found: {image_path}"
+            img_label.configure(text=self.image_errors[idx])
+        elif error is not None:
+            report_error(f"Error loading image {image_path}: {error}")
+            self.image_errors[idx] = f"Error loading image: {error}"
+            img_label.configure(text=self.image_errors[idx])
+        else:
+            # Convert to PhotoImage; PIL's Tk support is only loaded once an image is shown
+            from PIL import ImageTk
+            photo = ImageTk.PhotoImage(img)
+            self.image_refs[idx] = photo  # Keep reference
+            img_label.configure(image=photo, text='')
+
+    @timed
     def add_evidence(self):
         """Add new evidence"""
         if not self.current_item:
@@ -287,31 +582,69 @@ class EvidenceManagerGUI:
             else:
                 messagebox.showerror("Error", "Failed to add evidence")
 
+    @timed
+    def add_multiple_evidence(self):
+        """Add several evidence images in one go"""
+        if not self.current_item:
+            messagebox.showwarning("Warning", "Please select an item first")
+            return
+
+        file_paths = filedialog.askopenfilenames(
+            title="Select Evidence Images",
+            filetypes=[("Image files", "*.png *.jpg *.jpeg *.gif *.bmp")]
+        )
+
+        if not file_paths:
+            return
+
+        # Get source information for each file
+        dialog = MultiSourceDialog(self.root, file_paths)
+        if dialog.result:
+            success = self.data_manager.add_evidence_many(
+                self.current_item['ID'],
+                self.current_type,
+                dialog.result
+            )
+
+            if success:
+                self.refresh_data()
+                self.on_item_selected(None)
+                messagebox.showinfo("Success", f"{len(dialog.result)} evidence item(s) added successfully")
+            else:
+                messagebox.showerror("Error", "Failed to add evidence")
+
+    @timed
     def remove_evidence(self):
         """Remove selected evidence items"""
-        to_remove = []
-        
         # Collect selected evidence indices
-        for frame in self.evidence_list_frame.winfo_children():
-            if hasattr(frame, 'selected') and frame.selected.get():
-                to_remove.append(frame.evidence_idx)
+        to_remove = sorted(self.selected_evidence)
                 
         if not to_remove:
             messagebox.showwarning("Warning", "Please select evidence to remove")
             return
             
         if messagebox.askyesno("Confirm", f"Are you sure you want to remove {len(to_remove)} evidence item(s)?"):
-            # Remove in reverse order to maintain correct indices
-            for idx in sorted(to_remove, reverse=True):
-                if self.data_manager.remove_evidence(self.current_item['ID'], self.current_type, idx):
-                    continue
-                else:
-                    messagebox.showerror("Error", f"Failed to remove evidence {idx + 1}")
-                    
-            self.refresh_data()
-            self.on_item_selected(None)
-            messagebox.showinfo("Success", "Evidence removed successfully")
+            if self.data_manager.remove_evidence_many(self.current_item['ID'], self.current_type, to_remove,
+                                                      self.item_base):
+                self.refresh_data()
+                self.on_item_selected(None)
+                messagebox.showinfo("Success", "Evidence removed successfully")
+            else:
+                messagebox.showerror("Error", "Failed to remove evidence")
+
+    @timed
+    def collect_garbage(self):
+        """Delete image files that no evidence references"""
+        orphans = self.data_manager.collect_garbage(dry_run=True)
+        if not orphans:
+            messagebox.showinfo("Clean Up Images", "No unused images found")
+            return
 
+        if messagebox.askyesno("Confirm", f"Delete {len(orphans)} image file(s) that no evidence references?"):
+            self.data_manager.collect_garbage()
+            messagebox.showinfo("Success", f"Removed {len(orphans)} unused image file(s)")
+
+    @timed
     def save_changes(self):
         """Save changes to basic information"""
         if not self.current_item:
@@ -319,184 +652,134 @@ class EvidenceManagerGUI:
             
         self.current_item['Label'] = self.label_var.get()
         self.current_item['Details'] = self.details_text.get('1.0', tk.END).strip()
-        
-        if self.data_manager.update_item(self.current_item, self.current_type):
+
+        try:
+            saved = self.data_manager.update_item(self.current_item, self.current_type, self.item_base)
+        except ConflictError as e:
+            if not messagebox.askyesno(
+                    "Conflicting Changes",
+                    f"{e}.\n\nKeep your version of {', '.join(e.fields)}? Choose No to discard your "
+                    f"changes and load theirs."):
+                self.on_item_selected(None)
+                return
+            # Treat their values as the starting point, so ours win for those fields only
+            stored = self.data_manager.get_item(self.current_item['ID'], self.current_type) or {}
+            base = dict(self.item_base, **{name: stored.get(name, '') for name in e.fields})
+            try:
+                saved = self.data_manager.update_item(self.current_item, self.current_type, base)
+            except ConflictError as e:
+                saved = False
+                report_error(f"Error saving changes: {e}")
+
+        if saved:
             messagebox.showinfo("Success", "Changes saved successfully")
             self.refresh_data()
+            # Show what was saved, including anything merged from other curators
+            self.on_item_selected(None)
         else:
             messagebox.showerror("Error", "Failed to save changes")
 
+    def on_close(self):
+        """Compact the data files and close the window"""
+        self.image_loader.shutdown()
+        self.data_loader.shutdown(wait=False, cancel_futures=True)
+        if self.data_manager is None:
+            self.root.destroy()  # Closed while loading; nothing has been edited
+            return
+        # Looks closed straight away; web variants still being encoded are recorded before the compaction
+        self.root.withdraw()
+        self.data_manager.wait_for_images()
+        if not self.data_manager.compact():
+            messagebox.showerror("Error", "Failed to write pending changes to the CSV files")
+        try:
+            self.bundle_exporter.flush()
+        except Exception as e:
+            messagebox.showerror("Error", f"Failed to export {self.bundle_exporter.path}: {e}")
+        self.root.destroy()
+
     def clear_item_info(self):
         """Clear item information"""
         self.id_var.set('')
         self.label_var.set('')
         self.details_text.delete('1.0', tk.END)
-        self.evidence_list_frame.winfo_children()
         self.current_item = None
+        self.item_base = None
+        self.refresh_evidence_list()  # Destroys the rows and drops pending image loads
 
-class DataManager:
-    def __init__(self):
-        self.public_dir = Path('public')
-        self.public_dir.mkdir(exist_ok=True)
-        
-        self.images_dir = self.public_dir / IMAGES_SUBDIR
-        self.images_dir.mkdir(exist_ok=True)
-        
-        self.nodes_csv = 'Nodes.csv'
-        self.edges_csv = 'Edges.csv'
-
-    def get_items(self, item_type):
-        """Get all items of specified type"""
-        csv_file = self.nodes_csv if item_type == 'node' else self.edges_csv
-        items = []
-        
-        try:
-            with open(csv_file, 'r', newline='', encoding='utf-8') as f:
-                reader = csv.DictReader(f)
-                items = list(reader)
-                
-                # Ensure consistent evidence data format
-                for item in items:
-                    if not item.get('EvidenceData'):
-                        item['EvidenceData'] = '[]'
-                    try:
-                        # Validate JSON format and normalize paths
-                        evidence = json.loads(item['EvidenceData'])
-                        if not isinstance(evidence, list):
-                            item['EvidenceData'] = '[]'
-                        else:
-                            # Ensure all evidence uses forward slashes
-                            for e in evidence:
-                                if 'localPath' in e:
-                                    e['localPath'] = e['localPath'].replace('\\', '/')
-                            item['EvidenceData'] = json.dumps(evidence)
-                    except json.JSONDecodeError:
-                        item['EvidenceData'] = '[]'
-                        
-        except Exception as e:
-            print(f"Error reading {csv_file}: {e}")
-            
-        return items
-
-    def get_item(self, item_id, item_type):
-        """Get specific item by ID and type"""
-        items = self.get_items(item_type)
-        for item in items:
-            if item['ID'] == item_id:
-                return item
-        return None
-
-    def update_item(self, item, item_type):
-        """Update item basic information"""
-        csv_file = self.nodes_csv if item_type == 'node' else self.edges_csv
-        items = self.get_items(item_type)
-        
-        updated = False
-        for idx, existing_item in enumerate(items):
-            if existing_item['ID'] == item['ID']:
-                # Ensure evidence data is properly formatted before saving
-                if not item.get('EvidenceData'):
-                    item['EvidenceData'] = '[]'
-                try:
-                    # Validate JSON format
-                    evidence = json.loads(item['EvidenceData'])
-                    if not isinstance(evidence, list):
-                        item['EvidenceData'] = '[]'
-                except json.JSONDecodeError:
-                    item['EvidenceData'] = '[]'
-                    
-                items[idx] = item
-                updated = True
-                break
-                
-        if updated:
-            try:
-                with open(csv_file, 'w', newline='', encoding='utf-8') as f:
-                    writer = csv.DictWriter(f, fieldnames=items[0].keys())
-                    writer.writeheader()
-                    writer.writerows(items)
-                return True
-            except Exception as e:
-                print(f"Error updating {csv_file}: {e}")
-                
-        return False
-
-    def add_evidence(self, item_id, item_type, image_path, source_url=None, source_label=None):
-        """Add evidence to an item"""
-        if not os.path.exists(image_path):
-            return False
+class ImageLoader:
+    """Run image loads on a worker pool and deliver results on the Tk main thread.
 
-        # Generate unique filename and copy image
-        image_ext = Path(image_path).suffix
-        new_filename = f"{uuid.uuid4()}{image_ext}"
-        new_image_path = self.images_dir / new_filename
+    Workers put finished results on a queue which the main thread drains with
+    root.after, handling only as many results per tick as fit in one frame.
+    cancel_all() drops every load that has not been delivered yet.
+    """
 
+    def __init__(self, root, load_func, workers=IMAGE_LOADER_WORKERS):
+        self.root = root
+        self.load_func = load_func
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="image-loader")
+        self.results = queue.Queue()
+        self.generation = 0
+        self.futures = {}
+        self.pending = 0
+        self.poll_id = None
+
+    def submit(self, key, path, callback):
+        """Load path in the background and call callback(key, image, error) on the main thread"""
+        generation = self.generation
+        self.futures[key] = self.executor.submit(self._run, generation, key, path, callback)
+        self.pending += 1
+        if self.poll_id is None:
+            self.poll_id = self.root.after(IMAGE_LOADER_POLL_MS, self._poll)
+
+    def _run(self, generation, key, path, callback):
+        if generation != self.generation:
+            return  # Cancelled before it started
         try:
-            shutil.copy2(image_path, new_image_path)
+            result, error = self.load_func(path), None
         except Exception as e:
-            print(f"Error copying image: {e}")
-            return False
-
-        # Store both the web URL and file path - use forward slashes for consistency
-        evidence_data = {
-            "evidenceUrl": f"/public/{IMAGES_SUBDIR}/{new_filename}",  # Web URL path
-            "localPath": str(new_image_path).replace('\\', '/'),  # Local file path with forward slashes
-            "sourceUrl": source_url if source_url else "",
-            "sourceLabel": source_label if source_label else ""
-        }
-
-        # Update item
-        item = self.get_item(item_id, item_type)
-        if not item:
-            return False
-
-        try:
-            existing_evidence = json.loads(item.get('EvidenceData', '[]'))
-            if not isinstance(existing_evidence, list):
-                existing_evidence = []
-            
-            # Ensure all existing evidence uses forward slashes
-            for evidence in existing_evidence:
-                if 'localPath' in evidence:
-                    evidence['localPath'] = evidence['localPath'].replace('\\', '/')
-                
-        except json.JSONDecodeError:
-            existing_evidence = []
-
-        existing_evidence.append(evidence_data)
-        item['EvidenceData'] = json.dumps(existing_evidence)
-
-        return self.update_item(item, item_type)
+            result, error = None, e
+        self.results.put((generation, key, result, error, callback))
 
-    def remove_evidence(self, item_id, item_type, evidence_index):
-        """Remove evidence from an item"""
-        item = self.get_item(item_id, item_type)
-        if not item:
+    def _poll(self):
+        self.poll_id = None
+        deadline = time.perf_counter() + IMAGE_LOADER_FRAME_BUDGET
+        while time.perf_counter() < deadline:
+            try:
+                generation, key, result, error, callback = self.results.get_nowait()
+            except queue.Empty:
+                break
+            if generation != self.generation:
+                continue
+            self.futures.pop(key, None)
+            self.pending -= 1
+            callback(key, result, error)
+        if self.pending > 0:
+            self.poll_id = self.root.after(IMAGE_LOADER_POLL_MS, self._poll)
+
+    def cancel(self, key):
+        """Cancel a load that has not started yet; returns True if it was cancelled"""
+        future = self.futures.get(key)
+        if future is None or not future.cancel():
             return False
-
-        try:
-            evidence_data = json.loads(item.get('EvidenceData', '[]'))
-            if not isinstance(evidence_data, list):
-                evidence_data = []
-
-            if 0 <= evidence_index < len(evidence_data):
-                # Remove image file if it exists
-                image_path = evidence_data[evidence_index].get('localPath', '')
-                if image_path:
-                    try:
-                        os.remove(Path(image_path))
-                    except Exception as e:
-                        print(f"Error removing image file: {e}")
-
-                # Remove evidence from list
-                evidence_data.pop(evidence_index)
-                item['EvidenceData'] = json.dumps(evidence_data)
-                return self.update_item(item, item_type)
-
-        except Exception as e:
-            print(f"Error removing evidence: {e}")
-
-        return False
+        del self.futures[key]
+        self.pending -= 1
+        return True
+
+    def cancel_all(self):
+        """Discard all outstanding loads"""
+        self.generation += 1
+        for future in self.futures.values():
+            future.cancel()
+        self.futures = {}
+        self.pending = 0
+        if self.poll_id is not None:
+            self.root.after_cancel(self.poll_id)
+            self.poll_id = None
+
+    def shutdown(self):
+        self.cancel_all()
+        self.executor.shutdown(wait=False, cancel_futures=True)
 
 class SourceDialog:
     def __init__(self, parent):
@@ -538,9 +821,85 @@ class SourceDialog:
     def cancel(self):
         self.dialog.destroy()
 
+class MultiSourceDialog:
+    """Collect source information for several evidence files at once"""
+    def __init__(self, parent, file_paths):
+        self.result = None
+        self.file_paths = list(file_paths)
+
+        # Create dialog
+        self.dialog = tk.Toplevel(parent)
+        self.dialog.title("Add Source Information")
+        self.dialog.transient(parent)
+        self.dialog.grab_set()
+
+        # Defaults used for any file whose own fields are left blank
+        defaults_frame = ttk.LabelFrame(self.dialog, text="Defaults (used when a row is left blank)", padding="5")
+        defaults_frame.grid(row=0, column=0, sticky=(tk.W, tk.E), pady=5, padx=5)
+        ttk.Label(defaults_frame, text="Source URL:").grid(row=0, column=0, pady=2, padx=5)
+        self.default_url_var = tk.StringVar()
+        ttk.Entry(defaults_frame, textvariable=self.default_url_var, width=40).grid(row=0, column=1, pady=2, padx=5)
+        ttk.Label(defaults_frame, text="Source Label:").grid(row=1, column=0, pady=2, padx=5)
+        self.default_label_var = tk.StringVar()
+        ttk.Entry(defaults_frame, textvariable=self.default_label_var, width=40).grid(row=1, column=1, pady=2, padx=5)
+
+        # One row per file, inside a scrollable canvas
+        files_frame = ttk.LabelFrame(self.dialog, text="Files", padding="5")
+        files_frame.grid(row=1, column=0, sticky=(tk.W, tk.E, tk.N, tk.S), pady=5, padx=5)
+        canvas = tk.Canvas(files_frame, height=min(300, 30 * len(self.file_paths) + 30), width=700)
+        scrollbar = ttk.Scrollbar(files_frame, orient="vertical", command=canvas.yview)
+        canvas.configure(yscrollcommand=scrollbar.set)
+        rows_frame = ttk.Frame(canvas)
+        rows_frame.bind("<Configure>", lambda e: canvas.configure(scrollregion=canvas.bbox("all")))
+        canvas.create_window((0, 0), window=rows_frame, anchor="nw")
+        scrollbar.pack(side="right", fill="y")
+        canvas.pack(side="left", fill="both", expand=True)
+
+        ttk.Label(rows_frame, text="File").grid(row=0, column=0, sticky=tk.W, padx=5)
+        ttk.Label(rows_frame, text="Source URL").grid(row=0, column=1, sticky=tk.W, padx=5)
+        ttk.Label(rows_frame, text="Source Label").grid(row=0, column=2, sticky=tk.W, padx=5)
+        self.row_vars = []
+        for row, file_path in enumerate(self.file_paths, start=1):
+            ttk.Label(rows_frame, text=Path(file_path).name).grid(row=row, column=0, sticky=tk.W, padx=5, pady=2)
+            url_var = tk.StringVar()
+            label_var = tk.StringVar()
+            ttk.Entry(rows_frame, textvariable=url_var, width=35).grid(row=row, column=1, padx=5, pady=2)
+            ttk.Entry(rows_frame, textvariable=label_var, width=25).grid(row=row, column=2, padx=5, pady=2)
+            self.row_vars.append((url_var, label_var))
+
+        # Buttons
+        button_frame = ttk.Frame(self.dialog)
+        button_frame.grid(row=2, column=0, pady=10)
+
+        ttk.Button(button_frame, text="OK", command=self.ok).grid(row=0, column=0, padx=5)
+        ttk.Button(button_frame, text="Cancel", command=self.cancel).grid(row=0, column=1, padx=5)
+
+        # Center dialog
+        self.dialog.geometry("+%d+%d" % (parent.winfo_rootx() + 50,
+                                        parent.winfo_rooty() + 50))
+
+        self.dialog.wait_window()
+
+    def ok(self):
+        default_url = self.default_url_var.get()
+        default_label = self.default_label_var.get()
+        self.result = [
+            (file_path, url_var.get() or default_url, label_var.get() or default_label)
+            for file_path, (url_var, label_var) in zip(self.file_paths, self.row_vars)
+        ]
+        self.dialog.destroy()
+
+    def cancel(self):
+        self.dialog.destroy()
+
 def main():
+    parser = argparse.ArgumentParser(description="Edit evidence for the network nodes and edges")
+    parser.add_argument('--db', help="Use this SQLite database instead of the CSV files "
+                                     "(created from Nodes.csv/Edges.csv if new); the CSVs are exported on exit")
+    args = parser.parse_args()
+
     root = tk.Tk()
-    app = EvidenceManagerGUI(root)
+    app = EvidenceManagerGUI(root, db_path=args.db)
     root.mainloop()
 
 if __name__ == "__main__":
@@ -0,0 +1,101 @@
+import os
+import time
+import threading
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+LOCK_SUFFIX = '.lock'  # The lock for "Nodes.csv" is taken on "Nodes.csv.lock"
+LOCK_TIMEOUT = 30.0  # Seconds to wait for another process before giving up
+LOCK_POLL_INTERVAL = 0.02
+
+_locks = {}
+_locks_guard = threading.Lock()
+
+
+class LockTimeout(Exception):
+    """Another process held the lock for longer than the timeout"""
+
+
+def file_lock(path):
+    """The process-wide FileLock for path, so every user in this process shares one"""
+    key = os.path.abspath(path)
+    with _locks_guard:
+        lock = _locks.get(key)
+        if lock is None:
+            lock = _locks[key] = FileLock(key)
+        return lock
+
+
+class FileLock:
+    """Exclusive advisory lock shared between processes, held on a companion file.
+
+    Only writers take it; readers rely on atomic renames and append-only
+    journals and never wait. Within a process the lock is re-entrant for
+    the thread holding it and excludes other threads, so use file_lock()
+    rather than several instances for the same path.
+    """
+
+    def __init__(self, path, timeout=LOCK_TIMEOUT):
+        self.path = f"{path}{LOCK_SUFFIX}"
+        self.timeout = timeout
+        self._thread_lock = threading.RLock()
+        self._depth = 0
+        self._fd = None
+
+    def _try_lock(self, fd):
+        try:
+            if fcntl is not None:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            else:
+                msvcrt.locking(fd, msvcrt.LK_NBLCK, 1)
+            return True
+        except OSError:
+            return False
+
+    def _unlock(self, fd):
+        if fcntl is not None:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+        else:
+            os.lseek(fd, 0, os.SEEK_SET)
+            msvcrt.locking(fd, msvcrt.LK_UNLCK, 1)
+
+    def acquire(self):
+        deadline = time.monotonic() + self.timeout
+        if not self._thread_lock.acquire(timeout=self.timeout):
+            raise LockTimeout(f"Timed out waiting for {self.path}")
+        if self._depth:
+            self._depth += 1
+            return
+        try:
+            fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o666)
+            while not self._try_lock(fd):
+                if time.monotonic() >= deadline:
+                    os.close(fd)
+                    raise LockTimeout(f"Timed out waiting for {self.path}; another editor is saving")
+                time.sleep(LOCK_POLL_INTERVAL)
+        except BaseException:
+            self._thread_lock.release()
+            raise
+        self._fd = fd
+        self._depth = 1
+
+    def release(self):
+        self._depth -= 1
+        if not self._depth:
+            fd, self._fd = self._fd, None
+            try:
+                self._unlock(fd)
+            finally:
+                os.close(fd)
+        self._thread_lock.release()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.release()
@@ -0,0 +1,369 @@
+"""Export the nodes and edges as one pre-parsed JSON bundle for the web view.
+
+js/main.js loads public/graph.json when it exists instead of downloading and
+parsing both CSV files. In the bundle, EvidenceData is already a list, image
+paths are normalised, and repeated values (types, edge endpoints, source
+labels) are stored once in a shared string table. The step-by-step paths
+of the clusters defined in js/main.js are precomputed from the edges, and,
+once graph_layout.py has laid the graph out, so are the node positions, so
+the web view can draw the graph without running physics first. The
+bundle carries a hash of its contents, which changes only when the data
+does, and the SHA-256 of each CSV file it was made from: the web view
+loads the CSV files instead when they no longer match, e.g. after a hand
+edit or a git pull. It compares them with the ETags web_server.py sends,
+which start with the same hash, so checking costs two HEAD requests. Gzip and, if the brotli package is installed, brotli
+copies are written next to it.
+
+    python graph_bundle.py
+    python graph_bundle.py --db evidence.db
+"""
+import os
+import re
+import gzip
+import json
+import hashlib
+import argparse
+import tempfile
+import threading
+from itertools import chain
+from pathlib import Path
+
+from data_manager import DataManager
+from storage import SqliteBackend
+from repository import Record, file_mode_for, decode_evidence
+from instrumentation import timed, count, report_error
+
+try:
+    import brotli
+except ImportError:  # Optional; only the gzip copy is written without it
+    brotli = None
+
+BUNDLE_PATH = 'public/graph.json'
+BUNDLE_FORMAT = 2
+BUNDLE_EXPORT_DELAY = 1.0  # Seconds of inactivity after a save before the bundle is rewritten
+CLUSTER_SCRIPT = 'js/main.js'  # Defines clusterConfigs, whose node lists the cluster paths follow
+
+# Fields whose values repeat a lot and are replaced by an index into the string table
+INTERNED_FIELDS = {
+    'nodes': ['Type'],
+    'edges': ['From', 'To', 'Label'],
+    'evidence': ['sourceUrl', 'sourceLabel'],
+}
+PATH_FIELDS = ['evidenceUrl', 'localPath']
+
+_HASH_PATTERN = re.compile(rb'"hash":"([0-9a-f]+)"')
+_CLUSTER_PATTERN = re.compile(r"""['"]?([\w-]+)['"]?\s*:\s*\{\s*nodes\s*:\s*\[([^\]]*)\]""")
+
+
+def _dumps(value):
+    return json.dumps(value, ensure_ascii=False, separators=(',', ':'))
+
+
+def normalize_web_path(path):
+    """Relative, forward-slash path as the web view requests it; URLs are left alone"""
+    if not path or path.startswith(('http://', 'https://')):
+        return path or ''
+    return path.replace('\\', '/').lstrip('/')
+
+
+def read_cluster_nodes(script_path=CLUSTER_SCRIPT):
+    """Node lists of the clusters in the web view's clusterConfigs, by cluster ID"""
+    try:
+        with open(script_path, 'r', encoding='utf-8') as f:
+            script = f.read()
+    except FileNotFoundError:
+        return {}
+    return {cluster_id: re.findall(r"""['"]([^'"]+)['"]""", nodes)
+            for cluster_id, nodes in _CLUSTER_PATTERN.findall(script)}
+
+
+def cluster_path(graph, nodes):
+    """Steps through a cluster as the web view walks it: each node, then the edge to the next one.
+
+    The last node links back to the first. Node pairs without an edge between them
+    are simply adjacent steps.
+    """
+    path = []
+    for i, node_id in enumerate(nodes):
+        path.append({'type': 'Node', 'id': node_id})
+        edge_id = graph.edge_between(node_id, nodes[(i + 1) % len(nodes)])
+        if edge_id is not None:
+            path.append({'type': 'Edge', 'id': edge_id})
+    return path
+
+
+def _write_atomic(path, data):
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(prefix=f".{os.path.basename(path)}.", suffix='.tmp', dir=directory)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.chmod(tmp_path, file_mode_for(path))
+        count('bytes_written', len(data))
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+class GraphBundleExporter:
+    """Write the web bundle for a DataManager, re-encoding only rows that changed.
+
+    Encoded rows are cached between exports as JSON templates with their
+    interned strings left out. The string table is rebuilt from the rows on
+    every export, in order of first use, so the same data always gives the
+    same bundle. Rows are only filled in again when the table changed, so an
+    export after a single edit encodes one row and joins the rest.
+    """
+
+    def __init__(self, data_manager, path=BUNDLE_PATH, delay=BUNDLE_EXPORT_DELAY, cluster_script=CLUSTER_SCRIPT,
+                 layout=None):
+        self.data_manager = data_manager
+        self.layout = layout  # GraphLayout, created by the first export
+        self._layout_missing = False
+        self.path = path
+        self.delay = delay
+        self.cluster_script = cluster_script
+        self._fragments = {}  # (section, ID) -> [row values, JSON template, interned strings, JSON, table generation]
+        self._strings = []
+        self._string_index = {}
+        self._generation = 0  # Incremented whenever the string table changes
+        self._positions_fragment = None  # (positions, encoded positions)
+        self._source_hashes = {}  # CSV path -> (file and journal signature, SHA-256)
+        self._timer = None
+        self._lock = threading.Lock()
+        self._hash = None
+
+    def _web_evidence(self, evidence_data):
+        """Evidence entries with web paths, and every interned field present"""
+        entries = []
+        for evidence in evidence_data:
+            evidence = dict(evidence)
+            for name in PATH_FIELDS:
+                if name in evidence:
+                    evidence[name] = normalize_web_path(evidence[name])
+            if 'variants' in evidence:
+                evidence['variants'] = [{**variant, 'url': normalize_web_path(variant.get('url'))}
+                                        for variant in evidence['variants']]
+            for name in INTERNED_FIELDS['evidence']:
+                evidence[name] = evidence.get(name) or ''
+            entries.append(evidence)
+        return entries
+
+    def _encode_row(self, section, item):
+        """A row as a %-template of its JSON and the interned strings whose table indices fill it in"""
+        chunks, strings, text = [], [], ['{']
+
+        def encode_object(obj, interned):
+            nonlocal text
+            for position, (name, value) in enumerate(obj.items()):
+                text.append(f"{',' if position else ''}{_dumps(name)}:")
+                if name in interned:
+                    chunks.append(''.join(text))
+                    text = []
+                    strings.append(value or '')
+                elif name == 'EvidenceData' and obj is item:
+                    text.append('[')
+                    evidence_data = item.evidence if isinstance(item, Record) else decode_evidence(value)
+                    for index, evidence in enumerate(self._web_evidence(evidence_data)):
+                        text.append(',{' if index else '{')
+                        encode_object(evidence, INTERNED_FIELDS['evidence'])
+                        text.append('}')
+                    text.append(']')
+                elif obj is item:
+                    text.append(_dumps((value or '').strip() if name == 'Details' else (value or '')))
+                else:
+                    text.append(_dumps(value))
+
+        encode_object(item, INTERNED_FIELDS[section])
+        text.append('}')
+        chunks.append(''.join(text))
+        return '%d'.join(chunk.replace('%', '%%') for chunk in chunks), tuple(strings)
+
+    def _encode_section(self, section, items):
+        """The cache entries of a section's rows, encoding the rows that changed"""
+        entries, seen = [], set()
+        for item in items:
+            key = (section, item['ID'])
+            values = tuple(item.items())
+            entry = self._fragments.get(key)
+            if entry is None or entry[0] != values:
+                entry = self._fragments[key] = [values, *self._encode_row(section, item), None, None]
+            entries.append(entry)
+            seen.add(key)
+        # Forget rows that no longer exist
+        if len(seen) != sum(1 for key in self._fragments if key[0] == section):
+            for key in [key for key in self._fragments if key[0] == section and key not in seen]:
+                del self._fragments[key]
+        return entries
+
+    def _update_strings(self, entries):
+        """Rebuild the string table from the rows, in order of first use"""
+        strings = list(dict.fromkeys(chain.from_iterable(entry[2] for entry in entries)))
+        if strings != self._strings:
+            self._strings = strings
+            self._string_index = {value: index for index, value in enumerate(strings)}
+            self._generation += 1
+
+    def _join(self, entries):
+        """JSON array of rows, filling in the string table indices of those encoded since it changed"""
+        index, generation = self._string_index, self._generation
+        for entry in entries:
+            if entry[4] != generation:
+                entry[3] = entry[1] % tuple(map(index.__getitem__, entry[2]))
+                entry[4] = generation
+        return '[' + ','.join(entry[3] for entry in entries) + ']'
+
+    def _sources(self):
+        """SHA-256 of each CSV file as the web view downloads it, by file name.
+
+        While edits are still in a table's journal that is the table as
+        web_server.py renders it, otherwise the file itself. Hashes are kept
+        while the file and journal are unchanged.
+        """
+        sources = {}
+        for item_type, path in (('node', self.data_manager.nodes_csv), ('edge', self.data_manager.edges_csv)):
+            table = self.data_manager.get_table(item_type)
+            journal_path = getattr(table, 'journal_path', None)  # Only CSV tables have one
+            try:
+                st = os.stat(path)
+            except FileNotFoundError:
+                continue
+            try:
+                journal_size = os.path.getsize(journal_path) if journal_path else 0
+            except FileNotFoundError:
+                journal_size = 0
+            signature = (st.st_mtime_ns, st.st_size, journal_size)
+            cached = self._source_hashes.get(path)
+            if cached is None or cached[0] != signature:
+                if journal_size:
+                    data = table.to_csv_bytes()
+                else:
+                    with open(path, 'rb') as f:
+                        data = f.read()
+                cached = self._source_hashes[path] = (signature, hashlib.sha256(data).hexdigest())
+            sources[os.path.basename(path)] = cached[1]
+        return sources
+
+    def _positions(self, cluster_nodes):
+        """Encoded node positions by ID, laid out again only where the graph changed.
+
+        Without a saved layout, or when too much changed, the last positions
+        are kept if they cover every node, and otherwise none are sent.
+        """
+        if self.layout is None and not self._layout_missing:
+            try:
+                # Imported here because NumPy takes longer to load than the rest of the data layer
+                from graph_layout import GraphLayout
+            except ImportError:  # NumPy is optional; without it the web view lays the graph out itself
+                self._layout_missing = True
+            else:
+                self.layout = GraphLayout()
+        if self.layout is None:
+            return '{}'
+        node_ids = [node['ID'] for node in self.data_manager.iter_items('node', ['ID'])]
+        edges = [(edge['From'], edge['To']) for edge in self.data_manager.iter_items('edge', ['From', 'To'])]
+        positions = self.layout.update(node_ids, edges, cluster_nodes, incremental_only=True)
+        if positions is None:
+            # A full layout blocks for seconds, e.g. the GUI on close; it is left to graph_layout.py
+            positions = self.layout.positions if all(node_id in self.layout.positions for node_id in node_ids) else {}
+        # The layout returns the same dict while nothing moved
+        if self._positions_fragment is None or self._positions_fragment[0] is not positions:
+            self._positions_fragment = (positions, _dumps(positions))
+        return self._positions_fragment[1]
+
+    def build(self):
+        """Return (hash, encoded bundle bytes)"""
+        sources = self._sources()
+        node_entries = self._encode_section('nodes', self.data_manager.iter_items('node'))
+        edge_entries = self._encode_section('edges', self.data_manager.iter_items('edge'))
+        self._update_strings(chain(node_entries, edge_entries))
+        nodes, edges = self._join(node_entries), self._join(edge_entries)
+        cluster_nodes = read_cluster_nodes(self.cluster_script)
+        clusters = {cluster_id: {'nodes': members, 'path': cluster_path(self.data_manager.graph, members)}
+                    for cluster_id, members in cluster_nodes.items()}
+        body = (
+            f'"sources":{_dumps(sources)},'
+            f'"strings":{_dumps(self._strings)},'
+            f'"interned":{_dumps(INTERNED_FIELDS)},'
+            f'"clusters":{_dumps(clusters)},'
+            f'"positions":{self._positions(cluster_nodes)},'
+            f'"nodes":{nodes},"edges":{edges}}}'
+        ).encode('utf-8')
+        digest = hashlib.sha256(body).hexdigest()
+        return digest, f'{{"format":{BUNDLE_FORMAT},"hash":"{digest}",'.encode('utf-8') + body
+
+    def _current_hash(self):
+        if self._hash is None:
+            try:
+                with open(self.path, 'rb') as f:
+                    match = _HASH_PATTERN.search(f.read(256))
+                self._hash = match.group(1).decode('ascii') if match else ''
+            except FileNotFoundError:
+                self._hash = ''
+        return self._hash
+
+    @timed
+    def export(self):
+        """Write the bundle and its compressed copies if the data changed; returns the hash"""
+        with self._lock:
+            digest, data = self.build()
+            if digest == self._current_hash() and os.path.exists(f"{self.path}.gz"):
+                return digest
+            Path(self.path).parent.mkdir(parents=True, exist_ok=True)
+            _write_atomic(f"{self.path}.gz", gzip.compress(data, compresslevel=9, mtime=0))
+            if brotli is not None:
+                _write_atomic(f"{self.path}.br", brotli.compress(data))
+            # The uncompressed file goes last; it is what readers look at
+            _write_atomic(self.path, data)
+            self._hash = digest
+            return digest
+
+    def schedule(self):
+        """Export after a short quiet period, so a burst of saves writes the bundle once"""
+        if self._timer is not None:
+            self._timer.cancel()
+        self._timer = threading.Timer(self.delay, self._background_export)
+        self._timer.daemon = True
+        self._timer.start()
+
+    def _background_export(self):
+        try:
+            self.export()
+        except Exception as e:
+            report_error(f"Error exporting {self.path}: {e}")
+
+    def flush(self):
+        """Cancel any scheduled export and export now"""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        return self.export()
+
+
+def refresh_bundle(data_manager, **options):
+    """Export the bundle after a script changed the data, if there is one.
+
+    The web view prefers the bundle to the CSV files, so leaving it behind
+    would hide the change. options are passed to GraphBundleExporter.
+    """
+    path = options.get('path', BUNDLE_PATH)
+    if not os.path.exists(path):
+        return None
+    return GraphBundleExporter(data_manager, **options).export()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Write the pre-parsed graph bundle used by the web view")
+    parser.add_argument('--db', help="Read from this SQLite database instead of the CSV files")
+    parser.add_argument('--output', default=BUNDLE_PATH, help=f"Bundle path (default: {BUNDLE_PATH})")
+    args = parser.parse_args()
+
+    backend = SqliteBackend.from_csv(args.db) if args.db else None
+    exporter = GraphBundleExporter(DataManager(backend=backend), args.output)
+    print(f"Wrote {args.output} ({exporter.export()[:12]})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,206 @@
+import threading
+from collections import deque
+
+DIRECTIONS = ('out', 'in', 'both')
+
+
+class GraphIndex:
+    """Adjacency index over the edge table, keyed by node ID.
+
+    Built once from the edges and then kept in step with saved edges, so
+    neighbour and path queries never rescan the table. Adjacency lists keep
+    the edges in table order, which makes query results deterministic.
+
+    Directions follow the edges: 'out' follows From -> To, 'in' follows
+    To -> From and 'both' ignores the direction. Paths are returned as
+    (nodes, edges), with one more node ID than edge IDs.
+    """
+
+    def __init__(self, data_manager):
+        self.data_manager = data_manager
+        self._lock = threading.RLock()
+        self._clear()
+        self._version = None
+        data_manager.change_listeners.append(self.on_items_changed)
+
+    def _clear(self):
+        self.edges = {}  # edge ID -> (From, To, position in the table)
+        self.forward = {}  # node ID -> [(edge ID, To)]
+        self.reverse = {}  # node ID -> [(edge ID, From)]
+        self._next_position = 0
+
+    def _edge_version(self):
+        table = self.data_manager.get_table('edge')
+        table.refresh()
+        return table.version
+
+    def rebuild(self):
+        """Index every edge from the DataManager"""
+        with self._lock:
+            self._clear()
+            for edge in self.data_manager.iter_items('edge', ['ID', 'From', 'To']):
+                self._add(edge)
+            self._version = self._edge_version()
+
+    def refresh(self):
+        """Rebuild if the edge table changed behind the index's back"""
+        with self._lock:
+            if self._version != self._edge_version():
+                self.rebuild()
+
+    def on_items_changed(self, item_type, items):
+        """DataManager change listener: re-index saved edges"""
+        if item_type != 'edge':
+            return
+        with self._lock:
+            # Only this save happened since the index was built: update the saved edges
+            version = self._edge_version()
+            if self._version is not None and version == self._version + 1:
+                for edge in items:
+                    self._add(edge)
+                self._version = version
+
+    def _add(self, edge):
+        edge_id = edge['ID']
+        source, target = edge.get('From') or '', edge.get('To') or ''
+        existing = self.edges.get(edge_id)
+        if existing is not None:
+            if existing[:2] == (source, target):
+                return
+            self._remove(edge_id)
+            position = existing[2]
+        else:
+            position = self._next_position
+            self._next_position += 1
+        self.edges[edge_id] = (source, target, position)
+        self._insert(self.forward.setdefault(source, []), (edge_id, target))
+        self._insert(self.reverse.setdefault(target, []), (edge_id, source))
+
+    def _insert(self, adjacency, entry):
+        """Insert keeping the list in table order; appending is the usual case"""
+        position = self.edges[entry[0]][2]
+        index = len(adjacency)
+        while index and self.edges[adjacency[index - 1][0]][2] > position:
+            index -= 1
+        adjacency.insert(index, entry)
+
+    def _remove(self, edge_id):
+        source, target, _ = self.edges.pop(edge_id)
+        self.forward[source] = [entry for entry in self.forward[source] if entry[0] != edge_id]
+        self.reverse[target] = [entry for entry in self.reverse[target] if entry[0] != edge_id]
+
+    def _steps(self, node_id, direction):
+        """(edge ID, other node ID) for every edge leaving node_id in the given direction"""
+        if direction not in DIRECTIONS:
+            raise ValueError(f"direction must be one of {DIRECTIONS}, not {direction!r}")
+        if direction == 'out':
+            return self.forward.get(node_id, [])
+        if direction == 'in':
+            return self.reverse.get(node_id, [])
+        steps = self.forward.get(node_id, []) + self.reverse.get(node_id, [])
+        steps.sort(key=lambda step: self.edges[step[0]][2])
+        return steps
+
+    def edges_of(self, node_id, direction='both'):
+        """IDs of the edges touching a node, in table order"""
+        with self._lock:
+            self.refresh()
+            return [edge_id for edge_id, _ in self._steps(node_id, direction)]
+
+    def neighbours(self, node_id, direction='both'):
+        """IDs of the nodes one edge away, in the order their edges appear"""
+        with self._lock:
+            self.refresh()
+            return list(dict.fromkeys(other for _, other in self._steps(node_id, direction)))
+
+    def edge_between(self, node_a, node_b, direction='both'):
+        """ID of the first edge from node_a to node_b (either way for 'both'), or None"""
+        with self._lock:
+            self.refresh()
+            for edge_id, other in self._steps(node_a, direction):
+                if other == node_b:
+                    return edge_id
+            return None
+
+    def k_hop(self, node_id, k, direction='both'):
+        """Nodes within k edges of node_id and the edges between them, as (node IDs, edge IDs)"""
+        with self._lock:
+            self.refresh()
+            depth = {node_id: 0}
+            queue = deque([node_id])
+            while queue:
+                current = queue.popleft()
+                if depth[current] == k:
+                    continue
+                for _, other in self._steps(current, direction):
+                    if other not in depth:
+                        depth[other] = depth[current] + 1
+                        queue.append(other)
+            # Every edge with both ends in the neighbourhood belongs to the subgraph
+            edges = {edge_id for node in depth for edge_id, other in self.forward.get(node, [])
+                     if other in depth}
+            return set(depth), edges
+
+    def shortest_path(self, source, target, direction='both', max_length=None):
+        """Path with the fewest edges from source to target, or None if there is none within max_length"""
+        with self._lock:
+            self.refresh()
+            if source == target:
+                return [source], []
+            parents = {source: None}  # node -> (previous node, edge ID)
+            frontier = [source]
+            length = 0
+            while frontier and (max_length is None or length < max_length):
+                length += 1
+                next_frontier = []
+                for current in frontier:
+                    for edge_id, other in self._steps(current, direction):
+                        if other in parents:
+                            continue
+                        parents[other] = (current, edge_id)
+                        if other == target:
+                            return self._unwind(parents, target)
+                        next_frontier.append(other)
+                frontier = next_frontier
+            return None
+
+    @staticmethod
+    def _unwind(parents, target):
+        nodes, edges = [target], []
+        while parents[nodes[-1]] is not None:
+            previous, edge_id = parents[nodes[-1]]
+            nodes.append(previous)
+            edges.append(edge_id)
+        return nodes[::-1], edges[::-1]
+
+    def all_simple_paths(self, source, target, max_length, direction='both'):
+        """Every path from source to target with at most max_length edges and no repeated node.
+
+        The number of paths grows quickly with max_length, so a bound is required.
+        """
+        with self._lock:
+            self.refresh()
+            if source == target:
+                return [([source], [])]
+            paths = []
+            nodes, edges, on_path = [source], [], {source}
+            stack = [iter(self._steps(source, direction))]
+            while stack:
+                step = next(stack[-1], None)
+                if step is None:
+                    stack.pop()
+                    on_path.discard(nodes.pop())
+                    if edges:
+                        edges.pop()
+                    continue
+                edge_id, other = step
+                if other in on_path:
+                    continue
+                if other == target:
+                    paths.append((nodes + [other], edges + [edge_id]))
+                elif len(edges) + 1 < max_length:
+                    nodes.append(other)
+                    edges.append(edge_id)
+                    on_path.add(other)
+                    stack.append(iter(self._steps(other, direction)))
+            return paths
@@ -0,0 +1,383 @@
+"""Precompute node positions for the web view, so the browser can skip physics.
+
+A force-directed layout (Fruchterman-Reingold forces, vectorised with NumPy)
+over the node and edge tables: nodes repel each other, edges pull their
+ends together and the members of each cluster in js/main.js's clusterConfigs
+are pulled towards the cluster's centre. Above BARNES_HUT_THRESHOLD nodes
+the repulsion is approximated Barnes-Hut style, treating groups of distant
+nodes in a quadtree as one mass, which makes an iteration O(n log n).
+
+Positions are kept in public/layout.json together with the edges they were
+computed for. When only a few nodes or edges changed since then, only the
+changed nodes and their neighbours are moved, starting from the previous
+positions, so the rest of the graph stays where readers last saw it.
+GraphBundleExporter adds the positions to public/graph.json, and the web
+view renders them with physics off. Bundle exports only ever make the
+incremental updates; a full layout is run from here.
+
+    python graph_layout.py
+    python graph_layout.py --full --db evidence.db
+"""
+import os
+import sys
+import json
+import math
+import time
+import argparse
+import tempfile
+from pathlib import Path
+
+import numpy as np
+
+from data_manager import DataManager
+from storage import SqliteBackend
+from instrumentation import timed, count
+
+LAYOUT_PATH = 'public/layout.json'
+LAYOUT_FORMAT = 1
+LAYOUT_SEED = 1  # Fixed, so the same graph always gets the same layout and bundle hash
+
+SPRING_LENGTH = 200.0  # Ideal edge length, as springLength in the web view's physics options
+CLUSTER_STRENGTH = 2.0  # Pull towards the cluster centre, relative to an edge's pull
+GRAVITY = 0.5  # Pull towards the origin, which keeps unconnected parts from drifting apart
+MIN_DISTANCE = 1.0  # Nodes closer than this repel as if they were this far apart
+
+ITERATIONS = 300  # For a full layout of up to ITERATION_BUDGET / ITERATIONS nodes
+MIN_ITERATIONS = 50  # Larger graphs get fewer iterations, but never fewer than this
+ITERATION_BUDGET = 600_000  # Node-iterations a full layout may take
+INCREMENTAL_ITERATIONS = 60
+INCREMENTAL_HOPS = 1  # Neighbours of changed nodes that move with them
+INCREMENTAL_LIMIT = 0.2  # Above this fraction of changed nodes, the whole graph is laid out again
+
+BARNES_HUT_THRESHOLD = 1000  # Node count from which the repulsion is approximated
+BARNES_HUT_THETA = 0.9  # A quadtree cell counts as distant when its size is below theta times its distance
+LEAF_SIZE = 4  # Average nodes per cell at the deepest quadtree level
+MAX_DEPTH = 16  # Levels of the quadtree at most; cells at the deepest level are never split
+EXACT_BLOCK = 512  # Rows of the pairwise distance matrix computed at once
+
+
+def _scatter(index, values, size):
+    """Sum the rows of values (n x 2) into size rows by index"""
+    return np.stack([np.bincount(index, weights=values[:, axis], minlength=size) for axis in (0, 1)], axis=1)
+
+
+def _repulsion_exact(sources, points):
+    """Repulsion on each of points from every one of sources"""
+    forces = np.empty((len(points), 2))
+    x, y = sources[:, 0], sources[:, 1]
+    for start in range(0, len(points), EXACT_BLOCK):
+        block = points[start:start + EXACT_BLOCK]
+        dx = block[:, 0, None] - x
+        dy = block[:, 1, None] - y
+        scale = SPRING_LENGTH ** 2 / np.maximum(dx * dx + dy * dy, MIN_DISTANCE ** 2)
+        forces[start:start + len(block), 0] = (scale * dx).sum(axis=1)
+        forces[start:start + len(block), 1] = (scale * dy).sum(axis=1)
+    return forces
+
+
+def _interleave(values):
+    """Spread the low 16 bits of values out to the even bits"""
+    values = values & 0xFFFF
+    values = (values | (values << 8)) & 0x00FF00FF
+    values = (values | (values << 4)) & 0x0F0F0F0F
+    values = (values | (values << 2)) & 0x33333333
+    return (values | (values << 1)) & 0x55555555
+
+
+def _ranks(sizes):
+    """0, 1, ..., size - 1 for each of sizes, concatenated"""
+    return np.arange(sizes.sum()) - np.repeat(np.cumsum(sizes) - sizes, sizes)
+
+
+class QuadTree:
+    """Barnes-Hut quadtree over a set of source positions, stored level by level.
+
+    Sources are sorted by Morton code, so every cell is a contiguous run of
+    them and a cell at one level is a code prefix of its children's. Cells are
+    only split while they hold more than LEAF_SIZE sources, so dense clumps
+    get deep trees and sparse regions shallow ones.
+    """
+
+    def __init__(self, sources):
+        self.lo = sources.min(axis=0)
+        self.span = max(float((sources.max(axis=0) - self.lo).max()), MIN_DISTANCE) * (1 + 1e-9)
+        codes = self._codes(sources)
+        order = np.argsort(codes, kind='stable')
+        self.sources = sources[order]
+        codes = codes[order]
+        # Per level: cell prefixes, first source, source count and centre of mass of every cell
+        self.levels = [None]
+        for level in range(1, MAX_DEPTH + 1):
+            prefixes = codes >> (2 * (MAX_DEPTH - level))
+            starts = np.flatnonzero(np.concatenate(([True], prefixes[1:] != prefixes[:-1])))
+            counts = np.diff(np.append(starts, len(prefixes)))
+            centres = np.add.reduceat(self.sources, starts, axis=0) / counts[:, None]
+            self.levels.append((prefixes[starts], starts, counts, centres))
+            if counts.max() <= LEAF_SIZE:
+                break
+        # The children of a cell are a run of cells one level down: first child and child count per cell
+        self.children = [None]
+        for level in range(1, len(self.levels) - 1):
+            prefixes, below = self.levels[level][0], self.levels[level + 1][0]
+            first = np.searchsorted(below, prefixes << 2)
+            self.children.append((first, np.diff(np.append(first, len(below)))))
+
+    def _codes(self, points):
+        grid = np.clip(((points - self.lo) / self.span * (1 << MAX_DEPTH)).astype(np.int64), 0, (1 << MAX_DEPTH) - 1)
+        return (_interleave(grid[:, 0]) << 1) | _interleave(grid[:, 1])
+
+    def repulsion(self, points):
+        """Repulsion on each of points from all sources, with distant cells standing in for their sources"""
+        forces = np.zeros((len(points), 2))
+        codes = self._codes(points)
+        depth = len(self.levels) - 1
+        exact_point, exact_start, exact_count = [], [], []
+        # (point, cell index) pairs still to resolve, starting with the cells of level 1
+        cells = len(self.levels[1][0])
+        pair_point = np.repeat(np.arange(len(points)), cells)
+        pair_cell = np.tile(np.arange(cells), len(points))
+        for level in range(1, depth + 1):
+            prefixes, starts, counts, centres = self.levels[level]
+            delta = points[pair_point] - centres[pair_cell]
+            dist2 = np.maximum(np.einsum('ij,ij->i', delta, delta), MIN_DISTANCE ** 2)
+            size = self.span / (1 << level)
+            own = (codes[pair_point] >> (2 * (MAX_DEPTH - level))) == prefixes[pair_cell]
+            far = ~own & (size * size < BARNES_HUT_THETA ** 2 * dist2)
+            contribution = (SPRING_LENGTH ** 2 * counts[pair_cell[far]] / dist2[far])[:, None] * delta[far]
+            forces += _scatter(pair_point[far], contribution, len(points))
+            # Near cells are summed source by source once they are small, or opened otherwise
+            exact = ~far & ((counts[pair_cell] <= LEAF_SIZE) | (level == depth))
+            exact_point.append(pair_point[exact])
+            exact_start.append(starts[pair_cell[exact]])
+            exact_count.append(counts[pair_cell[exact]])
+            if level < depth:
+                opened = ~far & ~exact
+                first, number = self.children[level]
+                first, number = first[pair_cell[opened]], number[pair_cell[opened]]
+                pair_point = np.repeat(pair_point[opened], number)
+                pair_cell = np.repeat(first, number) + _ranks(number)
+
+        exact_point, exact_start, exact_count = (np.concatenate(parts) for parts in
+                                                 (exact_point, exact_start, exact_count))
+        exact_point = np.repeat(exact_point, exact_count)
+        delta = points[exact_point] - self.sources[np.repeat(exact_start, exact_count) + _ranks(exact_count)]
+        dist2 = np.maximum(np.einsum('ij,ij->i', delta, delta), MIN_DISTANCE ** 2)
+        contribution = (SPRING_LENGTH ** 2 / dist2)[:, None] * delta  # A point's pair with itself has delta 0
+        forces += _scatter(exact_point, contribution, len(points))
+        return forces
+
+
+def _repulsion(sources, points):
+    """Repulsion on points from sources, approximated for large source sets"""
+    if len(sources) >= BARNES_HUT_THRESHOLD:
+        return QuadTree(sources).repulsion(points)
+    return _repulsion_exact(sources, points)
+
+
+def force_layout(pos, edges, clusters=(), movable=None, iterations=ITERATIONS, temperature=None):
+    """Run the force-directed layout in place and return pos.
+
+    pos is an n x 2 array of starting positions, edges an m x 2 array of node
+    indices and clusters a list of node index arrays. Only the nodes in movable
+    (all if None) are moved. temperature caps how far a node moves in the first
+    iteration and falls to zero by the last.
+    """
+    n = len(pos)
+    movable = np.arange(n) if movable is None else np.asarray(movable, dtype=np.int64)
+    if not len(movable) or not iterations:
+        return pos
+    mask = np.zeros(n, dtype=bool)
+    mask[movable] = True
+    edges = edges[mask[edges[:, 0]] | mask[edges[:, 1]]] if len(edges) else np.empty((0, 2), dtype=np.int64)
+    clusters = [members for members in clusters if len(members) > 1 and mask[members].any()]
+    # Nodes that stay put only need to go into a quadtree once
+    fixed = QuadTree(pos[~mask]) if n - len(movable) >= BARNES_HUT_THRESHOLD else None
+    if temperature is None:
+        temperature = SPRING_LENGTH * math.sqrt(n) / 10
+
+    for step in range(iterations):
+        forces = np.zeros((n, 2))
+        moving = pos[movable]
+        if fixed is None:
+            forces[movable] = _repulsion(pos, moving)
+        else:
+            forces[movable] = fixed.repulsion(moving) + _repulsion(moving, moving)
+        if len(edges):
+            # Edges pull with d^2 / k, so an edge on its own settles at the spring length
+            delta = pos[edges[:, 1]] - pos[edges[:, 0]]
+            pull = delta * (np.sqrt(np.einsum('ij,ij->i', delta, delta)) / SPRING_LENGTH)[:, None]
+            forces += _scatter(edges[:, 0], pull, n) - _scatter(edges[:, 1], pull, n)
+        for members in clusters:
+            delta = pos[members].mean(axis=0) - pos[members]
+            forces[members] += CLUSTER_STRENGTH * delta * (np.sqrt(np.einsum('ij,ij->i', delta, delta))
+                                                           / SPRING_LENGTH)[:, None]
+        forces -= GRAVITY * pos
+
+        # Move along the force, at most the current temperature
+        step_forces = forces[movable]
+        length = np.sqrt(np.einsum('ij,ij->i', step_forces, step_forces))
+        limit = temperature * (1 - step / iterations)
+        scale = np.minimum(length, limit) / np.maximum(length, 1e-12)
+        pos[movable] += step_forces * scale[:, None]
+    count('layout_iterations', iterations)
+    return pos
+
+
+def _neighbours(edges, nodes, n):
+    """nodes plus every node sharing an edge with one of them"""
+    mask = np.zeros(n, dtype=bool)
+    mask[nodes] = True
+    if len(edges):
+        touching = mask[edges[:, 0]] | mask[edges[:, 1]]
+        mask[edges[touching].ravel()] = True
+    return np.flatnonzero(mask)
+
+
+class GraphLayout:
+    """Node positions for a graph, updated incrementally and kept in a JSON file.
+
+    update() returns the previous positions unchanged when the nodes, edges
+    and clusters are the same as last time, so it is cheap to call on every
+    bundle export.
+    """
+
+    def __init__(self, path=LAYOUT_PATH):
+        self.path = Path(path)
+        self.positions = {}  # node ID -> (x, y)
+        self.edges = set()  # (From, To) the positions were computed for
+        self.clusters = {}
+        self._loaded = False
+
+    def _load(self):
+        if self._loaded:
+            return
+        self._loaded = True
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            if data.get('format') == LAYOUT_FORMAT:
+                self.positions = {node_id: tuple(xy) for node_id, xy in data['positions'].items()}
+                self.edges = {tuple(edge) for edge in data['edges']}
+                self.clusters = data['clusters']
+        except (FileNotFoundError, ValueError, KeyError, TypeError, AttributeError):
+            pass
+
+    def save(self):
+        data = {
+            'format': LAYOUT_FORMAT,
+            'positions': self.positions,
+            'edges': list(self.edges),
+            'clusters': self.clusters,
+        }
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(prefix=f".{self.path.name}.", suffix='.tmp', dir=self.path.parent)
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            f.write(json.dumps(data, separators=(',', ':')))  # Much faster than json.dump for large layouts
+        os.replace(tmp_path, self.path)
+
+    def changed_nodes(self, node_ids, edges, clusters):
+        """IDs of the nodes that are new, gained or lost an edge, or joined or left a cluster"""
+        changed = {node_id for node_id in node_ids if node_id not in self.positions}
+        changed.update(node_id for edge in edges.symmetric_difference(self.edges) for node_id in edge)
+        for cluster_id in set(clusters) | set(self.clusters):
+            changed.update(set(clusters.get(cluster_id, ())) ^ set(self.clusters.get(cluster_id, ())))
+        return changed & set(node_ids)
+
+    @timed
+    def update(self, node_ids, edges, clusters=None, full=False, incremental_only=False):
+        """Lay out the graph and return {node ID: (x, y)}.
+
+        edges is an iterable of (From, To) and clusters maps cluster IDs to
+        node ID lists. Edges and cluster members that are not nodes are
+        ignored. Only the changed part is laid out again unless full is set
+        or too much changed. With incremental_only, returns None instead of
+        laying out the whole graph, which takes seconds for large graphs.
+        """
+        self._load()
+        node_ids = list(dict.fromkeys(node_ids))
+        index = {node_id: i for i, node_id in enumerate(node_ids)}
+        edges = {(source, target) for source, target in edges
+                 if source != target and source in index and target in index}
+        clusters = {cluster_id: [node_id for node_id in members if node_id in index]
+                    for cluster_id, members in (clusters or {}).items()}
+        changed = self.changed_nodes(node_ids, edges, clusters)
+        if not full and not changed and len(self.positions) == len(node_ids):
+            return self.positions
+
+        n = len(node_ids)
+        edge_array = np.array([(index[s], index[t]) for s, t in sorted(edges)], dtype=np.int64).reshape(-1, 2)
+        cluster_arrays = [np.array([index[node_id] for node_id in members], dtype=np.int64)
+                          for members in clusters.values()]
+        rng = np.random.default_rng(LAYOUT_SEED)
+        incremental = not full and len(changed) <= INCREMENTAL_LIMIT * n and len(self.positions) > 0
+        if not incremental and incremental_only:
+            return None
+        if incremental:
+            pos = self._seed_positions(node_ids, index, edge_array, rng)
+            movable = np.array(sorted(index[node_id] for node_id in changed), dtype=np.int64)
+            for _ in range(INCREMENTAL_HOPS):
+                movable = _neighbours(edge_array, movable, n)
+            force_layout(pos, edge_array, cluster_arrays, movable, INCREMENTAL_ITERATIONS, SPRING_LENGTH)
+        else:
+            radius = SPRING_LENGTH * math.sqrt(n) / 2
+            angle = rng.uniform(0, 2 * math.pi, n)
+            distance = radius * np.sqrt(rng.uniform(0, 1, n))
+            pos = np.stack([distance * np.cos(angle), distance * np.sin(angle)], axis=1)
+            iterations = min(max(ITERATION_BUDGET // max(n, 1), MIN_ITERATIONS), ITERATIONS)
+            force_layout(pos, edge_array, cluster_arrays, iterations=iterations)
+        count('layout_nodes_moved', n if not incremental else len(movable))
+
+        self.positions = {node_id: (round(float(x), 1), round(float(y), 1))
+                          for node_id, (x, y) in zip(node_ids, pos)}
+        self.edges = edges
+        self.clusters = clusters
+        self.save()
+        return self.positions
+
+    def _seed_positions(self, node_ids, index, edges, rng):
+        """Previous positions, with new nodes next to their placed neighbours (or near the middle)"""
+        pos = np.zeros((len(node_ids), 2))
+        placed = np.zeros(len(node_ids), dtype=bool)
+        for node_id, i in index.items():
+            if node_id in self.positions:
+                pos[i] = self.positions[node_id]
+                placed[i] = True
+        if len(edges):
+            ends = np.concatenate([edges, edges[:, ::-1]])
+            known = ends[placed[ends[:, 1]]]
+            sums = _scatter(known[:, 0], pos[known[:, 1]], len(node_ids))
+            counts = np.bincount(known[:, 0], minlength=len(node_ids))
+            near = ~placed & (counts > 0)
+            pos[near] = sums[near] / counts[near, None]
+            placed |= near
+        centre = pos[placed].mean(axis=0) if placed.any() else np.zeros(2)
+        pos[~placed] = centre
+        # Spread the new nodes so they don't start on top of each other
+        new = np.flatnonzero([node_id not in self.positions for node_id in node_ids])
+        pos[new] += rng.normal(scale=SPRING_LENGTH / 2, size=(len(new), 2))
+        return pos
+
+
+def main():
+    from graph_bundle import refresh_bundle, read_cluster_nodes
+
+    parser = argparse.ArgumentParser(description="Precompute the node positions used by the web view")
+    parser.add_argument('--db', help="Read from this SQLite database instead of the CSV files")
+    parser.add_argument('--full', action='store_true', help="Lay out the whole graph again from scratch")
+    parser.add_argument('--output', default=LAYOUT_PATH, help=f"Layout path (default: {LAYOUT_PATH})")
+    args = parser.parse_args()
+
+    backend = SqliteBackend.from_csv(args.db) if args.db else None
+    data_manager = DataManager(backend=backend)
+    layout = GraphLayout(args.output)
+    started = time.monotonic()
+    node_ids = [node['ID'] for node in data_manager.iter_items('node', ['ID'])]
+    edges = [(edge['From'], edge['To']) for edge in data_manager.iter_items('edge', ['From', 'To'])]
+    positions = layout.update(node_ids, edges, read_cluster_nodes(), full=args.full)
+    print(f"Laid out {len(positions)} nodes in {time.monotonic() - started:.1f}s; wrote {args.output}",
+          file=sys.stderr)
+    refresh_bundle(data_manager, layout=layout)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,190 @@
+"""Optional timing and counting of data-layer and GUI operations.
+
+Off unless EVIDENCE_METRICS is set when the program starts:
+
+    EVIDENCE_METRICS=1 python evidence_manager_gui.py
+
+While on, each call of an instrumented function is timed. The rows parsed,
+bytes written, images decoded and so on during the call are counted. Every
+call of a top-level operation (DataManager methods, GUI handlers) is logged
+as one JSON line on the 'evidence.metrics' logger. That goes to stderr, or
+to the file named by EVIDENCE_METRICS_LOG. Hot helpers such as the per-row
+JSON normalisation are only aggregated. On exit, the totals per operation
+and counter are written to EVIDENCE_METRICS_STATS (default metrics.json).
+
+EVIDENCE_PROFILE=<operation>, e.g. EVIDENCE_PROFILE=on_item_selected, runs
+the first call of that operation under cProfile. It writes
+<operation>.prof and a text summary next to it.
+
+When off, @timed returns the function unchanged and count() returns at
+once, so instrumentation costs nothing in normal use.
+"""
+import os
+import sys
+import json
+import time
+import atexit
+import logging
+import threading
+import functools
+from contextlib import contextmanager
+
+ENABLED = os.environ.get('EVIDENCE_METRICS', '') not in ('', '0')
+PROFILE_TARGET = os.environ.get('EVIDENCE_PROFILE') or None
+LOG_PATH = os.environ.get('EVIDENCE_METRICS_LOG') or None
+STATS_PATH = os.environ.get('EVIDENCE_METRICS_STATS') or 'metrics.json'
+PROFILE_SUMMARY_LINES = 40  # Functions listed in the text summary of a profile
+
+logger = logging.getLogger('evidence.metrics')
+
+_lock = threading.Lock()
+_local = threading.local()
+_operations = {}  # name -> [calls, errors, total seconds, min seconds, max seconds]
+_counters = {}  # name -> total
+_profiled = set()
+
+
+def _setup():
+    handler = logging.FileHandler(LOG_PATH, encoding='utf-8') if LOG_PATH else logging.StreamHandler(sys.stderr)
+    handler.setFormatter(logging.Formatter('%(message)s'))
+    logger.addHandler(handler)
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+    atexit.register(dump_stats)
+
+
+def _stack():
+    stack = getattr(_local, 'stack', None)
+    if stack is None:
+        stack = _local.stack = []
+    return stack
+
+
+def count(name, amount=1):
+    """Add to a counter, attributed to the operation running on this thread"""
+    if not ENABLED:
+        return
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + amount
+    stack = _stack()
+    if stack:
+        counters = stack[-1]
+        counters[name] = counters.get(name, 0) + amount
+
+
+def report_error(message):
+    """Print an error message and, with metrics on, log and count it"""
+    print(message)
+    if not ENABLED:
+        return
+    count('errors')
+    stack = _stack()
+    logger.error(json.dumps({'ts': time.time(), 'event': 'error', 'message': message,
+                             'op': stack[-1].get('_op') if stack else None}))
+
+
+def _record(name, elapsed, failed, counters, log):
+    with _lock:
+        stats = _operations.get(name)
+        if stats is None:
+            stats = _operations[name] = [0, 0, 0.0, elapsed, elapsed]
+        stats[0] += 1
+        stats[1] += failed
+        stats[2] += elapsed
+        stats[3] = min(stats[3], elapsed)
+        stats[4] = max(stats[4], elapsed)
+    if log:
+        record = {'ts': time.time(), 'op': name, 'ms': round(elapsed * 1000, 3), 'ok': not failed,
+                  'thread': threading.current_thread().name}
+        record.update((key, value) for key, value in counters.items() if key != '_op')
+        logger.info(json.dumps(record))
+
+
+def timed(func=None, *, name=None, log=True):
+    """Decorator timing every call of func; use log=False for helpers called in tight loops"""
+    if func is None:
+        return functools.partial(timed, name=name, log=log)
+    op_name = name or func.__qualname__
+    profile_this = PROFILE_TARGET is not None and (op_name == PROFILE_TARGET or
+                                                   op_name.endswith(f".{PROFILE_TARGET}"))
+    if not ENABLED and not profile_this:
+        return func
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if profile_this and op_name not in _profiled:
+            _profiled.add(op_name)
+            with profile(f"{PROFILE_TARGET}.prof"):
+                return wrapper(*args, **kwargs)
+        if not ENABLED:
+            return func(*args, **kwargs)
+        stack = _stack()
+        counters = {'_op': op_name}
+        stack.append(counters)
+        failed = True
+        start = time.perf_counter()
+        try:
+            result = func(*args, **kwargs)
+            failed = False
+            return result
+        finally:
+            elapsed = time.perf_counter() - start
+            stack.pop()
+            # Work done inside a nested operation also counts towards the caller
+            if stack:
+                parent = stack[-1]
+                for key, value in counters.items():
+                    if key != '_op':
+                        parent[key] = parent.get(key, 0) + value
+            _record(op_name, elapsed, failed, counters, log)
+    return wrapper
+
+
+@contextmanager
+def profile(path):
+    """Run the enclosed code under cProfile; writes path and a text summary at path + '.txt'"""
+    # Only needed when profiling, so they are not imported by every program using the data layer
+    import io
+    import pstats
+    import cProfile
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield profiler
+    finally:
+        profiler.disable()
+        profiler.dump_stats(path)
+        summary = io.StringIO()
+        pstats.Stats(profiler, stream=summary).sort_stats('cumulative').print_stats(PROFILE_SUMMARY_LINES)
+        with open(f"{path}.txt", 'w', encoding='utf-8') as f:
+            f.write(summary.getvalue())
+        print(f"Wrote profile to {path}", file=sys.stderr)
+
+
+def stats():
+    """Totals per operation and counter since start"""
+    with _lock:
+        operations = {
+            name: {
+                'calls': calls,
+                'errors': errors,
+                'total_ms': total * 1000,
+                'mean_ms': total / calls * 1000,
+                'min_ms': low * 1000,
+                'max_ms': high * 1000,
+            }
+            for name, (calls, errors, total, low, high) in sorted(_operations.items())
+        }
+        return {'operations': operations, 'counters': dict(sorted(_counters.items()))}
+
+
+def dump_stats(path=None):
+    """Write stats() as JSON (to EVIDENCE_METRICS_STATS by default)"""
+    path = path or STATS_PATH
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(stats(), f, indent=2)
+    return path
+
+
+if ENABLED:
+    _setup()
@@ -2,6 +2,10 @@
 let network = null;
 let nodesDataset = new vis.DataSet();
 let edgesDataset = new vis.DataSet();
+let layoutPositions = null;  // Node positions precomputed by graph_layout.py, by node ID
+const csvDownloads = new Map();  // CSV file name -> promise of its bytes, for the current load
+let bundleIsStale = false;  // Set once the bundle was found not to match the CSV files
+const CONTENT_HASH_ETAG = /^(?:W\/)?"([0-9a-f]{32})(?:-[a-z]+)?"$/;  // web_server.py's ETags: SHA-256 prefix, coding
 
 // --- DOM Element References ---
 const loadingGraphEl = document.getElementById('loading-graph');
@@ -59,16 +63,20 @@ async function initializeDashboard() {
     networkContainer.style.opacity = '0.3';
 
     try {
-        // Load both CSV files
-        const [nodes, edges] = await Promise.all([
+        // Prefer the pre-parsed bundle written by graph_bundle.py, fall back to the CSV files
+        csvDownloads.clear();
+        const bundle = await loadBundle();
+        const [nodes, edges] = bundle ? [bundle.nodes, bundle.edges] : await Promise.all([
             loadCSV('Nodes.csv'),
             loadCSV('Edges.csv')
         ]);
 
         // Process nodes and edges
         nodes.forEach(node => {
-            // Parse EvidenceData if it exists
-            if (node.EvidenceData) {
+            // Parse EvidenceData if it exists (the bundle has it parsed already)
+            if (Array.isArray(node.EvidenceData)) {
+                // Already parsed
+            } else if (node.EvidenceData) {
                 try {
                     node.EvidenceData = JSON.parse(node.EvidenceData);
                 } catch (e) {
@@ -90,8 +98,10 @@ async function initializeDashboard() {
         });
 
         edges.forEach(edge => {
-            // Parse EvidenceData if it exists
-            if (edge.EvidenceData) {
+            // Parse EvidenceData if it exists (the bundle has it parsed already)
+            if (Array.isArray(edge.EvidenceData)) {
+                // Already parsed
+            } else if (edge.EvidenceData) {
                 try {
                     console.log(`Processing edge ${edge.ID} evidence:`, edge.EvidenceData);
                     edge.EvidenceData = JSON.parse(edge.EvidenceData);
@@ -117,12 +127,26 @@ async function initializeDashboard() {
             }
         });
 
+        // Start from the precomputed layout if the bundle has one, so physics can stay off
+        layoutPositions = bundle && bundle.positions && Object.keys(bundle.positions).length ? bundle.positions : null;
+        nodes.forEach(node => {
+            const position = layoutPosition(node.id);
+            if (position) {
+                [node.x, node.y] = position;
+            }
+        });
+
         // Add to vis.js datasets
         nodesDataset.clear();
         edgesDataset.clear();
         nodesDataset.add(nodes);
         edgesDataset.add(edges);
 
+        // Use the cluster paths precomputed by graph_bundle.py instead of searching the edges
+        if (bundle && bundle.clusters) {
+            applyBundleClusters(bundle.clusters);
+        }
+
         // Draw the network
         drawGraph();
 
@@ -137,15 +161,127 @@ async function initializeDashboard() {
     }
 }
 
+/**
+ * Load the pre-parsed graph bundle, or null if there is none or it is older than the CSV files
+ */
+async function loadBundle() {
+    if (bundleIsStale) return null;
+    try {
+        // Revalidate every time; the server answers 304 while the bundle is unchanged
+        const response = await fetch('public/graph.json', { cache: 'no-cache' });
+        if (!response.ok) return null;
+        const bundle = await response.json();
+        const current = await bundleIsCurrent(bundle);
+        if (current === false) {
+            console.warn('Graph bundle does not match the CSV files, loading those instead');
+            return null;
+        }
+        if (current === null) {
+            // The server's ETags don't say; draw from the bundle and check it once the page is up
+            setTimeout(() => checkBundleInBackground(bundle.sources), 0);
+        }
+        return decodeBundle(bundle);
+    } catch (e) {
+        console.warn('Could not load graph bundle, falling back to CSV files:', e);
+        return null;
+    }
+}
+
+/**
+ * Whether the CSV files still have the contents the bundle was made from (e.g. not edited by hand or
+ * pulled since), or null if that cannot be told without downloading them
+ */
+async function bundleIsCurrent(bundle) {
+    if (!bundle.sources) return false;
+    // web_server.py's ETags start with the SHA-256 of the CSV as served, so a HEAD request is enough
+    const matches = await Promise.all(Object.entries(bundle.sources).map(async ([filename, hash]) => {
+        const response = await fetch(filename, { method: 'HEAD', cache: 'no-cache' });
+        const etag = CONTENT_HASH_ETAG.exec(response.headers.get('ETag') || '');
+        return etag ? etag[1] === hash.slice(0, etag[1].length) : null;
+    }));
+    if (matches.includes(false)) return false;
+    return matches.includes(null) ? null : true;
+}
+
+/**
+ * Hash the CSV files after drawing from the bundle, and reload from them if the bundle is out of date
+ */
+async function checkBundleInBackground(sources) {
+    // Hashing needs a secure context; without one the bundle is trusted as before
+    if (!(window.crypto && crypto.subtle)) return;
+    try {
+        const matches = await Promise.all(Object.entries(sources).map(async ([filename, hash]) => {
+            const digest = await crypto.subtle.digest('SHA-256', await downloadCSV(filename));
+            const hex = Array.from(new Uint8Array(digest), byte => byte.toString(16).padStart(2, '0')).join('');
+            return hex === hash;
+        }));
+        if (!matches.every(Boolean)) {
+            console.warn('Graph bundle does not match the CSV files, reloading from those');
+            bundleIsStale = true;
+            initializeDashboard();
+        }
+    } catch (e) {
+        console.warn('Could not check the graph bundle against the CSV files:', e);
+    }
+}
+
+/**
+ * Replace string-table indices in a bundle with their values
+ */
+function decodeBundle(bundle) {
+    const strings = bundle.strings;
+    const decode = (row, fields) => fields.forEach(field => {
+        if (typeof row[field] === 'number') row[field] = strings[row[field]];
+    });
+    ['nodes', 'edges'].forEach(section => {
+        bundle[section].forEach(row => {
+            decode(row, bundle.interned[section]);
+            (row.EvidenceData || []).forEach(evidence => decode(evidence, bundle.interned.evidence));
+        });
+    });
+    return bundle;
+}
+
+/**
+ * Copy precomputed cluster paths into clusterConfigs, skipping clusters whose node list has changed since the export
+ */
+function applyBundleClusters(clusters) {
+    Object.entries(clusters).forEach(([clusterId, cluster]) => {
+        const config = clusterConfigs[clusterId];
+        if (config && cluster.nodes.join(',') === config.nodes.join(',')) {
+            config.path = cluster.path;
+        }
+    });
+}
+
+/**
+ * Precomputed [x, y] of a node, or undefined to let physics place it
+ */
+function layoutPosition(nodeId) {
+    return layoutPositions ? layoutPositions[nodeId] : undefined;
+}
+
+/**
+ * Download a CSV file once per load, shared by the bundle check and the parser
+ */
+function downloadCSV(filename) {
+    if (!csvDownloads.has(filename)) {
+        // Revalidate every time; the server answers 304 while the file is unchanged
+        csvDownloads.set(filename, fetch(filename, { cache: 'no-cache' }).then(response => {
+            if (!response.ok) throw new Error(`Failed to load ${filename}: ${response.status}`);
+            return response.arrayBuffer();
+        }));
+    }
+    return csvDownloads.get(filename);
+}
+
 /**
  * Load and parse CSV file using PapaParse
  */
-function loadCSV(filename) {
-    // Add cache-busting parameter
-    const cacheBuster = `?_=${new Date().getTime()}`;
+async function loadCSV(filename) {
+    const text = new TextDecoder().decode(await downloadCSV(filename));
     return new Promise((resolve, reject) => {
-        Papa.parse(filename + cacheBuster, {
-            download: true,
+        Papa.parse(text, {
             header: true,
             skipEmptyLines: true,
             complete: results => resolve(results.data),
@@ -211,7 +347,8 @@ function drawGraph() {
             }
         },
         physics: {
-            enabled: true,
+            // A precomputed layout is drawn as it is
+            enabled: !layoutPositions,
             solver: 'forceAtlas2Based',
             forceAtlas2Based: {
                 gravitationalConstant: -1000,
@@ -222,7 +359,7 @@ function drawGraph() {
                 avoidOverlap: 1
             },
             stabilization: {
-                enabled: true,
+                enabled: !layoutPositions,
                 iterations: 1000,
                 updateInterval: 25,
                 onlyDynamicEdges: false,
@@ -248,9 +385,11 @@ function drawGraph() {
         network.setOptions({ physics: { enabled: false } });
     });
 
-    // Re-enable physics temporarily when dragging nodes
+    // Re-enable physics temporarily when dragging nodes, unless the layout is precomputed
     network.on("dragStart", function () {
-        network.setOptions({ physics: { enabled: true } });
+        if (!layoutPositions) {
+            network.setOptions({ physics: { enabled: true } });
+        }
     });
 
     network.on("dragEnd", function () {
@@ -540,11 +679,20 @@ function displayEvidence(evidenceArray) {
         // Add image
         const img = document.createElement('img');
         // Handle the path - use localPath if available, otherwise use evidenceUrl
-        const imagePath = evidencePath.startsWith('http') ? 
-            evidencePath : 
-            evidencePath.replace(/^\//, '').replace(/\\/g, '/');  // Replace backslashes with forward slashes
-            
-        img.src = imagePath;
+        const toWebPath = path => path.startsWith('http') ?
+            path :
+            path.replace(/^\//, '').replace(/\\/g, '/');  // Replace backslashes with forward slashes
+        const imagePath = toWebPath(evidencePath);
+
+        // Let the browser pick the smallest resized copy that fills the panel
+        const variants = Array.isArray(evidence.variants) ? evidence.variants : [];
+        if (variants.length > 0) {
+            img.srcset = variants.map(variant => `${toWebPath(variant.url)} ${variant.width}w`).join(', ');
+            img.sizes = '(max-width: 767px) 100vw, 50vw';
+            img.width = variants[variants.length - 1].width;
+            img.height = variants[variants.length - 1].height;
+        }
+        img.src = variants.length > 0 ? toWebPath(variants[variants.length - 1].url) : imagePath;
         img.alt = `Evidence ${index + 1}`;
         img.style.display = 'block';
         img.style.maxWidth = '100%';
@@ -552,6 +700,12 @@ function displayEvidence(evidenceArray) {
         
         // Add error handling with more details
         img.onerror = () => {
+            // Fall back to the original if the resized copies are missing
+            if (img.srcset) {
+                img.removeAttribute('srcset');
+                img.src = imagePath;
+                return;
+            }
             console.warn('Failed to load image:', imagePath);
             img.style.display = 'none';
             const errorText = document.createElement('div');
@@ -592,8 +746,10 @@ function displayEvidence(evidenceArray) {
  * Arrange nodes in a circle
  */
 function arrangeNodesInCircle(nodeIds, radius = 200) {
-    const centerX = 0;
-    const centerY = 0;
+    // Centre the circle where the precomputed layout put the cluster, or on the origin
+    const placed = nodeIds.map(layoutPosition).filter(Boolean);
+    const centerX = placed.length ? placed.reduce((sum, position) => sum + position[0], 0) / placed.length : 0;
+    const centerY = placed.length ? placed.reduce((sum, position) => sum + position[1], 0) / placed.length : 0;
 
     // First, remove any existing center node
     try {
@@ -602,9 +758,10 @@ function arrangeNodesInCircle(nodeIds, radius = 200) {
 
     // Reset all nodes to default state and release fixed positions
     nodesDataset.get().forEach(node => {
+        const position = layoutPosition(node.id);
         node.fixed = false;
-        node.x = undefined;
-        node.y = undefined;
+        node.x = position ? position[0] : undefined;
+        node.y = position ? position[1] : undefined;
         node.color = {
             background: '#97C2FC',
             border: '#2B7CE9'
@@ -624,8 +781,10 @@ function arrangeNodesInCircle(nodeIds, radius = 200) {
         edgesDataset.update(edge);
     });
 
-    // Enable physics briefly to reset positions
-    network.setOptions({ physics: { enabled: true } });
+    // Enable physics briefly to reset positions; a precomputed layout is already in place
+    if (!layoutPositions) {
+        network.setOptions({ physics: { enabled: true } });
+    }
 
     // Add invisible center node to force edge routing
     const centerNode = {
@@ -637,8 +796,8 @@ function arrangeNodesInCircle(nodeIds, radius = 200) {
             border: 'rgba(0,0,0,0)'
         },
         fixed: true,
-        x: 0,
-        y: 0,
+        x: centerX,
+        y: centerY,
         physics: false,
         hidden: true
     };
@@ -704,9 +863,10 @@ function resetView() {
 
     // Reset all nodes to default state
     nodesDataset.get().forEach(node => {
+        const position = layoutPosition(node.id);
         node.fixed = false;
-        node.x = undefined;
-        node.y = undefined;
+        node.x = position ? position[0] : undefined;
+        node.y = position ? position[1] : undefined;
         node.color = {
             background: '#97C2FC',
             border: '#2B7CE9'
@@ -726,8 +886,10 @@ function resetView() {
         edgesDataset.update(edge);
     });
 
-    // Enable physics briefly to reorganize
-    network.setOptions({ physics: { enabled: true } });
+    // Enable physics briefly to reorganize; a precomputed layout is already in place
+    if (!layoutPositions) {
+        network.setOptions({ physics: { enabled: true } });
+    }
 
     // Reset the view with animation
     network.fit({
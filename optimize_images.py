@@ -0,0 +1,137 @@
+"""Create the resized web variants of every image in public/images.
+
+Each image gets WebP copies at the widths in web_images.WEB_IMAGE_WIDTHS,
+written in a process pool. Images whose variants are already up to date
+are skipped, so the job can be rerun at any time. The variants are then
+recorded in the EvidenceData of every entry showing the image, with one
+write per table, so the web view can offer them through srcset.
+
+The summary compares the originals with their largest variant, which is
+the most the web view downloads per image.
+
+    python optimize_images.py
+    python optimize_images.py --db evidence.db --workers 8 --force
+"""
+import os
+import sys
+import json
+import time
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+from data_manager import DataManager, WEB_IMAGES_URL
+from storage import SqliteBackend
+from graph_bundle import refresh_bundle
+from web_images import WebImages, WEB_IMAGES_DIRNAME
+
+PROGRESS_INTERVAL = 1.0  # Seconds between progress lines
+
+# Per-process variant writer, set up by _init_worker
+_web_images = None
+_force = False
+
+
+def _init_worker(images_dir, force):
+    global _web_images, _force
+    _web_images = WebImages(Path(images_dir) / WEB_IMAGES_DIRNAME, WEB_IMAGES_URL)
+    _force = force
+
+
+def optimize_image(image_path):
+    """Write the variants of one image if needed (runs in a worker process).
+
+    Returns (image_path, variants, encoded, original bytes, largest variant bytes, error).
+    """
+    try:
+        variants = None if _force else _web_images.variants(image_path)
+        encoded = variants is None
+        if encoded:
+            variants = _web_images.generate(image_path, force=True)
+        largest = _web_images.variant_path(image_path, variants[-1]['width'])
+        return image_path, variants, encoded, os.path.getsize(image_path), os.path.getsize(largest), None
+    except Exception as e:
+        return image_path, None, False, 0, 0, f"{type(e).__name__}: {e}"
+
+
+def source_images(images_dir):
+    """Paths of the stored evidence images, skipping the cache directories and temporary files"""
+    if not os.path.isdir(images_dir):
+        return []
+    return sorted(Path(os.path.abspath(entry.path)).as_posix() for entry in os.scandir(images_dir)
+                  if not entry.name.startswith('.') and entry.is_file())
+
+
+def run_optimize(data_manager, workers=None, force=False, progress=True):
+    """Create the variants of every stored image and record them; returns a summary dict"""
+    images = source_images(data_manager.images_dir)
+    variants_by_path, errors = {}, []
+    encoded = original_bytes = web_bytes = 0
+
+    started = last_report = time.monotonic()
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                             initargs=(str(data_manager.images_dir), force)) as executor:
+        for done, (image_path, variants, was_encoded, original, largest, error) in enumerate(
+                executor.map(optimize_image, images, chunksize=4), start=1):
+            if error:
+                errors.append({'image': image_path, 'error': error})
+            else:
+                variants_by_path[image_path] = variants
+                encoded += was_encoded
+                original_bytes += original
+                web_bytes += largest
+            now = time.monotonic()
+            if progress and (now - last_report >= PROGRESS_INTERVAL or done == len(images)):
+                last_report = now
+                rate = done / max(now - started, 1e-9)
+                print(f"Checked {done}/{len(images)} images ({rate:.1f}/s, {encoded} encoded, "
+                      f"{len(errors)} failed)", file=sys.stderr)
+
+    updated = data_manager.set_web_variants(variants_by_path)
+    if updated is None:
+        raise RuntimeError("Failed to write the evidence; rerun to try again")
+    if updated:
+        if not data_manager.compact():
+            raise RuntimeError("Failed to write the CSV files")
+        refresh_bundle(data_manager)
+
+    return {
+        'images': len(images),
+        'encoded': encoded,
+        'skipped': len(variants_by_path) - encoded,
+        'evidence_updated': updated,
+        'original_bytes': original_bytes,
+        'web_bytes': web_bytes,
+        'bytes_saved': original_bytes - web_bytes,
+        'errors': errors,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Create resized web variants of the evidence images")
+    parser.add_argument('--db', help="Use this SQLite database instead of the CSV files")
+    parser.add_argument('--workers', type=int, default=None, help="Worker processes (default: CPU count)")
+    parser.add_argument('--force', action='store_true', help="Re-encode images whose variants are up to date")
+    parser.add_argument('--json', action='store_true', help="Print the summary as JSON")
+    parser.add_argument('--quiet', action='store_true', help="Don't print progress")
+    args = parser.parse_args()
+
+    backend = SqliteBackend.from_csv(args.db) if args.db else None
+    summary = run_optimize(DataManager(backend=backend), args.workers, args.force, not args.quiet)
+
+    if args.json:
+        print(json.dumps(summary, indent=2))
+    else:
+        for error in summary['errors']:
+            print(f"{error['image']}: {error['error']}", file=sys.stderr)
+        saved = summary['bytes_saved']
+        percent = saved / summary['original_bytes'] * 100 if summary['original_bytes'] else 0.0
+        print(f"Encoded {summary['encoded']} images, {summary['skipped']} already up to date, "
+              f"{len(summary['errors'])} failed; updated {summary['evidence_updated']} evidence entries")
+        print(f"Largest variants total {summary['web_bytes']:,} bytes against {summary['original_bytes']:,} "
+              f"for the originals: {saved:,} bytes ({percent:.1f}%) saved")
+    sys.exit(1 if summary['errors'] else 0)
+
+
+if __name__ == "__main__":
+    main()
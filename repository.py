@@ -0,0 +1,625 @@
+import os
+import sys
+import csv
+import stat
+import json
+import tempfile
+import threading
+from io import StringIO
+
+from file_lock import file_lock, LockTimeout
+from instrumentation import timed, count, report_error
+
+JOURNAL_SUFFIX = '.journal'  # Pending row changes are appended to "<csv>.journal"
+COMPACT_DELAY = 2.0  # Seconds of write inactivity before the CSV is compacted
+COMPACT_MAX_ENTRIES = 500  # Compact straight away once the journal holds this many entries
+
+
+@timed(log=False)
+def normalize_evidence_json(value):
+    """Return a valid JSON evidence list string with forward-slash local paths"""
+    if not value:
+        return '[]'
+    try:
+        evidence = json.loads(value)
+    except json.JSONDecodeError:
+        return '[]'
+    if not isinstance(evidence, list):
+        return '[]'
+    # Ensure all evidence uses forward slashes
+    for e in evidence:
+        if isinstance(e, dict) and 'localPath' in e:
+            e['localPath'] = e['localPath'].replace('\\', '/')
+    return json.dumps(evidence)
+
+
+def decode_evidence(value):
+    """Parse an EvidenceData string into a list of evidence dicts.
+
+    Rows written by this tool are normalised when saved, so this only has
+    to fix up the back-slash paths of rows edited by hand.
+    """
+    try:
+        evidence = json.loads(value or '[]')
+    except json.JSONDecodeError:
+        return []
+    if not isinstance(evidence, list):
+        return []
+    evidence = [e for e in evidence if isinstance(e, dict)]
+    for e in evidence:
+        if '\\' in (e.get('localPath') or ''):
+            e['localPath'] = e['localPath'].replace('\\', '/')
+    return evidence
+
+
+class ConflictError(Exception):
+    """A row was changed by someone else in a way that cannot be merged with the edit being saved"""
+
+    def __init__(self, item_id, fields):
+        super().__init__(f"{item_id} was changed by someone else ({', '.join(fields)})")
+        self.item_id = item_id
+        self.fields = fields
+
+
+def evidence_key(evidence):
+    """Identity of an evidence entry: its image and source.
+
+    Fields filled in later, like the web variants the image worker adds,
+    are left out, so an entry stays the same entry when another writer
+    adds them.
+    """
+    return (evidence.get('localPath') or evidence.get('evidenceUrl') or '',
+            evidence.get('sourceUrl') or '', evidence.get('sourceLabel') or '')
+
+
+def merge_evidence(base, theirs, ours):
+    """Three-way merge of evidence lists.
+
+    Entries either side added are kept and entries either side removed are
+    dropped, so two curators adding evidence to the same item both keep
+    theirs. Their order is kept, with our additions after it. An entry
+    both sides kept is taken from our side if we changed it, e.g. added
+    its web variants, and from theirs otherwise.
+    """
+    base_entries = {evidence_key(evidence): evidence for evidence in base}
+    our_entries = {evidence_key(evidence): evidence for evidence in ours}
+    merged = []
+    for evidence in theirs:
+        key = evidence_key(evidence)
+        if key in our_entries:
+            merged.append(our_entries[key] if our_entries[key] != base_entries.get(key) else evidence)
+        elif key not in base_entries:
+            merged.append(evidence)
+    base_keys = set(base_entries)
+    seen = {evidence_key(evidence) for evidence in merged}
+    merged += [evidence for evidence in ours
+               if evidence_key(evidence) not in base_keys and evidence_key(evidence) not in seen]
+    return merged
+
+
+def _field_value(row, name):
+    if name == 'EvidenceData':
+        return decode_evidence(row.get(name))
+    return row.get(name) or ''
+
+
+def merge_rows(base, theirs, ours):
+    """Merge our edit of a row with the changes someone else saved since we read it as base.
+
+    Fields only one side changed take that side's value and evidence lists
+    are merged with merge_evidence(). Raises ConflictError if both sides
+    changed another field to different values.
+    """
+    merged = dict(theirs)
+    conflicts = []
+    for name in ours:
+        base_value, their_value, our_value = (_field_value(row, name) for row in (base, theirs, ours))
+        if our_value == base_value:
+            continue  # Unchanged by us; theirs stands
+        if their_value in (base_value, our_value):
+            merged[name] = ours[name]
+        elif name == 'EvidenceData':
+            merged[name] = json.dumps(merge_evidence(base_value, their_value, our_value))
+        else:
+            conflicts.append(name)
+    if conflicts:
+        raise ConflictError(ours['ID'], conflicts)
+    return merged
+
+
+def merge_items(items, base, current):
+    """Merge each edited item with changes saved since its base copy was read, in place.
+
+    base holds the rows as the caller read them (None to overwrite) and
+    current(item_id) returns the row as stored now.
+    """
+    for item, original in zip(items, base):
+        if original is None:
+            continue
+        stored = current(item['ID'])
+        if stored is None or all(_field_value(stored, name) == _field_value(original, name)
+                                 for name in stored.keys() | original.keys()):
+            continue
+        merged = merge_rows(original, stored, item)
+        item.clear()
+        item.update(merged)
+        count('rows_merged')
+
+
+def column_map(fieldnames):
+    """Shared column -> position map for the records of one header, with interned names"""
+    return {sys.intern(name): position for position, name in enumerate(fieldnames)}
+
+
+class Record:
+    """A read-only table row: its values in column order and a column map shared by many rows.
+
+    Far smaller than a dict per row. Supports the read side of the dict
+    interface (row['Label'], row.get(), items(), ...), and the evidence
+    list is decoded from EvidenceData on first access and then kept.
+    """
+    __slots__ = ('columns', 'values', '_evidence')
+
+    def __init__(self, columns, values):
+        self.columns = columns
+        self.values = values
+        self._evidence = None
+
+    @classmethod
+    def from_dict(cls, item, columns=None):
+        columns = columns if columns is not None else column_map(item)
+        return cls(columns, tuple('' if item.get(name) is None else item[name] for name in columns))
+
+    def __getitem__(self, name):
+        return self.values[self.columns[name]]
+
+    def get(self, name, default=None):
+        position = self.columns.get(name)
+        return default if position is None else self.values[position]
+
+    def __contains__(self, name):
+        return name in self.columns
+
+    def keys(self):
+        return self.columns.keys()
+
+    def items(self):
+        return zip(self.columns, self.values)
+
+    def to_dict(self):
+        return dict(zip(self.columns, self.values))
+
+    @property
+    def evidence(self):
+        """Decoded EvidenceData; treat as read-only since it is shared"""
+        if self._evidence is None:
+            self._evidence = decode_evidence(self.get('EvidenceData'))
+        return self._evidence
+
+    def __repr__(self):
+        return f"Record({self.to_dict()!r})"
+
+
+def read_records(f, fields=None):
+    """Stream a CSV file as Records; returns (fieldnames, record iterator).
+
+    With fields, records only hold those columns, so memory scales with the
+    fields actually used. Unquoted commas in the last column spill into
+    extra cells and are joined back; short rows are padded with ''.
+    """
+    reader = csv.reader(f)
+    fieldnames = [sys.intern(name) for name in next(reader, [])]
+    width = len(fieldnames)
+    if fields is None:
+        columns = column_map(fieldnames)
+        positions = None
+    else:
+        fields = [name for name in fields if name in fieldnames]
+        columns = column_map(fields)
+        positions = [fieldnames.index(name) for name in fields]
+
+    def records():
+        for values in reader:
+            if not values:
+                continue
+            if len(values) > width:
+                values[width - 1:] = [','.join(values[width - 1:])]
+            elif len(values) < width:
+                values.extend([''] * (width - len(values)))
+            if positions is not None:
+                values = [values[position] for position in positions]
+            yield Record(columns, tuple(values))
+
+    return fieldnames, records()
+
+
+def file_mode_for(path):
+    """Permissions for a file replacing path: those of the existing file, or the umask default.
+
+    Temporary files are created 0600, so they must be given these before os.replace.
+    """
+    try:
+        return stat.S_IMODE(os.stat(path).st_mode)
+    except FileNotFoundError:
+        umask = os.umask(0)
+        os.umask(umask)
+        return 0o666 & ~umask
+
+
+def _fsync_dir(path):
+    """Flush a directory entry so a rename survives a crash (no-op where unsupported)"""
+    try:
+        fd = os.open(path or '.', os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+class CsvTable:
+    """Cached view of one CSV table, indexed by ID.
+
+    The file is parsed once and kept in memory as compact Records in row
+    order. EvidenceData stays a string until someone decodes it. Every
+    access checks the file's mtime and size, and the table is only re-parsed
+    when the file was changed by someone else. stream() reads the file
+    without caching it, for tables too large to hold.
+
+    Edits are not written to the CSV directly. Each changed row is appended
+    to a journal file next to the CSV and fsynced, so an edit costs the size
+    of one row. The journal is merged into the CSV by compact(), which writes
+    a temporary file and atomically replaces the original, either on demand
+    or in the background shortly after the last edit.
+
+    Several processes can edit the same table. Writers take an advisory
+    lock on "<csv>.lock" and catch up with the journal before appending,
+    and an edit made from an out-of-date copy of a row is merged with the
+    newer one (see replace_many). Readers never take the lock.
+    """
+
+    def __init__(self, path, compact_delay=COMPACT_DELAY, compact_max_entries=COMPACT_MAX_ENTRIES):
+        self.path = path
+        self.journal_path = f"{path}{JOURNAL_SUFFIX}"
+        self.compact_delay = compact_delay
+        self.compact_max_entries = compact_max_entries
+        self.fieldnames = []
+        self.rows = []  # Records in file order
+        self.index = {}  # ID -> position in rows
+        self._columns = {}
+        self._signature = None
+        self._journal_offset = 0
+        self._journal_entries = 0
+        self._compact_timer = None
+        self._lock = threading.RLock()
+        self._file_lock = file_lock(path)  # Taken before _lock, so waiting on another process never holds up readers
+        self.version = 0  # Incremented whenever the cached rows change
+
+    def _stat_signature(self):
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return (st.st_mtime_ns, st.st_size)
+
+    def _journal_size(self):
+        try:
+            return os.path.getsize(self.journal_path)
+        except FileNotFoundError:
+            return 0
+
+    def refresh(self):
+        """Reload the table if the CSV or its journal changed since they were last read"""
+        with self._lock:
+            signature = self._stat_signature()
+            journal_size = self._journal_size()
+            if signature != self._signature or journal_size < self._journal_offset:
+                self._load()
+                self._signature = signature
+                self._journal_offset = 0
+                self._journal_entries = 0
+            if journal_size > self._journal_offset:
+                self._replay_journal()
+
+    @timed
+    def _load(self):
+        self.version += 1
+        self.fieldnames = []
+        self.rows = []
+        self.index = {}
+        self._columns = {}
+        try:
+            with open(self.path, 'r', newline='', encoding='utf-8') as f:
+                self.fieldnames, records = read_records(f)
+                self._columns = column_map(self.fieldnames)
+                # Evidence is normalised when it is saved, so rows are kept exactly as read
+                self.rows = list(records)
+                id_position = self._columns['ID'] if self.rows else None
+                self.index = {record.values[id_position]: position for position, record in enumerate(self.rows)}
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            report_error(f"Error reading {self.path}: {e}")
+        count('rows_parsed', len(self.rows))
+
+    @timed(log=False)
+    def _replay_journal(self):
+        """Apply complete journal entries written since the last read"""
+        try:
+            with open(self.journal_path, 'rb') as f:
+                f.seek(self._journal_offset)
+                data = f.read()
+        except FileNotFoundError:
+            return
+        # A trailing line without a newline is an interrupted append; leave it unread
+        end = data.rfind(b'\n') + 1
+        for line in data[:end].splitlines():
+            if not line.strip():
+                continue
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError as e:
+                report_error(f"Skipping corrupt entry in {self.journal_path}: {e}")
+                continue
+            if entry.get('op') == 'put':
+                self._apply(entry['row'])
+            elif entry.get('op') == 'put_many':
+                for row in entry['rows']:
+                    self._apply(row)
+            self._journal_entries += 1
+            count('journal_entries_replayed')
+        if end:
+            self.version += 1
+        self._journal_offset += end
+
+    def _apply(self, item):
+        new = [name for name in item if name not in self._columns]
+        if new:
+            self.fieldnames.extend(new)
+            self._columns = column_map(self.fieldnames)
+        record = Record.from_dict(item, self._columns)
+        position = self.index.get(item['ID'])
+        if position is None:
+            self.index[item['ID']] = len(self.rows)
+            self.rows.append(record)
+        else:
+            self.rows[position] = record
+
+    def all(self):
+        """Return copies of all rows in file order"""
+        with self._lock:
+            self.refresh()
+            return [record.to_dict() for record in self.rows]
+
+    def records(self, fields=None):
+        """Return the cached rows as read-only Records, without copying them.
+
+        fields is a hint for backends that can skip columns; every column is
+        already in memory here.
+        """
+        with self._lock:
+            self.refresh()
+            return list(self.rows)
+
+    def stream(self, fields=None):
+        """Yield the rows as Records straight from the file, with saved edits applied.
+
+        Nothing is cached and only the journal is held in memory, so this
+        works on tables too large to load. With fields, records only hold
+        those columns (and ID).
+        """
+        with self._lock:
+            edits = {}
+            try:
+                with open(self.journal_path, 'rb') as f:
+                    data = f.read()
+            except FileNotFoundError:
+                data = b''
+            for line in data[:data.rfind(b'\n') + 1].splitlines():
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                for row in entry.get('rows') or [entry.get('row') or {}]:
+                    if 'ID' in row:
+                        edits[row['ID']] = row
+        if fields is not None:
+            fields = ['ID'] + [name for name in fields if name != 'ID']  # Needed to apply the edits
+        try:
+            f = open(self.path, 'r', newline='', encoding='utf-8')
+        except FileNotFoundError:
+            return
+        with f:
+            _, records = read_records(f, fields)
+            keep = None if fields is None else set(fields)
+            for record in records:
+                edited = edits.get(record.get('ID')) if edits else None
+                if edited is not None:
+                    record = Record.from_dict({name: value for name, value in edited.items()
+                                               if keep is None or name in keep})
+                yield record
+
+    def to_csv_bytes(self):
+        """The table with all saved edits applied, encoded exactly as compact() writes it"""
+        with self._lock:
+            self.refresh()
+            fieldnames, rows = list(self.fieldnames), list(self.rows)
+        # Record values are in column order; rows read before a column was added are short
+        width = len(fieldnames)
+        buffer = StringIO(newline='')
+        writer = csv.writer(buffer)
+        writer.writerow(fieldnames)
+        writer.writerows(record.values if len(record.values) == width
+                         else record.values + ('',) * (width - len(record.values)) for record in rows)
+        return buffer.getvalue().encode('utf-8')
+
+    def get(self, item_id):
+        """Return a copy of the row with the given ID, or None"""
+        with self._lock:
+            self.refresh()
+            position = self.index.get(item_id)
+            return self.rows[position].to_dict() if position is not None else None
+
+    def __contains__(self, item_id):
+        with self._lock:
+            self.refresh()
+            return item_id in self.index
+
+    def __len__(self):
+        with self._lock:
+            self.refresh()
+            return len(self.rows)
+
+    def replace(self, item):
+        """Replace the row with the same ID and record the change in the journal"""
+        return self.replace_many([item])
+
+    def replace_many(self, items, base=None):
+        """Replace several rows with a single journal entry, so either all or none are applied.
+
+        base optionally holds each row as the caller read it before editing
+        (None to overwrite). Rows someone else saved since then are merged
+        with the edit, updating the items in place, or ConflictError is
+        raised and nothing is written.
+        """
+        try:
+            with self._file_lock, self._lock:
+                self.refresh()
+                if not items or any(item['ID'] not in self.index for item in items):
+                    return False
+                if base is not None:
+                    merge_items(items, base, self._stored)
+                entry = {'op': 'put', 'row': items[0]} if len(items) == 1 else {'op': 'put_many', 'rows': items}
+                try:
+                    self._append_journal(entry)
+                except Exception as e:
+                    report_error(f"Error updating {self.path}: {e}")
+                    return False
+                for item in items:
+                    self._apply(item)
+                self.version += 1
+                self._schedule_compaction()
+                return True
+        except LockTimeout as e:
+            report_error(f"Error updating {self.path}: {e}")
+            return False
+
+    def _stored(self, item_id):
+        position = self.index.get(item_id)
+        return self.rows[position].to_dict() if position is not None else None
+
+    @timed(log=False)
+    def _append_journal(self, entry):
+        """Durably append one entry to the journal"""
+        line = (json.dumps(entry, ensure_ascii=False) + '\n').encode('utf-8')
+        with open(self.journal_path, 'ab') as f:
+            # Drop an interrupted append left by a crash so the new entry starts on a clean line
+            if f.tell() > self._journal_offset:
+                f.truncate(self._journal_offset)
+                f.seek(self._journal_offset)
+            f.write(line)
+            f.flush()
+            os.fsync(f.fileno())
+        self._journal_offset += len(line)
+        self._journal_entries += 1
+        count('bytes_written', len(line))
+
+    def _schedule_compaction(self):
+        """Compact after a quiet period, or now if the journal has grown large"""
+        if self._compact_timer is not None:
+            self._compact_timer.cancel()
+            self._compact_timer = None
+        if self._journal_entries >= self.compact_max_entries:
+            delay = 0
+        elif self.compact_delay is None:
+            return
+        else:
+            delay = self.compact_delay
+        self._compact_timer = threading.Timer(delay, self._background_compact)
+        self._compact_timer.daemon = True
+        self._compact_timer.start()
+
+    def _background_compact(self):
+        try:
+            self.compact()
+        except Exception as e:
+            report_error(f"Error compacting {self.path}: {e}")
+
+    @timed
+    def compact(self):
+        """Merge the journal into the CSV with an atomic replace.
+
+        Returns True if the CSV was rewritten.
+        """
+        with self._file_lock, self._lock:
+            if self._compact_timer is not None:
+                self._compact_timer.cancel()
+                self._compact_timer = None
+            self.refresh()
+            if not self._journal_entries:
+                return False
+            fieldnames = list(self.fieldnames)
+            snapshot = [record.to_dict() for record in self.rows]
+            snapshot_offset = self._journal_offset
+            snapshot_signature = self._signature
+
+        # Write the merged table outside the lock so edits are not held up
+        directory = os.path.dirname(os.path.abspath(self.path))
+        fd, tmp_path = tempfile.mkstemp(prefix=f".{os.path.basename(self.path)}.", suffix='.tmp', dir=directory)
+        try:
+            with os.fdopen(fd, 'w', newline='', encoding='utf-8') as f:
+                writer = csv.DictWriter(f, fieldnames=fieldnames)
+                writer.writeheader()
+                writer.writerows(snapshot)
+                f.flush()
+                os.fsync(f.fileno())
+                count('bytes_written', f.tell())
+            os.chmod(tmp_path, file_mode_for(self.path))
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+
+        with self._file_lock, self._lock:
+            if self._stat_signature() != snapshot_signature:
+                # Another process compacted meanwhile, so our journal offset is stale. Its
+                # CSV and the journal tail it kept already hold every entry we merged
+                os.remove(tmp_path)
+                return False
+            os.replace(tmp_path, self.path)
+            _fsync_dir(directory)
+            # Entries up to the snapshot are now in the CSV; keep anything appended since.
+            # Replaying an already-merged entry is harmless, so a crash here loses nothing.
+            try:
+                with open(self.journal_path, 'rb') as f:
+                    f.seek(snapshot_offset)
+                    tail = f.read()
+            except FileNotFoundError:
+                tail = b''
+            tail = tail[:tail.rfind(b'\n') + 1]
+            if tail:
+                fd, tmp_journal = tempfile.mkstemp(prefix=f".{os.path.basename(self.journal_path)}.", suffix='.tmp', dir=directory)
+                with os.fdopen(fd, 'wb') as f:
+                    f.write(tail)
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.chmod(tmp_journal, file_mode_for(self.journal_path))
+                os.replace(tmp_journal, self.journal_path)
+            else:
+                try:
+                    os.remove(self.journal_path)
+                except FileNotFoundError:
+                    pass
+            _fsync_dir(directory)
+            # The tail starts at the snapshot. Entries up to our old offset are applied here already;
+            # replay the rest, which other processes appended since this one last caught up
+            applied = self._journal_offset - snapshot_offset
+            self._signature = self._stat_signature()
+            self._journal_offset = applied
+            self._journal_entries = tail[:applied].count(b'\n')
+            self._replay_journal()
+            if tail:
+                self._schedule_compaction()
+            return True
@@ -0,0 +1,257 @@
+import re
+import heapq
+import itertools
+import bisect
+import threading
+from collections import defaultdict
+
+SEARCH_FIELDS = ['ID', 'Label', 'Type', 'Details']
+SUBSTRING_FIELDS = ['ID', 'Label']  # Fields also matched in the middle of words (trigram index)
+SEARCH_LIMIT = 20
+MAX_CANDIDATES = 1000  # Candidates looked at per kind of match; bounds the cost of broad queries
+
+_WORD = re.compile(r'\w+', re.UNICODE)
+_MAX_CHAR = chr(0x10ffff)
+
+
+def _words(text):
+    return _WORD.findall(text.lower())
+
+
+def _trigrams(text):
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+def _remove_sorted(values, value):
+    index = bisect.bisect_left(values, value)
+    if index < len(values) and values[index] == value:
+        del values[index]
+
+
+class _Document:
+    __slots__ = ('item_type', 'item_id', 'label', 'id_lower', 'label_lower', 'tokens', 'token_text',
+                 'substring_text')
+
+    def __init__(self, item_type, item):
+        self.item_type = item_type
+        self.item_id = item['ID']
+        self.label = item.get('Label') or ''
+        self.id_lower = self.item_id.lower()
+        self.label_lower = self.label.lower()
+        self.tokens = set()
+        for field in SEARCH_FIELDS:
+            self.tokens.update(_words(item.get(field) or ''))
+        self.token_text = ' ' + ' '.join(self.tokens)  # A word starts with term if ' ' + term is in here
+        self.substring_text = ' '.join((item.get(field) or '').lower() for field in SUBSTRING_FIELDS)
+
+
+class SearchIndex:
+    """In-memory type-ahead index over the ID, Label, Type and Details of nodes and edges.
+
+    Every word is kept in a sorted token list, so a prefix is a bisect plus
+    a range scan. ID and Label are also indexed by trigram to find matches
+    in the middle of words. Results are ranked with exact and prefix matches
+    on the ID and label first, then by label length, with ties broken by
+    label and key so that equal matches always come back in the same order.
+
+    Matches are not collected into sets. Candidates are read lazily from the
+    sorted lists and from the postings of the query's rarest word, and
+    every word is checked against each candidate. Within each kind of match,
+    at most MAX_CANDIDATES candidates are looked at, so a broad query costs
+    no more than a narrow one. Postings are dicts, whose order does not
+    change from one process to the next, unlike that of sets.
+
+    The index attaches to a DataManager and updates the saved items after
+    each write. If the tables change in some other way (another process, an
+    external edit) it is rebuilt on the next search.
+    """
+
+    def __init__(self, data_manager=None):
+        self.data_manager = data_manager
+        self._lock = threading.RLock()
+        self._clear()
+        self._versions = None
+        if data_manager is not None:
+            data_manager.change_listeners.append(self.on_items_changed)
+
+    def _clear(self):
+        self.documents = {}  # (item_type, ID) -> _Document
+        self._postings = defaultdict(dict)  # word -> {document key: None}
+        self._sorted_tokens = []
+        self._trigram_postings = defaultdict(dict)  # trigram -> {document key: None}
+        self._sorted_ids = []  # (lowercased ID, key), for whole-query matches on the ID
+        self._sorted_labels = []  # (lowercased Label, key), for whole-query matches on the label
+        self._label_counts = {}  # lowercased Label -> number of documents with it
+        self._distinct_labels = []  # Sorted keys of _label_counts
+
+    def rebuild(self):
+        """Index every node and edge from the DataManager"""
+        with self._lock:
+            self._clear()
+            for item_type in ('node', 'edge'):
+                for item in self.data_manager.iter_items(item_type, SEARCH_FIELDS):
+                    self.add(item_type, item, keep_sorted=False)
+            self._sorted_tokens = sorted(self._postings)
+            self._sorted_ids.sort()
+            self._sorted_labels.sort()
+            self._distinct_labels = sorted(self._label_counts)
+            self._versions = self.data_manager.table_versions()
+
+    def refresh(self):
+        """Rebuild if the tables changed behind the index's back"""
+        if self.data_manager is not None and self._versions != self.data_manager.table_versions():
+            self.rebuild()
+
+    def on_items_changed(self, item_type, items):
+        """DataManager change listener: re-index the saved items"""
+        with self._lock:
+            # If this save is the only change since the index was built, updating the
+            # saved items keeps it current; otherwise the next search rebuilds it
+            versions = self.data_manager.table_versions()
+            if self._versions is not None and sum(versions) == sum(self._versions) + 1:
+                for item in items:
+                    self.add(item_type, item)
+                self._versions = versions
+
+    def add(self, item_type, item, keep_sorted=True):
+        """Index an item, replacing any previous version of it"""
+        with self._lock:
+            key = (item_type, item['ID'])
+            self.remove(item_type, item['ID'])
+            document = self.documents[key] = _Document(item_type, item)
+            for token in document.tokens:
+                postings = self._postings[token]
+                if not postings and keep_sorted:
+                    bisect.insort(self._sorted_tokens, token)
+                postings[key] = None
+            for trigram in _trigrams(document.substring_text):
+                self._trigram_postings[trigram][key] = None
+            for names, name in ((self._sorted_ids, document.id_lower), (self._sorted_labels, document.label_lower)):
+                if keep_sorted:
+                    bisect.insort(names, (name, key))
+                else:
+                    names.append((name, key))
+            label_count = self._label_counts.get(document.label_lower, 0)
+            if not label_count and keep_sorted:
+                bisect.insort(self._distinct_labels, document.label_lower)
+            self._label_counts[document.label_lower] = label_count + 1
+
+    def remove(self, item_type, item_id):
+        with self._lock:
+            key = (item_type, item_id)
+            document = self.documents.pop(key, None)
+            if document is None:
+                return
+            for token in document.tokens:
+                postings = self._postings[token]
+                postings.pop(key, None)
+                if not postings:
+                    del self._postings[token]
+                    _remove_sorted(self._sorted_tokens, token)
+            for trigram in _trigrams(document.substring_text):
+                postings = self._trigram_postings.get(trigram)
+                if postings is not None:
+                    postings.pop(key, None)
+                    if not postings:
+                        del self._trigram_postings[trigram]
+            for names, name in ((self._sorted_ids, document.id_lower), (self._sorted_labels, document.label_lower)):
+                _remove_sorted(names, (name, key))
+            self._label_counts[document.label_lower] -= 1
+            if not self._label_counts[document.label_lower]:
+                del self._label_counts[document.label_lower]
+                _remove_sorted(self._distinct_labels, document.label_lower)
+
+    def _token_range(self, term):
+        """Words in the index starting with term"""
+        tokens = self._sorted_tokens
+        low = bisect.bisect_left(tokens, term)
+        return tokens[low:bisect.bisect_left(tokens, term + _MAX_CHAR, low)]
+
+    def _term_size(self, term):
+        """Upper bound of the number of documents matching term, to find the rarest"""
+        # A term that starts MAX_CANDIDATES words is broad anyway; don't count all of them
+        tokens = itertools.islice(self._token_range(term), MAX_CANDIDATES)
+        size = sum(map(len, map(self._postings.__getitem__, tokens)))
+        if len(term) >= 3:
+            size += min(len(self._trigram_postings.get(trigram, ())) for trigram in _trigrams(term))
+        return size
+
+    def _term_keys(self, term):
+        """Keys of documents with a word starting with term, or whose ID or Label contains it"""
+        for token in self._token_range(term):
+            yield from self._postings[token]
+        if len(term) >= 3:
+            yield from self._substring_keys(term)
+
+    def _substring_keys(self, term):
+        """Keys of documents whose ID or Label contains term (at least 3 characters)"""
+        postings = sorted((self._trigram_postings.get(trigram, {}) for trigram in _trigrams(term)), key=len)
+        for key in postings[0]:
+            if all(key in other for other in postings[1:]) and term in self.documents[key].substring_text:
+                yield key
+
+    @staticmethod
+    def _name_keys(names, start, stop):
+        """Keys in a sorted (name, key) list with start <= name < stop, in that order"""
+        low = bisect.bisect_left(names, (start,))
+        high = bisect.bisect_left(names, (stop,), low)
+        return (names[index][1] for index in range(low, high))
+
+    def _label_prefix_keys(self, query):
+        """Keys of documents whose label starts with query, shortest label first"""
+        low = bisect.bisect_left(self._distinct_labels, query)
+        high = bisect.bisect_left(self._distinct_labels, query + _MAX_CHAR, low)
+        for label in sorted(self._distinct_labels[low:high], key=len):  # Stable, so equal lengths stay sorted
+            yield from self._name_keys(self._sorted_labels, label, label + '\0')
+
+    def _ranked_tiers(self, query):
+        """(in rank order, keys) for each kind of match of the whole query, best kind first"""
+        yield True, self._name_keys(self._sorted_ids, query, query + '\0')
+        yield True, self._name_keys(self._sorted_labels, query, query + '\0')
+        yield False, self._name_keys(self._sorted_ids, query, query + _MAX_CHAR)
+        yield True, self._label_prefix_keys(query)
+        if len(query) >= 3:
+            yield False, (key for key in self._substring_keys(query) if query in self.documents[key].label_lower)
+
+    def _rank(self, key):
+        """Sort key within a tier: shorter labels first, usually the more specific match"""
+        document = self.documents[key]
+        return len(document.label), document.label_lower, key
+
+    def _matches(self, key, terms, item_type):
+        if item_type is not None and key[0] != item_type:
+            return False
+        document = self.documents[key]
+        return all(' ' + term in document.token_text or (len(term) >= 3 and term in document.substring_text)
+                   for term in terms)
+
+    def search(self, query, item_type=None, limit=SEARCH_LIMIT):
+        """Return up to limit (item_type, ID, Label) tuples matching every word of query"""
+        query = query.strip().lower()
+        terms = _words(query)
+        if not terms or limit <= 0:
+            return []
+        with self._lock:
+            self.refresh()
+            # Exact, then prefix, then substring matches of the whole query on the ID and
+            # label come first, then documents matching the rarest word. A key that was
+            # looked at once is never looked at again; whether it matches is the same in
+            # every tier.
+            rarest = min(terms, key=self._term_size) if len(terms) > 1 else terms[0]
+            tiers = itertools.chain(self._ranked_tiers(query), [(False, self._term_keys(rarest))])
+            best, seen = [], set()
+            for ordered, keys in tiers:
+                wanted = limit - len(best)
+                found = []
+                for key in itertools.islice(keys, MAX_CANDIDATES):
+                    if key in seen:
+                        continue
+                    seen.add(key)
+                    if self._matches(key, terms, item_type):
+                        found.append(key)
+                        if ordered and len(found) == wanted:
+                            break
+                best += heapq.nsmallest(wanted, found, key=self._rank)
+                if len(best) >= limit:
+                    break
+            return [(key[0], key[1], self.documents[key].label) for key in best]
@@ -0,0 +1,349 @@
+import os
+import csv
+import json
+import sqlite3
+import tempfile
+import threading
+
+from repository import CsvTable, Record, column_map, merge_items, normalize_evidence_json, file_mode_for
+from file_lock import file_lock
+from instrumentation import timed, count, report_error
+
+NODE_COLUMNS = ['ID', 'Label', 'Type', 'Details', 'EvidenceData', 'ImageUrl']  # Default Nodes.csv layout
+EDGE_COLUMNS = ['ID', 'From', 'To', 'Label', 'Details', 'EvidenceData']  # Default Edges.csv layout
+EVIDENCE_FIELDS = ['evidenceUrl', 'localPath', 'sourceUrl', 'sourceLabel']
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS nodes (
+    ID TEXT PRIMARY KEY,
+    position INTEGER NOT NULL,
+    Label TEXT, Type TEXT, Details TEXT, ImageUrl TEXT,
+    extra TEXT
+);
+CREATE TABLE IF NOT EXISTS edges (
+    ID TEXT PRIMARY KEY,
+    position INTEGER NOT NULL,
+    "From" TEXT, "To" TEXT, Label TEXT, Details TEXT,
+    extra TEXT
+);
+CREATE TABLE IF NOT EXISTS evidence (
+    item_type TEXT NOT NULL,
+    item_id TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    evidenceUrl TEXT, localPath TEXT, sourceUrl TEXT, sourceLabel TEXT,
+    extra TEXT,
+    PRIMARY KEY (item_type, item_id, position)
+);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_nodes_position ON nodes (position);
+CREATE INDEX IF NOT EXISTS idx_edges_position ON edges (position);
+CREATE INDEX IF NOT EXISTS idx_edges_from ON edges ("From");
+CREATE INDEX IF NOT EXISTS idx_edges_to ON edges ("To");
+CREATE INDEX IF NOT EXISTS idx_evidence_local_path ON evidence (localPath);
+"""
+
+
+@timed(log=False)
+def write_csv_atomic(path, fieldnames, rows):
+    """Write rows to a CSV through a temporary file so readers never see a partial file.
+
+    Holds the file's write lock, so an editor working on the CSV directly
+    does not compact over the export or the other way round.
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(prefix=f".{os.path.basename(path)}.", suffix='.tmp', dir=directory)
+    try:
+        with os.fdopen(fd, 'w', newline='', encoding='utf-8') as f:
+            writer = csv.DictWriter(f, fieldnames=fieldnames)
+            writer.writeheader()
+            writer.writerows(rows)
+            f.flush()
+            os.fsync(f.fileno())
+            count('bytes_written', f.tell())
+        os.chmod(tmp_path, file_mode_for(path))
+        with file_lock(path):
+            os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+class CsvBackend:
+    """Keep nodes and edges in Nodes.csv/Edges.csv (the default backend)"""
+
+    def __init__(self, nodes_csv='Nodes.csv', edges_csv='Edges.csv'):
+        self.nodes_csv = nodes_csv
+        self.edges_csv = edges_csv
+        self.tables = {
+            'node': CsvTable(nodes_csv),
+            'edge': CsvTable(edges_csv),
+        }
+
+    def compact(self):
+        """Merge pending journal entries into the CSV files"""
+        for table in self.tables.values():
+            table.compact()
+
+    def export_csv(self, nodes_csv, edges_csv):
+        """Write the tables to CSV files in the web layout"""
+        for table, path in ((self.tables['node'], nodes_csv), (self.tables['edge'], edges_csv)):
+            table.compact()
+            if os.path.abspath(path) != os.path.abspath(table.path):
+                write_csv_atomic(path, table.fieldnames, table.all())
+
+    def close(self):
+        pass
+
+
+class SqliteTable:
+    """Nodes or edges stored in SQLite, with the same interface as CsvTable"""
+
+    def __init__(self, backend, item_type, sql_table, columns):
+        self.backend = backend
+        self.item_type = item_type
+        self.sql_table = sql_table
+        self.columns = columns  # Row columns stored in their own SQL column
+        self.version = 0  # Incremented whenever the rows change
+        self._data_version = None
+
+    @property
+    def path(self):
+        return self.backend.db_path
+
+    @property
+    def fieldnames(self):
+        return self.backend.get_fieldnames(self.item_type)
+
+    def refresh(self):
+        """Notice commits made by other connections"""
+        with self.backend.lock:
+            data_version = self.backend.conn.execute("PRAGMA data_version").fetchone()[0]
+            if data_version != self._data_version:
+                self._data_version = data_version
+                self.version += 1
+
+    def _select(self):
+        columns = ', '.join(f'"{column}"' for column in self.columns)
+        return f'SELECT {columns}, extra FROM {self.sql_table}'
+
+    def _to_item(self, record, evidence):
+        values = dict(zip(self.columns, record[:-1]))
+        if record[-1]:
+            values.update(json.loads(record[-1]))
+        values['EvidenceData'] = json.dumps(evidence)
+        item = {name: values.get(name) or '' for name in self.fieldnames}
+        for name, value in values.items():
+            item.setdefault(name, value or '')
+        return item
+
+    def _evidence_for(self, item_id):
+        records = self.backend.conn.execute(
+            'SELECT evidenceUrl, localPath, sourceUrl, sourceLabel, extra FROM evidence '
+            'WHERE item_type = ? AND item_id = ? ORDER BY position', (self.item_type, item_id))
+        return [self.backend.evidence_from_record(record) for record in records]
+
+    @timed(log=False)
+    def all(self):
+        """Return all rows in their original order"""
+        with self.backend.lock:
+            self.refresh()
+            evidence = {}
+            records = self.backend.conn.execute(
+                'SELECT item_id, evidenceUrl, localPath, sourceUrl, sourceLabel, extra FROM evidence '
+                'WHERE item_type = ? ORDER BY item_id, position', (self.item_type,))
+            for record in records:
+                evidence.setdefault(record[0], []).append(self.backend.evidence_from_record(record[1:]))
+            records = self.backend.conn.execute(f'{self._select()} ORDER BY position')
+            items = [self._to_item(record, evidence.get(record[0], [])) for record in records]
+            count('rows_read', len(items))
+            return items
+
+    def records(self, fields=None):
+        """Return all rows as Records; with fields, only those columns are read"""
+        if fields is None or not all(name in self.columns for name in fields):
+            return [Record.from_dict(item) for item in self.all()]
+        columns = column_map(fields)
+        selected = ', '.join(f'"{name}"' for name in fields)
+        with self.backend.lock:
+            self.refresh()
+            cursor = self.backend.conn.execute(f'SELECT {selected} FROM {self.sql_table} ORDER BY position')
+            return [Record(columns, tuple('' if value is None else value for value in record)) for record in cursor]
+
+    def stream(self, fields=None):
+        """Yield the rows as Records, as records() returns them, so callers can stream either backend"""
+        yield from self.records(fields)
+
+    def get(self, item_id):
+        """Return the row with the given ID, or None"""
+        with self.backend.lock:
+            self.refresh()
+            record = self.backend.conn.execute(f'{self._select()} WHERE ID = ?', (item_id,)).fetchone()
+            if record is None:
+                return None
+            return self._to_item(record, self._evidence_for(item_id))
+
+    def __contains__(self, item_id):
+        with self.backend.lock:
+            return self.backend.conn.execute(
+                f'SELECT 1 FROM {self.sql_table} WHERE ID = ?', (item_id,)).fetchone() is not None
+
+    def __len__(self):
+        with self.backend.lock:
+            return self.backend.conn.execute(f'SELECT COUNT(*) FROM {self.sql_table}').fetchone()[0]
+
+    def replace(self, item):
+        """Replace the row with the same ID and its evidence in one transaction"""
+        return self.replace_many([item])
+
+    def replace_many(self, items, base=None):
+        """Replace several rows and their evidence in one transaction.
+
+        base works as for CsvTable.replace_many: edits made from an older copy
+        of a row are merged with what is stored, or ConflictError is raised.
+        """
+        with self.backend.lock:
+            self.refresh()
+            conn = self.backend.conn
+            assignments = ', '.join(f'"{column}" = ?' for column in self.columns[1:])
+            try:
+                with conn:
+                    # Take the write lock up front, so the rows merged against cannot change before the update
+                    conn.execute('BEGIN IMMEDIATE')
+                    if base is not None:
+                        merge_items(items, base, self.get)
+                    for item in items:
+                        extra = {name: value for name, value in item.items()
+                                 if name not in self.columns and name != 'EvidenceData'}
+                        cursor = conn.execute(
+                            f'UPDATE {self.sql_table} SET {assignments}, extra = ? WHERE ID = ?',
+                            [item.get(column, '') for column in self.columns[1:]]
+                            + [json.dumps(extra) if extra else None, item['ID']])
+                        if cursor.rowcount == 0:
+                            raise KeyError(item['ID'])
+                        conn.execute('DELETE FROM evidence WHERE item_type = ? AND item_id = ?',
+                                     (self.item_type, item['ID']))
+                        self.backend.insert_evidence(self.item_type, item['ID'], item.get('EvidenceData'))
+                        self.backend.add_fieldnames(self.item_type, item)
+            except KeyError:
+                return False  # Unknown ID; the transaction was rolled back
+            except sqlite3.Error as e:
+                report_error(f"Error updating {self.sql_table} in {self.backend.db_path}: {e}")
+                return False
+            self.version += 1
+            return True
+
+    def compact(self):
+        return False
+
+
+class SqliteBackend:
+    """Keep nodes, edges and evidence in a SQLite database.
+
+    The database runs in WAL mode so readers (an export, another editor) are
+    not blocked by writes. The CSV files used by the web view are regenerated
+    from it by export_csv(), which compact() does automatically when the
+    backend was given CSV paths.
+    """
+
+    def __init__(self, db_path, nodes_csv=None, edges_csv=None):
+        self.db_path = db_path
+        self.nodes_csv = nodes_csv
+        self.edges_csv = edges_csv
+        self.lock = threading.RLock()
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(SCHEMA)
+        self._fieldnames = {}
+        self.tables = {
+            'node': SqliteTable(self, 'node', 'nodes', [c for c in NODE_COLUMNS if c != 'EvidenceData']),
+            'edge': SqliteTable(self, 'edge', 'edges', [c for c in EDGE_COLUMNS if c != 'EvidenceData']),
+        }
+
+    @classmethod
+    def from_csv(cls, db_path, nodes_csv='Nodes.csv', edges_csv='Edges.csv'):
+        """Open db_path, importing the CSV files first if the database is new or empty"""
+        backend = cls(db_path, nodes_csv, edges_csv)
+        if not len(backend.tables['node']) and not len(backend.tables['edge']):
+            backend.import_csv(nodes_csv, edges_csv)
+        return backend
+
+    def get_fieldnames(self, item_type):
+        if item_type not in self._fieldnames:
+            with self.lock:
+                record = self.conn.execute('SELECT value FROM meta WHERE key = ?',
+                                           (f'{item_type}_fieldnames',)).fetchone()
+            default = NODE_COLUMNS if item_type == 'node' else EDGE_COLUMNS
+            self._fieldnames[item_type] = json.loads(record[0]) if record else list(default)
+        return self._fieldnames[item_type]
+
+    def add_fieldnames(self, item_type, item):
+        """Remember the column order, including columns the schema has no SQL column for"""
+        fieldnames = self.get_fieldnames(item_type)
+        new = [name for name in item if name not in fieldnames]
+        if new or not self.conn.execute('SELECT 1 FROM meta WHERE key = ?', (f'{item_type}_fieldnames',)).fetchone():
+            fieldnames.extend(new)
+            self.conn.execute('INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)',
+                              (f'{item_type}_fieldnames', json.dumps(fieldnames)))
+
+    def evidence_from_record(self, record):
+        evidence = dict(zip(EVIDENCE_FIELDS, record[:-1]))
+        if record[-1]:
+            evidence.update(json.loads(record[-1]))
+        return evidence
+
+    def insert_evidence(self, item_type, item_id, evidence_json):
+        evidence_data = json.loads(normalize_evidence_json(evidence_json))
+        rows = []
+        for position, evidence in enumerate(evidence_data):
+            if not isinstance(evidence, dict):
+                continue
+            extra = {name: value for name, value in evidence.items() if name not in EVIDENCE_FIELDS}
+            rows.append([item_type, item_id, position] + [evidence.get(name, '') for name in EVIDENCE_FIELDS]
+                        + [json.dumps(extra) if extra else None])
+        self.conn.executemany('INSERT INTO evidence VALUES (?, ?, ?, ?, ?, ?, ?, ?)', rows)
+
+    @timed
+    def import_csv(self, nodes_csv, edges_csv):
+        """Replace the database contents with the rows of the CSV files"""
+        with self.lock, self.conn:
+            for item_type, path in (('node', nodes_csv), ('edge', edges_csv)):
+                table = self.tables[item_type]
+                source = CsvTable(path)
+                self.conn.execute(f'DELETE FROM {table.sql_table}')
+                self.conn.execute('DELETE FROM evidence WHERE item_type = ?', (item_type,))
+                placeholders = ', '.join('?' for _ in table.columns)
+                columns = ', '.join(f'"{column}"' for column in table.columns)
+                for position, item in enumerate(source.all()):
+                    extra = {name: value for name, value in item.items()
+                             if name not in table.columns and name != 'EvidenceData'}
+                    self.conn.execute(
+                        f'INSERT INTO {table.sql_table} ({columns}, position, extra) VALUES ({placeholders}, ?, ?)',
+                        [item.get(column, '') for column in table.columns] + [position, json.dumps(extra) if extra else None])
+                    self.insert_evidence(item_type, item['ID'], item.get('EvidenceData'))
+                self._fieldnames[item_type] = list(source.fieldnames)
+                self.conn.execute('INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)',
+                                  (f'{item_type}_fieldnames', json.dumps(source.fieldnames)))
+        for table in self.tables.values():
+            table.version += 1
+
+    def export_csv(self, nodes_csv, edges_csv):
+        """Write Nodes.csv/Edges.csv in the column layout js/main.js reads"""
+        for item_type, path in (('node', nodes_csv), ('edge', edges_csv)):
+            table = self.tables[item_type]
+            write_csv_atomic(path, table.fieldnames, table.all())
+
+    def compact(self):
+        """Bring the CSV files up to date and fold the WAL back into the database"""
+        if self.nodes_csv and self.edges_csv:
+            self.export_csv(self.nodes_csv, self.edges_csv)
+        with self.lock:
+            self.conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
@@ -0,0 +1,39 @@
+import os
+import sys
+import csv
+
+import pytest
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+
+from storage import NODE_COLUMNS, EDGE_COLUMNS  # noqa: E402
+
+NODES = [
+    {'ID': 'ja', 'Label': 'Jacinda Ardern', 'Type': 'Person', 'Details': '', 'EvidenceData': '[]', 'ImageUrl': ''},
+    {'ID': 'bmgf', 'Label': 'BMGF', 'Type': 'Organisation', 'Details': '', 'EvidenceData': '[]', 'ImageUrl': ''},
+]
+EDGES = [
+    {'ID': 'rel1', 'From': 'bmgf', 'To': 'ja', 'Label': 'Funds', 'Details': '', 'EvidenceData': '[]'},
+]
+
+
+def write_csv(path, fieldnames, rows):
+    with open(path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.DictWriter(f, fieldnames=fieldnames)
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+def read_csv(path):
+    with open(path, 'r', newline='', encoding='utf-8') as f:
+        return list(csv.DictReader(f))
+
+
+@pytest.fixture
+def dataset(tmp_path, monkeypatch):
+    """A small Nodes.csv/Edges.csv in an empty working directory, as the scripts expect"""
+    write_csv(tmp_path / 'Nodes.csv', NODE_COLUMNS, NODES)
+    write_csv(tmp_path / 'Edges.csv', EDGE_COLUMNS, EDGES)
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
@@ -0,0 +1,86 @@
+import os
+import json
+
+import pytest
+
+Image = pytest.importorskip('PIL.Image')
+
+from data_manager import DataManager  # noqa: E402
+from audit_evidence import run_audit, PATH_MISMATCH, OUTSIDE_IMAGES, MISSING_FILE  # noqa: E402
+
+
+@pytest.fixture
+def audited(dataset):
+    """A DataManager whose nodes have a mismatched, an outside and a missing image"""
+    data_manager = DataManager()
+    source = dataset / 'photo.png'
+    Image.new('RGB', (40, 30), 'red').save(source)
+    stored, _ = data_manager.blobs.put(source)
+    stored = os.path.relpath(stored)
+    outside = dataset / 'outside.png'
+    Image.new('RGB', (40, 30), 'blue').save(outside)
+
+    ja = data_manager.get_item('ja', 'node')
+    ja['EvidenceData'] = json.dumps([
+        {'evidenceUrl': '/public/images/renamed.png', 'localPath': stored, 'sourceUrl': '', 'sourceLabel': ''},
+        {'evidenceUrl': '/public/images/gone.png', 'localPath': 'public/images/gone.png',
+         'sourceUrl': '', 'sourceLabel': ''},
+    ])
+    bmgf = data_manager.get_item('bmgf', 'node')
+    bmgf['EvidenceData'] = json.dumps([
+        {'evidenceUrl': '/outside.png', 'localPath': 'outside.png', 'sourceUrl': '', 'sourceLabel': 'Kept'}])
+    assert data_manager.update_items([ja, bmgf], 'node')
+    return data_manager
+
+
+def evidence(data_manager, item_id):
+    return json.loads(data_manager.get_item(item_id, 'node')['EvidenceData'])
+
+
+def problem_kinds(report):
+    return sorted((problem['id'], problem['problem']) for problem in report['problems'])
+
+
+def test_fix_repairs_paths_in_one_write_per_table(audited, monkeypatch):
+    writes = []
+    update_items = audited.update_items
+    monkeypatch.setattr(audited, 'update_items', lambda items, *args: writes.append(
+        [item['ID'] for item in items]) or update_items(items, *args))
+
+    report = run_audit(audited, workers=1, fix=True, progress=False)
+
+    assert problem_kinds(report) == [('bmgf', OUTSIDE_IMAGES), ('ja', MISSING_FILE), ('ja', PATH_MISMATCH)]
+    assert report['fixed'] == 2
+    assert writes == [['ja', 'bmgf']]
+    first, missing = evidence(audited, 'ja')
+    assert first['evidenceUrl'] == f"/public/images/{os.path.basename(first['localPath'])}"
+    assert missing['localPath'] == 'public/images/gone.png'  # Broken, but only --drop-broken removes it
+    copied = evidence(audited, 'bmgf')[0]
+    assert copied['localPath'].startswith('public/images/') and os.path.exists(copied['localPath'])
+    assert copied['sourceLabel'] == 'Kept'
+
+    assert run_audit(audited, workers=1, progress=False)['problems'][0]['problem'] == MISSING_FILE
+
+
+def test_drop_broken_only_removes_entries(audited):
+    before = sorted(os.listdir('public/images'))
+
+    report = run_audit(audited, workers=1, drop_broken=True, progress=False)
+
+    assert report['fixed'] == 1
+    assert [entry['evidenceUrl'] for entry in evidence(audited, 'ja')] == ['/public/images/renamed.png']
+    assert evidence(audited, 'bmgf')[0]['localPath'] == 'outside.png'
+    assert sorted(os.listdir('public/images')) == sorted(before + ['.audit.json'])  # Nothing copied in
+
+
+def test_decode_results_are_reused_until_the_file_changes(audited):
+    first = run_audit(audited, workers=1, progress=False)
+    assert (first['decoded'], first['cached']) == (2, 0)
+
+    again = run_audit(audited, workers=1, progress=False)
+    assert (again['decoded'], again['cached']) == (0, 2)
+    assert again['problems'] == first['problems']
+
+    Image.new('RGB', (20, 20), 'green').save('outside.png')
+    changed = run_audit(audited, workers=1, progress=False)
+    assert (changed['decoded'], changed['cached']) == (1, 1)
@@ -0,0 +1,50 @@
+import os
+
+import blob_store
+from blob_store import BlobStore, file_sha256
+
+
+def test_put_names_files_by_content_and_deduplicates(tmp_path):
+    store = BlobStore(tmp_path / 'images')
+    first = tmp_path / 'a.PNG'
+    first.write_bytes(b'image data')
+    second = tmp_path / 'b.png'
+    second.write_bytes(b'image data')
+
+    stored, created = store.put(first)
+    again, created_again = store.put(second)
+
+    assert created and not created_again
+    assert stored == again == tmp_path / 'images' / f"{file_sha256(first)}.png"
+    assert stored.read_bytes() == b'image data'
+    assert [name for name in os.listdir(tmp_path / 'images')] == [stored.name]
+
+
+def test_files_from_outside_are_not_linked(tmp_path, monkeypatch):
+    monkeypatch.setattr(blob_store, '_reflink', lambda *args: False)  # Where reflinks work, the copy is one
+    store = BlobStore(tmp_path / 'images')
+    source = tmp_path / 'picked.png'
+    source.write_bytes(b'original')
+
+    stored, _ = store.put(source)
+    assert os.stat(source).st_nlink == 1
+    assert os.stat(stored).st_nlink == 1
+
+    with open(source, 'r+b') as f:  # Edited in place, keeping the inode
+        f.write(b'ORIGINAL')
+    assert stored.read_bytes() == b'original'
+    assert stored.stem == file_sha256(stored)
+
+
+def test_files_inside_the_store_are_linked(tmp_path, monkeypatch):
+    monkeypatch.setattr(blob_store, '_reflink', lambda *args: False)
+    store = BlobStore(tmp_path / 'images')
+    (tmp_path / 'images').mkdir()
+    legacy = tmp_path / 'images' / 'legacy.png'
+    legacy.write_bytes(b'stored under its old name')
+
+    stored, created = store.put(legacy)
+
+    assert created
+    assert os.path.samefile(legacy, stored)
+    assert os.stat(legacy).st_nlink == 2
@@ -0,0 +1,78 @@
+import os
+import csv
+import json
+
+import pytest
+
+Image = pytest.importorskip('PIL.Image')
+
+from data_manager import DataManager  # noqa: E402
+from bulk_import import run_import, load_checkpoint, CHECKPOINT_SUFFIX  # noqa: E402
+
+MANIFEST = [
+    ('ja', 'node', 'one.png', 'First'),
+    ('ja', 'node', 'two.png', 'Second'),
+    ('bmgf', 'node', 'three.png', 'Third'),
+    ('rel1', 'edge', 'one.png', 'Edge'),
+]
+
+
+@pytest.fixture
+def manifest(dataset):
+    for name, colour in (('one.png', 'red'), ('two.png', 'green'), ('three.png', 'blue')):
+        Image.new('RGB', (40, 30), colour).save(dataset / name)
+    path = dataset / 'drop.csv'
+    with open(path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(['item_id', 'type', 'image_path', 'source_url', 'label'])
+        writer.writerows((item_id, item_type, image, '', label) for item_id, item_type, image, label in MANIFEST)
+    return str(path)
+
+
+def labels(data_manager, item_id, item_type='node'):
+    item = data_manager.get_item(item_id, item_type)
+    return [evidence['sourceLabel'] for evidence in json.loads(item['EvidenceData'])]
+
+
+def run_until_edge_write(manifest, monkeypatch):
+    """Import, killed after the node evidence was written but before the edge evidence was"""
+    data_manager = DataManager()
+    add_stored_evidence = data_manager.add_stored_evidence
+
+    def write_nodes_then_die(item_type, evidence_by_item):
+        if item_type == 'edge':
+            raise KeyboardInterrupt
+        return add_stored_evidence(item_type, evidence_by_item)
+    monkeypatch.setattr(data_manager, 'add_stored_evidence', write_nodes_then_die)
+    with pytest.raises(KeyboardInterrupt):
+        run_import(manifest, data_manager, workers=1, progress=False)
+
+
+def test_resuming_an_interrupted_import_neither_duplicates_nor_skips(manifest, monkeypatch):
+    run_until_edge_write(manifest, monkeypatch)
+    checkpoint = f"{manifest}{CHECKPOINT_SUFFIX}"
+    assert len(load_checkpoint(checkpoint)) == 3
+
+    # Cut the last record short, as if killed while writing it, so that image is prepared again
+    with open(checkpoint, 'r', encoding='utf-8') as f:
+        lines = f.readlines()
+    with open(checkpoint, 'w', encoding='utf-8') as f:
+        f.writelines(lines[:2])
+        f.write(lines[2][:20])
+    assert len(load_checkpoint(checkpoint)) == 2
+    run_until_edge_write(manifest, monkeypatch)
+    assert len(load_checkpoint(checkpoint)) == 3
+
+    summary = run_import(manifest, DataManager(), workers=1, progress=False)
+
+    assert (summary['added'], summary['skipped'], summary['errors']) == (1, 3, [])
+    data_manager = DataManager()
+    assert labels(data_manager, 'ja') == ['First', 'Second']
+    assert labels(data_manager, 'bmgf') == ['Third']
+    assert labels(data_manager, 'rel1', 'edge') == ['Edge']
+    assert not os.path.exists(checkpoint)
+    assert len([name for name in os.listdir('public/images') if name.endswith('.png')]) == 3
+
+    # Running the finished manifest again changes nothing
+    assert run_import(manifest, DataManager(), workers=1, progress=False)['added'] == 0
+    assert labels(DataManager(), 'ja') == ['First', 'Second']
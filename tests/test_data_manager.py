@@ -0,0 +1,151 @@
+import os
+import threading
+
+import pytest
+
+from data_manager import DataManager
+
+
+@pytest.fixture
+def managers(dataset):
+    """Make DataManagers whose background image work is finished before the test's directory goes away"""
+    created = []
+
+    def make():
+        created.append(DataManager())
+        return created[-1]
+    yield make
+    for data_manager in created:
+        data_manager.wait_for_images()
+
+
+@pytest.fixture
+def image(dataset):
+    path = dataset / 'picked.png'
+    path.write_bytes(b'not really a png')
+    return path
+
+
+def evidence(data_manager, item_id, item_type='node'):
+    return data_manager._load_evidence(data_manager.get_item(item_id, item_type))
+
+
+def test_opening_the_data_creates_nothing(dataset):
+    before = sorted(os.listdir(dataset))
+
+    data_manager = DataManager()
+    assert data_manager.get_item('ja', 'node')['Label'] == 'Jacinda Ardern'
+    assert data_manager.collect_garbage(dry_run=True) == []
+
+    assert sorted(os.listdir(dataset)) == before
+
+
+def test_shared_image_is_kept_until_its_last_reference_is_removed(dataset, managers, image):
+    data_manager = managers()
+    assert data_manager.add_evidence('ja', 'node', image, 'https://example.org', 'Example')
+    assert data_manager.add_evidence('rel1', 'edge', image)
+    stored = evidence(data_manager, 'ja')[0]['localPath']
+    assert evidence(data_manager, 'rel1', 'edge')[0]['localPath'] == stored
+
+    assert data_manager.remove_evidence('ja', 'node', 0)
+    assert os.path.exists(stored)
+
+    assert data_manager.remove_evidence('rel1', 'edge', 0)
+    assert not os.path.exists(stored)
+
+
+def test_failed_write_removes_the_new_image(dataset, managers, image, monkeypatch):
+    data_manager = managers()
+    monkeypatch.setattr(data_manager, 'update_item', lambda *args: False)
+
+    assert not data_manager.add_evidence('ja', 'node', image)
+
+    assert os.listdir('public/images') == []
+
+
+def test_failed_write_keeps_an_image_stored_meanwhile_by_someone_else(dataset, managers, image, monkeypatch):
+    data_manager = managers()
+    other = managers()
+
+    def update_item(*args):
+        # Another editor stores the same image and saves before our write fails
+        assert other.add_evidence('bmgf', 'node', image)
+        return False
+    monkeypatch.setattr(data_manager, 'update_item', update_item)
+
+    assert not data_manager.add_evidence('ja', 'node', image)
+
+    stored = evidence(other, 'bmgf')[0]['localPath']
+    assert os.path.exists(stored)
+    assert evidence(data_manager, 'ja') == []
+
+
+def test_collect_garbage_removes_unreferenced_images(dataset, managers, image):
+    data_manager = managers()
+    assert data_manager.add_evidence('ja', 'node', image)
+    kept = os.path.abspath(evidence(data_manager, 'ja')[0]['localPath'])
+    orphan = dataset / 'public' / 'images' / 'orphan.png'
+    orphan.write_bytes(b'unused')
+
+    assert data_manager.collect_garbage(dry_run=True) == [orphan.as_posix()]
+    assert orphan.exists()
+
+    data_manager.collect_garbage()
+    assert not orphan.exists()
+    assert os.path.exists(kept)
+
+
+def test_web_images_are_created_after_the_save(dataset, managers, monkeypatch):
+    Image = pytest.importorskip('PIL.Image')
+    path = dataset / 'photo.png'
+    Image.new('RGB', (400, 300), 'red').save(path)
+    data_manager = managers()
+    release = threading.Event()
+    generate = data_manager.web_images.generate
+
+    def slow_generate(*args, **kwargs):
+        release.wait(5)
+        return generate(*args, **kwargs)
+    monkeypatch.setattr(data_manager.web_images, 'generate', slow_generate)
+
+    assert data_manager.add_evidence('ja', 'node', path)
+    assert 'variants' not in evidence(data_manager, 'ja')[0]  # Saved without waiting for the encoder
+
+    release.set()
+    data_manager.wait_for_images()
+    variants = evidence(data_manager, 'ja')[0]['variants']
+    assert [variant['width'] for variant in variants] == [320, 400]
+    assert all(os.path.exists(variant['url'].lstrip('/')) for variant in variants)
+
+    # A second copy of the image finds the variants straight away
+    assert data_manager.add_evidence('bmgf', 'node', path)
+    assert evidence(data_manager, 'bmgf')[0]['variants'] == variants
+
+
+def test_remove_based_on_a_read_from_before_the_web_variants_were_added(dataset, managers):
+    Image = pytest.importorskip('PIL.Image')
+    path = dataset / 'photo.png'
+    Image.new('RGB', (400, 300), 'red').save(path)
+    data_manager = managers()
+    assert data_manager.add_evidence('ja', 'node', path, 'https://example.org', 'Example')
+    base = data_manager.get_item('ja', 'node')
+    data_manager.wait_for_images()
+    assert 'variants' in evidence(data_manager, 'ja')[0]
+
+    assert data_manager.remove_evidence_many('ja', 'node', [0], base)
+    assert evidence(data_manager, 'ja') == []
+
+
+def test_web_images_are_recorded_without_scanning_every_row(dataset, managers, monkeypatch):
+    Image = pytest.importorskip('PIL.Image')
+    path = dataset / 'photo.png'
+    Image.new('RGB', (400, 300), 'red').save(path)
+    data_manager = managers()
+    scanned = []
+    iter_items = data_manager.iter_items
+    monkeypatch.setattr(data_manager, 'iter_items', lambda *args: scanned.append(args) or iter_items(*args))
+
+    assert data_manager.add_evidence('rel1', 'edge', path)
+    data_manager.wait_for_images()
+    assert 'variants' in evidence(data_manager, 'rel1', 'edge')[0]
+    assert scanned == []
@@ -0,0 +1,58 @@
+import sys
+import subprocess
+import threading
+
+import pytest
+
+from conftest import REPO_DIR
+from file_lock import FileLock, LockTimeout, file_lock
+
+HOLD_LOCK = '''
+import sys, time
+sys.path.insert(0, sys.argv[1])
+from file_lock import file_lock
+with file_lock(sys.argv[2]):
+    print('locked', flush=True)
+    sys.stdin.readline()
+'''
+
+
+def test_lock_excludes_other_processes(tmp_path):
+    path = str(tmp_path / 'Nodes.csv')
+    holder = subprocess.Popen([sys.executable, '-c', HOLD_LOCK, REPO_DIR, path],
+                              stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True)
+    try:
+        assert holder.stdout.readline().strip() == 'locked'
+        with pytest.raises(LockTimeout):
+            FileLock(path, timeout=0.2).acquire()
+    finally:
+        holder.communicate('\n')
+
+    with FileLock(path, timeout=5):
+        pass  # Free again once the other process let go
+
+
+def test_lock_is_reentrant_and_excludes_other_threads(tmp_path):
+    lock = file_lock(str(tmp_path / 'Nodes.csv'))
+    assert file_lock(str(tmp_path / 'Nodes.csv')) is lock
+    lock.timeout = 0.2
+    acquired_elsewhere = []
+
+    def try_lock():
+        try:
+            with lock:
+                acquired_elsewhere.append(True)
+        except LockTimeout:
+            acquired_elsewhere.append(False)
+
+    with lock:
+        with lock:
+            thread = threading.Thread(target=try_lock)
+            thread.start()
+            thread.join()
+    assert acquired_elsewhere == [False]
+
+    thread = threading.Thread(target=try_lock)
+    thread.start()
+    thread.join()
+    assert acquired_elsewhere == [False, True]
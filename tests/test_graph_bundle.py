@@ -0,0 +1,83 @@
+import json
+import hashlib
+
+import pytest
+
+from data_manager import DataManager
+from graph_bundle import GraphBundleExporter, refresh_bundle
+
+
+@pytest.fixture
+def exporter(dataset):
+    return GraphBundleExporter(DataManager(), cluster_script='missing.js')
+
+
+def sha256(path):
+    with open(path, 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def edit_type(data_manager, item_id, item_type):
+    """Change a node's Type, one of the columns interned in the bundle's string table"""
+    item = data_manager.get_item(item_id, 'node')
+    item['Type'] = item_type
+    assert data_manager.update_item(item, 'node')
+
+
+def test_same_data_gives_the_same_bundle_whatever_the_history(exporter):
+    data_manager = exporter.data_manager
+    original = exporter.build()
+
+    edit_type(data_manager, 'ja', 'Politician')
+    assert 'Politician' in json.loads(exporter.build()[1])['strings']
+    edit_type(data_manager, 'ja', 'Person')
+
+    digest, data = exporter.build()
+    bundle = json.loads(data)
+    assert 'Politician' not in bundle['strings']
+    assert bundle['strings'][bundle['nodes'][0]['Type']] == 'Person'
+    assert digest == original[0]
+    assert data_manager.compact()
+    assert exporter.build() == original
+    assert GraphBundleExporter(DataManager(), cluster_script='missing.js').build() == original
+
+
+def test_sources_match_the_csv_as_the_web_view_downloads_it(exporter):
+    data_manager = exporter.data_manager
+    assert json.loads(exporter.build()[1])['sources'] == {
+        'Nodes.csv': sha256('Nodes.csv'), 'Edges.csv': sha256('Edges.csv')}
+
+    edit_type(data_manager, 'ja', 'Politician')
+    pending = json.loads(exporter.build()[1])['sources']
+    assert pending['Nodes.csv'] == hashlib.sha256(data_manager.get_table('node').to_csv_bytes()).hexdigest()
+
+    data_manager.compact()
+    assert pending['Nodes.csv'] == sha256('Nodes.csv')
+
+
+def test_refresh_bundle_only_updates_an_existing_bundle(dataset):
+    data_manager = DataManager()
+    assert refresh_bundle(data_manager, cluster_script='missing.js') is None
+    assert not (dataset / 'public').exists()
+
+    exporter = GraphBundleExporter(data_manager, cluster_script='missing.js')
+    exporter.export()
+    edit_type(data_manager, 'ja', 'Politician')
+
+    assert refresh_bundle(data_manager, cluster_script='missing.js') == exporter.build()[0]
+
+
+def test_exports_never_run_a_full_layout(exporter, dataset):
+    graph_layout = pytest.importorskip('graph_layout')
+    assert json.loads(exporter.build()[1])['positions'] == {}
+    assert not (dataset / 'public' / 'layout.json').exists()
+
+    layout = graph_layout.GraphLayout()
+    node_ids = [node['ID'] for node in exporter.data_manager.iter_items('node', ['ID'])]
+    edges = [(edge['From'], edge['To']) for edge in exporter.data_manager.iter_items('edge', ['From', 'To'])]
+    positions = layout.update(node_ids, edges, {})
+    assert (dataset / 'public' / 'layout.json').exists()
+
+    exporter = GraphBundleExporter(DataManager(), cluster_script='missing.js')
+    assert json.loads(exporter.build()[1])['positions'] == {
+        node_id: list(xy) for node_id, xy in positions.items()}
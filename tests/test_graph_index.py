@@ -0,0 +1,77 @@
+import pytest
+
+from conftest import write_csv
+from data_manager import DataManager
+from repository import CsvTable
+from storage import EDGE_COLUMNS
+
+#   a -e1-> b -e2-> c -e4-> d -e5-> a, with a shortcut a -e3-> c, and x -e6-> y on its own
+EDGES = [('e1', 'a', 'b'), ('e2', 'b', 'c'), ('e3', 'a', 'c'), ('e4', 'c', 'd'), ('e5', 'd', 'a'), ('e6', 'x', 'y')]
+
+
+@pytest.fixture
+def graph(dataset):
+    write_csv(dataset / 'Edges.csv', EDGE_COLUMNS,
+              [{'ID': edge_id, 'From': source, 'To': target, 'Label': '', 'Details': '', 'EvidenceData': '[]'}
+               for edge_id, source, target in EDGES])
+    return DataManager().graph
+
+
+def test_neighbours_follow_the_direction(graph):
+    assert graph.neighbours('c', 'out') == ['d']
+    assert graph.neighbours('c', 'in') == ['b', 'a']
+    assert graph.neighbours('c') == ['b', 'a', 'd']
+    assert graph.edges_of('a') == ['e1', 'e3', 'e5']
+    assert graph.edge_between('a', 'd') == 'e5'
+    assert graph.edge_between('a', 'd', 'out') is None
+    with pytest.raises(ValueError):
+        graph.neighbours('a', 'sideways')
+
+
+def test_shortest_path(graph):
+    assert graph.shortest_path('a', 'd', 'out') == (['a', 'c', 'd'], ['e3', 'e4'])
+    assert graph.shortest_path('a', 'd') == (['a', 'd'], ['e5'])
+    assert graph.shortest_path('d', 'b', 'in') == (['d', 'c', 'b'], ['e4', 'e2'])
+    assert graph.shortest_path('a', 'd', 'out', max_length=1) is None
+    assert graph.shortest_path('a', 'y') is None
+    assert graph.shortest_path('a', 'a') == (['a'], [])
+
+
+def test_all_simple_paths(graph):
+    assert graph.all_simple_paths('a', 'd', 3, 'out') == [
+        (['a', 'b', 'c', 'd'], ['e1', 'e2', 'e4']),
+        (['a', 'c', 'd'], ['e3', 'e4']),
+    ]
+    assert graph.all_simple_paths('a', 'd', 2, 'out') == [(['a', 'c', 'd'], ['e3', 'e4'])]
+    assert graph.all_simple_paths('a', 'y', 5) == []
+
+
+def test_k_hop(graph):
+    assert graph.k_hop('a', 1, 'out') == ({'a', 'b', 'c'}, {'e1', 'e2', 'e3'})
+    assert graph.k_hop('a', 1) == ({'a', 'b', 'c', 'd'}, {'e1', 'e2', 'e3', 'e4', 'e5'})
+    assert graph.k_hop('x', 0) == ({'x'}, set())
+
+
+def test_saved_edges_update_the_index(graph, monkeypatch):
+    data_manager = graph.data_manager
+    graph.neighbours('a')  # Built on first use
+    rebuilds = []
+    rebuild = graph.rebuild
+    monkeypatch.setattr(graph, 'rebuild', lambda: rebuilds.append(1) or rebuild())
+
+    edge = data_manager.get_item('e6', 'edge')
+    edge['From'] = 'd'
+    assert data_manager.update_item(edge, 'edge')
+
+    assert graph.neighbours('d', 'out') == ['a', 'y']  # Keeps table order: e5 comes before e6
+    assert graph.neighbours('x') == []
+    assert graph.shortest_path('a', 'y', 'out') == (['a', 'c', 'd', 'y'], ['e3', 'e4', 'e6'])
+    assert rebuilds == []
+
+    # An edit saved elsewhere is picked up by rebuilding
+    table = CsvTable('Edges.csv', compact_delay=None)
+    edge = table.get('e3')
+    edge['To'] = 'd'
+    assert table.replace(edge)
+    assert graph.shortest_path('a', 'd', 'out') == (['a', 'd'], ['e3'])
+    assert rebuilds == [1]
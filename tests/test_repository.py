@@ -0,0 +1,183 @@
+import os
+import sys
+import json
+import subprocess
+
+import pytest
+
+import repository
+from conftest import REPO_DIR, read_csv
+from repository import CsvTable, ConflictError, merge_rows
+
+
+def open_table(path='Nodes.csv'):
+    return CsvTable(path, compact_delay=None)
+
+
+def edited(table, item_id, **values):
+    item = table.get(item_id)
+    item.update(values)
+    return item
+
+
+def test_edit_is_journaled_without_rewriting_the_csv(dataset):
+    table = open_table()
+    before = (dataset / 'Nodes.csv').read_bytes()
+
+    assert table.replace(edited(table, 'ja', Label='J. Ardern'))
+
+    assert (dataset / 'Nodes.csv').read_bytes() == before
+    assert os.path.exists('Nodes.csv.journal')
+    assert table.get('ja')['Label'] == 'J. Ardern'
+    assert open_table().get('ja')['Label'] == 'J. Ardern'
+
+
+def test_compact_merges_the_journal_into_the_csv(dataset):
+    table = open_table()
+    table.replace(edited(table, 'ja', Label='J. Ardern'))
+    table.replace(edited(table, 'bmgf', Details='Funds vaccine research'))
+
+    assert table.compact()
+
+    rows = {row['ID']: row for row in read_csv('Nodes.csv')}
+    assert rows['ja']['Label'] == 'J. Ardern'
+    assert rows['bmgf']['Details'] == 'Funds vaccine research'
+    assert [row['ID'] for row in read_csv('Nodes.csv')] == ['ja', 'bmgf']
+    assert not os.path.exists('Nodes.csv.journal')
+    assert not table.compact()  # Nothing left to merge
+
+
+def test_replace_many_is_one_entry(dataset):
+    table = open_table()
+    items = [edited(table, 'ja', Label='A'), edited(table, 'bmgf', Label='B')]
+
+    assert table.replace_many(items)
+
+    assert len((dataset / 'Nodes.csv.journal').read_bytes().splitlines()) == 1
+    assert not table.replace_many([{'ID': 'missing', 'Label': 'C'}])
+
+
+def test_interrupted_append_is_ignored_and_replaced(dataset):
+    table = open_table()
+    table.replace(edited(table, 'ja', Label='J. Ardern'))
+    with open('Nodes.csv.journal', 'ab') as f:
+        f.write(b'{"op": "put", "row": {"ID": "bmgf", "Lab')  # Crashed mid-write
+
+    reader = open_table()
+    assert reader.get('ja')['Label'] == 'J. Ardern'
+    assert reader.get('bmgf')['Label'] == 'BMGF'
+
+    assert reader.replace(edited(reader, 'bmgf', Label='Gates Foundation'))
+    assert open_table().get('bmgf')['Label'] == 'Gates Foundation'
+    assert reader.compact()
+    assert {row['ID']: row['Label'] for row in read_csv('Nodes.csv')} == {
+        'ja': 'J. Ardern', 'bmgf': 'Gates Foundation'}
+
+
+def test_csv_replaced_by_someone_else_is_reloaded(dataset):
+    table = open_table()
+    assert table.get('ja')['Label'] == 'Jacinda Ardern'
+
+    text = (dataset / 'Nodes.csv').read_text(encoding='utf-8')
+    (dataset / 'Nodes.csv').write_text(text.replace('Jacinda Ardern', 'Jacinda Kate Ardern'), encoding='utf-8')
+
+    assert table.get('ja')['Label'] == 'Jacinda Kate Ardern'
+
+
+EDIT_IN_OTHER_PROCESS = '''
+import sys
+sys.path.insert(0, sys.argv[1])
+from repository import CsvTable
+table = CsvTable('Nodes.csv', compact_delay=None)
+item = table.get('ja')
+item['Label'] = sys.argv[2]
+assert table.replace(item)
+'''
+
+
+def edit_in_other_process(label):
+    subprocess.run([sys.executable, '-c', EDIT_IN_OTHER_PROCESS, REPO_DIR, label], check=True)
+
+
+def test_edit_from_another_process_during_compaction_is_kept(dataset, monkeypatch):
+    table = open_table()
+    table.replace(edited(table, 'bmgf', Label='Gates Foundation'))
+
+    # Another editor saves while the merged CSV is being written, outside the lock
+    file_mode_for = repository.file_mode_for
+
+    def edit_then_get_mode(path):
+        monkeypatch.setattr(repository, 'file_mode_for', file_mode_for)
+        edit_in_other_process('Edited elsewhere')
+        return file_mode_for(path)
+    monkeypatch.setattr(repository, 'file_mode_for', edit_then_get_mode)
+    assert table.compact()
+
+    assert table.get('ja')['Label'] == 'Edited elsewhere'
+    assert open_table().get('ja')['Label'] == 'Edited elsewhere'
+
+    # A later compaction from this process must not drop it either
+    table.replace(edited(table, 'bmgf', Details='Funds vaccine research'))
+    assert table.compact()
+    rows = {row['ID']: row for row in read_csv('Nodes.csv')}
+    assert rows['ja']['Label'] == 'Edited elsewhere'
+    assert rows['bmgf']['Label'] == 'Gates Foundation'
+    assert rows['bmgf']['Details'] == 'Funds vaccine research'
+    assert open_table().get('ja')['Label'] == 'Edited elsewhere'
+
+
+def test_edits_from_two_processes_are_merged(dataset):
+    table = open_table()
+    base = table.get('ja')
+    edit_in_other_process('Edited elsewhere')
+
+    ours = dict(base, Details='Prime Minister 2017-2023')
+    assert table.replace_many([ours], [base])
+
+    assert ours['Label'] == 'Edited elsewhere'  # Updated in place to the merged row
+    assert open_table().get('ja') == ours
+
+
+def test_conflicting_edit_is_rejected(dataset):
+    table = open_table()
+    base = table.get('ja')
+    edit_in_other_process('Edited elsewhere')
+
+    with pytest.raises(ConflictError) as raised:
+        table.replace_many([dict(base, Label='Edited here')], [base])
+
+    assert raised.value.fields == ['Label']
+    assert open_table().get('ja')['Label'] == 'Edited elsewhere'
+
+
+def test_merge_rows_merges_evidence_added_on_both_sides():
+    first = {'evidenceUrl': '/public/images/a.png', 'localPath': 'public/images/a.png'}
+    theirs_added = {'evidenceUrl': '/public/images/b.png', 'localPath': 'public/images/b.png'}
+    ours_added = {'evidenceUrl': '/public/images/c.png', 'localPath': 'public/images/c.png'}
+    base = {'ID': 'ja', 'Label': 'Jacinda Ardern', 'EvidenceData': json.dumps([first])}
+    theirs = dict(base, EvidenceData=json.dumps([first, theirs_added]))
+    ours = dict(base, Label='J. Ardern', EvidenceData=json.dumps([ours_added]))  # We removed the first one
+
+    merged = merge_rows(base, theirs, ours)
+
+    assert merged['Label'] == 'J. Ardern'
+    assert json.loads(merged['EvidenceData']) == [theirs_added, ours_added]
+
+
+def test_merge_rows_matches_evidence_whose_web_variants_were_added_meanwhile():
+    first = {'evidenceUrl': '/public/images/a.png', 'localPath': 'public/images/a.png'}
+    second = {'evidenceUrl': '/public/images/b.png', 'localPath': 'public/images/b.png'}
+    variants = [{'url': '/public/images/web/a-320.webp', 'width': 320, 'height': 240}]
+    base = {'ID': 'ja', 'EvidenceData': json.dumps([first, second])}
+
+    # They added the variants, we removed the entry
+    theirs = dict(base, EvidenceData=json.dumps([dict(first, variants=variants), second]))
+    assert json.loads(merge_rows(base, theirs, dict(base, EvidenceData=json.dumps([second])))['EvidenceData']) == [
+        second]
+
+    # We added the variants, they added an entry
+    third = {'evidenceUrl': '/public/images/c.png', 'localPath': 'public/images/c.png'}
+    theirs = dict(base, EvidenceData=json.dumps([first, second, third]))
+    ours = dict(base, EvidenceData=json.dumps([dict(first, variants=variants), second]))
+    assert json.loads(merge_rows(base, theirs, ours)['EvidenceData']) == [
+        dict(first, variants=variants), second, third]
@@ -0,0 +1,96 @@
+import os
+import sys
+import json
+import subprocess
+
+from conftest import REPO_DIR
+from data_manager import DataManager
+from repository import CsvTable
+from search_index import SearchIndex
+
+ITEMS = [
+    ('node', {'ID': 'fund', 'Label': 'Pivotal Ventures', 'Type': 'Organisation', 'Details': ''}),
+    ('node', {'ID': 'f2', 'Label': 'Funding Round', 'Type': 'Event', 'Details': ''}),
+    ('node', {'ID': 'f3', 'Label': 'Fund', 'Type': 'Organisation', 'Details': ''}),
+    ('node', {'ID': 'f4', 'Label': 'Refunds', 'Type': 'Event', 'Details': ''}),
+    ('node', {'ID': 'f5', 'Label': 'Other', 'Type': 'Person', 'Details': 'funded by the foundation'}),
+    ('edge', {'ID': 'e1', 'Label': 'Funds', 'Type': '', 'Details': ''}),
+    ('edge', {'ID': 'e2', 'Label': 'Funds', 'Type': '', 'Details': ''}),
+    ('node', {'ID': 'f6', 'Label': 'Funds', 'Type': 'Organisation', 'Details': ''}),
+]
+
+# Indexes the same items in a fresh interpreter, so set and hash ordering differ from this one
+SEARCH_SCRIPT = '''
+import sys, json
+sys.path.insert(0, sys.argv[1])
+from search_index import SearchIndex
+index = SearchIndex()
+for item_type, item in json.loads(sys.argv[2]):
+    index.add(item_type, item)
+print(json.dumps(index.search(sys.argv[3])))
+'''
+
+
+def make_index(items=ITEMS):
+    index = SearchIndex()
+    for item_type, item in items:
+        index.add(item_type, item)
+    return index
+
+
+def ids(results):
+    return [item_id for _, item_id, _ in results]
+
+
+def test_exact_then_prefix_then_substring_then_other_matches():
+    assert ids(make_index().search('fund')) == [
+        'fund',  # ID
+        'f3',  # Label
+        'e1', 'e2', 'f6', 'f2',  # Label prefix, shorter labels first, then by label and key
+        'f4',  # Label substring
+        'f5',  # Details
+    ]
+
+
+def test_results_are_limited_and_filtered_by_type():
+    index = make_index()
+    assert ids(index.search('fund', limit=3)) == ['fund', 'f3', 'e1']
+    assert ids(index.search('fund', item_type='edge')) == ['e1', 'e2']
+    assert ids(index.search('fund found')) == ['f5']  # Every word has to match
+    assert index.search('missing') == []
+
+
+def test_equal_matches_come_back_in_the_same_order_in_every_process():
+    items = [('node', {'ID': f'n{i}', 'Label': 'Grant Revenue', 'Type': '', 'Details': ''})
+             for i in (7, 3, 12, 1, 5)]
+    results = []
+    for seed in ('1', '2'):
+        output = subprocess.run(
+            [sys.executable, '-c', SEARCH_SCRIPT, REPO_DIR, json.dumps(items), 'grant rev'],
+            env=dict(os.environ, PYTHONHASHSEED=seed), capture_output=True, text=True, check=True).stdout
+        results.append([tuple(result) for result in json.loads(output)])
+    assert results[0] == results[1] == make_index(items).search('grant rev')
+    assert ids(results[0]) == ['n1', 'n12', 'n3', 'n5', 'n7']
+
+
+def test_saved_items_are_reindexed(dataset):
+    data_manager = DataManager()
+    index = SearchIndex(data_manager)
+    index.rebuild()
+    assert ids(index.search('jacinda')) == ['ja']
+
+    item = data_manager.get_item('ja', 'node')
+    item['Label'] = 'Prime Minister'
+    assert data_manager.update_item(item, 'node')
+    versions = index._versions
+    assert index.search('jacinda') == []
+    assert index.search('minister') == [('node', 'ja', 'Prime Minister')]
+    assert index._versions == versions  # Updated from the listener, not rebuilt
+
+    # A change made elsewhere is picked up by rebuilding on the next search
+    table = CsvTable('Edges.csv', compact_delay=None)
+    edge = table.get('rel1')
+    edge['Label'] = 'Sponsors'
+    assert table.replace(edge)
+    assert ids(index.search('sponsors')) == ['rel1']
+    assert index.search('funds') == []
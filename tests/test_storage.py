@@ -0,0 +1,96 @@
+import json
+
+import pytest
+
+from conftest import read_csv, write_csv
+from repository import ConflictError
+from storage import SqliteBackend, NODE_COLUMNS
+
+
+@pytest.fixture
+def open_db(dataset):
+    """Open SQLite backends on one database, as separate editors would, and close them afterwards"""
+    backends = []
+
+    def open_backend():
+        backends.append(SqliteBackend.from_csv('evidence.db'))
+        return backends[-1]
+    yield open_backend
+    for backend in backends:
+        backend.close()
+
+
+def test_csv_round_trip_keeps_rows_columns_and_evidence(dataset, open_db):
+    evidence = [{'evidenceUrl': '/public/images/a.png', 'localPath': 'public/images/a.png', 'sourceUrl': '',
+                 'sourceLabel': 'Example', 'variants': [{'url': '/public/images/web/a.png.320w.webp',
+                                                         'width': 320, 'height': 240}]}]
+    rows = [{'ID': 'ja', 'Label': 'Jacinda Ardern', 'Type': 'Person', 'Details': 'Line one\nline "two"',
+             'EvidenceData': json.dumps(evidence), 'ImageUrl': '', 'Notes': 'Kept'},
+            {'ID': 'bmgf', 'Label': 'BMGF', 'Type': 'Organisation', 'Details': '', 'EvidenceData': '[]',
+             'ImageUrl': '', 'Notes': ''}]
+    write_csv(dataset / 'Nodes.csv', NODE_COLUMNS + ['Notes'], rows)
+    edges = read_csv('Edges.csv')
+
+    backend = open_db()
+    assert backend.tables['node'].get('ja')['Notes'] == 'Kept'
+    assert json.loads(backend.tables['node'].get('ja')['EvidenceData']) == evidence
+
+    (dataset / 'Nodes.csv').unlink()
+    backend.compact()  # Writes the CSV files back
+
+    assert read_csv('Nodes.csv') == rows
+    assert read_csv('Edges.csv') == edges
+    assert list(read_csv('Nodes.csv')[0]) == NODE_COLUMNS + ['Notes']
+
+
+def test_commits_from_another_connection_are_seen(dataset, open_db):
+    ours, theirs = open_db(), open_db()
+    table = ours.tables['node']
+    assert table.get('ja')['Label'] == 'Jacinda Ardern'
+    version = table.version
+
+    item = theirs.tables['node'].get('ja')
+    item['Label'] = 'J. Ardern'
+    assert theirs.tables['node'].replace(item)
+
+    assert table.get('ja')['Label'] == 'J. Ardern'
+    assert table.version > version
+    assert [record['Label'] for record in table.records(['ID', 'Label'])] == ['J. Ardern', 'BMGF']
+
+
+def test_edits_from_two_connections_are_merged(dataset, open_db):
+    ours, theirs = open_db(), open_db()
+    base = ours.tables['node'].get('ja')
+    first = {'evidenceUrl': '/public/images/a.png', 'localPath': 'public/images/a.png',
+             'sourceUrl': '', 'sourceLabel': ''}
+    second = dict(first, evidenceUrl='/public/images/b.png', localPath='public/images/b.png')
+    assert theirs.tables['node'].replace(dict(base, Label='J. Ardern', EvidenceData=json.dumps([first])))
+
+    item = dict(base, Details='Prime Minister 2017-2023', EvidenceData=json.dumps([second]))
+    assert ours.tables['node'].replace_many([item], [base])
+
+    stored = theirs.tables['node'].get('ja')
+    assert (stored['Label'], stored['Details']) == ('J. Ardern', 'Prime Minister 2017-2023')
+    assert json.loads(stored['EvidenceData']) == [first, second]
+    assert stored == item  # Updated in place to the merged row
+
+
+def test_conflicting_edit_is_rejected(dataset, open_db):
+    ours, theirs = open_db(), open_db()
+    base = ours.tables['node'].get('ja')
+    assert theirs.tables['node'].replace(dict(base, Label='Edited elsewhere'))
+
+    with pytest.raises(ConflictError) as raised:
+        ours.tables['node'].replace_many([dict(base, Label='Edited here', Details='Also changed')], [base])
+
+    assert raised.value.fields == ['Label']
+    stored = theirs.tables['node'].get('ja')
+    assert (stored['Label'], stored['Details']) == ('Edited elsewhere', '')  # Rolled back as a whole
+
+
+def test_unknown_id_changes_nothing(dataset, open_db):
+    table = open_db().tables['node']
+    items = [dict(table.get('ja'), Label='A'), {'ID': 'missing', 'Label': 'B'}]
+
+    assert not table.replace_many(items)
+    assert table.get('ja')['Label'] == 'Jacinda Ardern'
@@ -0,0 +1,66 @@
+import json
+
+import pytest
+
+from thumbnails import ThumbnailCache
+
+Image = pytest.importorskip('PIL.Image')
+
+SIZE = (32, 32)
+
+
+@pytest.fixture
+def images(tmp_path):
+    paths = []
+    for i in range(20):
+        path = tmp_path / f"source{i}.png"
+        Image.new('RGB', (64, 48), (i * 10, 0, 0)).save(path)
+        paths.append(path)
+    return paths
+
+
+def thumbnail_files(cache):
+    return sorted(path.name for path in cache.cache_dir.glob('*.png'))
+
+
+def test_index_is_written_in_batches(tmp_path, images):
+    cache = ThumbnailCache(tmp_path / 'thumbs', save_delay=60)
+    for path in images:
+        cache.get(path, SIZE)
+    assert not cache.index_path.exists()  # Fewer than INDEX_SAVE_MIN_PENDING new hashes
+
+    cache.flush()
+
+    assert len(json.loads(cache.index_path.read_text())) == len(images)
+    reopened = ThumbnailCache(tmp_path / 'thumbs')
+    assert reopened.source_hash(images[0]) == cache.source_hash(images[0])
+    assert not reopened._unsaved
+
+
+def test_least_recently_used_thumbnails_are_evicted(tmp_path, images):
+    cache = ThumbnailCache(tmp_path / 'thumbs', save_delay=60)
+    first = cache.get(images[0], SIZE)
+    size = first.stat().st_size
+    cache.max_bytes = size * 3
+
+    second = cache.get(images[1], SIZE)
+    cache.get(images[2], SIZE)
+    cache.get(images[0], SIZE)  # Now the most recently used
+    newest = cache.get(images[3], SIZE)
+
+    assert not second.exists()
+    assert first.exists() and newest.exists()
+    assert cache._total_bytes == sum(path.stat().st_size for path in cache.cache_dir.glob('*.png'))
+    assert cache._total_bytes <= cache.max_bytes
+
+
+def test_invalidate_removes_thumbnails(tmp_path, images):
+    cache = ThumbnailCache(tmp_path / 'thumbs', save_delay=60)
+    path = cache.get(images[0], SIZE)
+    cache.get(images[1], SIZE)
+
+    cache.invalidate(images[0])
+
+    assert not path.exists()
+    assert len(thumbnail_files(cache)) == 1
+    assert cache._total_bytes == sum(path.stat().st_size for path in cache.cache_dir.glob('*.png'))
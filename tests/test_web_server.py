@@ -0,0 +1,122 @@
+import csv
+import gzip
+import hashlib
+import threading
+from io import StringIO
+from http.client import HTTPConnection
+
+import pytest
+
+from repository import CsvTable
+from web_server import WebServer, IMMUTABLE_CACHE, REVALIDATE_CACHE
+
+
+@pytest.fixture
+def get(dataset):
+    """GET (or another method) a path from a server on an ephemeral port; returns (status, headers, body)"""
+    server = WebServer(('127.0.0.1', 0), str(dataset), quiet=True)
+    thread = threading.Thread(target=server.serve_forever, args=(0.05,), daemon=True)
+    thread.start()
+
+    def request(path, method='GET', **headers):
+        connection = HTTPConnection(*server.server_address, timeout=5)
+        try:
+            connection.request(method, path, headers={name.replace('_', '-'): value
+                                                      for name, value in headers.items()})
+            response = connection.getresponse()
+            return response.status, response.headers, response.read()
+        finally:
+            connection.close()
+    yield request
+    server.shutdown()
+    server.server_close()
+
+
+def test_unchanged_files_are_not_modified(dataset, get):
+    status, headers, body = get('/Nodes.csv')
+    assert status == 200
+    assert body == (dataset / 'Nodes.csv').read_bytes()
+    assert headers['ETag'] == f'"{hashlib.sha256(body).hexdigest()[:32]}"'
+    assert headers['Cache-Control'] == REVALIDATE_CACHE
+
+    status, headers, body = get('/Nodes.csv', If_None_Match=f'W/{headers["ETag"]}')
+    assert (status, body) == (304, b'')
+
+    (dataset / 'Nodes.csv').write_bytes(b'ID,Label\n')
+    assert get('/Nodes.csv', If_None_Match=headers['ETag'])[0] == 200
+
+
+def test_byte_ranges(dataset, get):
+    data = (dataset / 'Nodes.csv').read_bytes()
+    etag = get('/Nodes.csv', 'HEAD')[1]['ETag']
+
+    status, headers, body = get('/Nodes.csv', Range='bytes=2-11', If_Range=etag)
+    assert (status, body) == (206, data[2:12])
+    assert headers['Content-Range'] == f'bytes 2-11/{len(data)}'
+    assert get('/Nodes.csv', Range='bytes=-5')[2] == data[-5:]
+
+    # A partial copy of an older version gets the whole file
+    status, headers, body = get('/Nodes.csv', Range='bytes=2-11', If_Range='"stale"')
+    assert (status, body) == (200, data)
+
+    status, headers, body = get('/Nodes.csv', Range=f'bytes={len(data)}-')
+    assert status == 416
+    assert headers['Content-Range'] == f'bytes */{len(data)}'
+
+
+def test_precompressed_copy_is_used_only_while_it_matches(dataset, get):
+    public = dataset / 'public'
+    public.mkdir()
+    (public / 'graph.json').write_bytes(b'{"format":1}')
+    (public / 'graph.json.gz').write_bytes(gzip.compress(b'{"format":1}', mtime=0))
+
+    status, headers, body = get('/public/graph.json', Accept_Encoding='gzip')
+    assert headers['Content-Encoding'] == 'gzip'
+    assert body == (public / 'graph.json.gz').read_bytes()
+    assert headers['Vary'] == 'Accept-Encoding'
+
+    # A copy left over from the previous export is not sent; the file is gzipped on the fly
+    (public / 'graph.json').write_bytes(b'{"format":2}')
+    status, headers, body = get('/public/graph.json', Accept_Encoding='gzip')
+    assert gzip.decompress(body) == b'{"format":2}'
+    assert get('/public/graph.json', Accept_Encoding='identity')[2] == b'{"format":2}'
+
+
+def test_csv_is_served_with_its_journal_applied(dataset, get):
+    table = CsvTable('Nodes.csv', compact_delay=None)
+    item = table.get('ja')
+    item['Label'] = 'J. Ardern'
+    assert table.replace(item)
+    assert (dataset / 'Nodes.csv.journal').stat().st_size
+
+    status, headers, body = get('/Nodes.csv')
+    rows = list(csv.DictReader(StringIO(body.decode('utf-8'))))
+    assert [row['Label'] for row in rows] == ['J. Ardern', 'BMGF']
+    assert headers['ETag'] == f'"{hashlib.sha256(body).hexdigest()[:32]}"'
+    assert get('/Nodes.csv', If_None_Match=headers['ETag'])[0] == 304
+
+    assert table.compact()
+    assert get('/Nodes.csv')[2] == (dataset / 'Nodes.csv').read_bytes()
+
+
+def test_only_the_web_view_files_are_served(dataset, get):
+    (dataset / 'secret.txt').write_text('secret')
+    (dataset / 'public').mkdir()
+    (dataset / 'public' / '.hidden').write_text('hidden')
+    (dataset / 'Nodes.csv.journal').write_text('')
+    for path in ('/secret.txt', '/public/../secret.txt', '/public/%2e%2e/secret.txt', '/public/.hidden',
+                 '/Nodes.csv.journal', '/.git/config', '/js/missing.js'):
+        assert get(path)[0] == 404, path
+
+
+def test_only_content_hashed_originals_are_immutable(dataset, get):
+    images = dataset / 'public' / 'images'
+    (images / 'web').mkdir(parents=True)
+    original = images / f"{hashlib.sha256(b'image').hexdigest()}.png"
+    original.write_bytes(b'image')
+    variant = images / 'web' / f"{original.name}.320w.webp"
+    variant.write_bytes(b'variant')
+
+    assert get(f'/public/images/{original.name}')[1]['Cache-Control'] == IMMUTABLE_CACHE
+    # Re-encoding a variant keeps its name
+    assert get(f'/public/images/web/{variant.name}')[1]['Cache-Control'] == REVALIDATE_CACHE
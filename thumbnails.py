@@ -0,0 +1,242 @@
+import os
+import json
+import atexit
+import tempfile
+import threading
+from collections import OrderedDict
+from pathlib import Path
+
+from blob_store import file_sha256
+from instrumentation import timed, count, report_error
+
+THUMBNAIL_DIRNAME = '.thumbs'  # Cache directory, created inside the images directory
+THUMBNAIL_MAX_BYTES = 200 * 1024 * 1024  # Default size limit before least recently used entries are evicted
+INDEX_FILENAME = 'index.json'
+INDEX_SAVE_DELAY = 2.0  # Seconds without new hashes before the index is written
+INDEX_SAVE_MIN_PENDING = 100  # Write during a long run of misses once this many hashes, or half the index, are unsaved
+
+
+def fit_size(width, height, max_width, max_height):
+    """Scale (width, height) to fit inside the bounds, keeping the aspect ratio"""
+    ratio = min(max_width / width, max_height / height)
+    return (max(1, int(width * ratio)), max(1, int(height * ratio)))
+
+
+class ThumbnailCache:
+    """Disk-backed cache of pre-scaled evidence images.
+
+    Thumbnails are keyed by the SHA-256 of the source file's contents and the
+    target size, so identical images share entries and an edited file never
+    serves a stale thumbnail. Source hashes are remembered per path (by mtime
+    and size) so a cache hit only has to read the small thumbnail; new hashes
+    are written to the index in batches, shortly after the last one or at
+    exit. Once the cache grows past max_bytes the least recently used
+    thumbnails are removed. The directory is scanned once for their sizes and
+    use order, which are then kept up to date in memory.
+    """
+
+    def __init__(self, cache_dir, max_bytes=THUMBNAIL_MAX_BYTES, save_delay=INDEX_SAVE_DELAY):
+        self.cache_dir = Path(cache_dir)
+        self.max_bytes = max_bytes
+        self.save_delay = save_delay
+        self.index_path = self.cache_dir / INDEX_FILENAME
+        self._lock = threading.RLock()
+        self._hashes = None  # source path -> [mtime_ns, size, sha256]
+        self._unsaved = 0  # Index changes not written yet
+        self._save_timer = None
+        self._entries = None  # Thumbnail file name -> size, least recently used first
+        self._total_bytes = 0
+        atexit.register(self.flush)
+
+    def _load_index(self):
+        if self._hashes is not None:
+            return
+        self._hashes = {}
+        try:
+            with open(self.index_path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            if isinstance(data, dict):
+                self._hashes = data
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            report_error(f"Error reading thumbnail index {self.index_path}: {e}")
+
+    def _index_changed(self):
+        """Save the index after a quiet period, or now if many changes are pending (call with _lock held).
+
+        The batch that forces a write grows with the index, so a cold pass over
+        many images writes it a bounded number of times per doubling.
+        """
+        self._unsaved += 1
+        if self._save_timer is not None:
+            self._save_timer.cancel()
+            self._save_timer = None
+        if self._unsaved >= max(INDEX_SAVE_MIN_PENDING, len(self._hashes) // 2):
+            self.flush()
+            return
+        self._save_timer = threading.Timer(self.save_delay, self.flush)
+        self._save_timer.daemon = True
+        self._save_timer.start()
+
+    def flush(self):
+        """Write source hashes not saved to the index yet"""
+        with self._lock:
+            if self._save_timer is not None:
+                self._save_timer.cancel()
+                self._save_timer = None
+            if not self._unsaved:
+                return
+            try:
+                self.cache_dir.mkdir(parents=True, exist_ok=True)
+                fd, tmp_path = tempfile.mkstemp(prefix='.index.', suffix='.tmp', dir=self.cache_dir)
+                with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                    json.dump(self._hashes, f)
+                os.replace(tmp_path, self.index_path)
+                self._unsaved = 0
+                count('bytes_written', os.path.getsize(self.index_path))
+            except Exception as e:
+                # Not fatal, the hashes are recomputed next time
+                report_error(f"Error writing thumbnail index {self.index_path}: {e}")
+
+    def _key(self, source_path):
+        return Path(os.path.abspath(source_path)).as_posix()
+
+    def source_hash(self, source_path):
+        """Return the content hash of a source image, reusing it while the file is unchanged"""
+        st = os.stat(source_path)
+        key = self._key(source_path)
+        with self._lock:
+            self._load_index()
+            cached = self._hashes.get(key)
+            if cached and cached[0] == st.st_mtime_ns and cached[1] == st.st_size:
+                return cached[2]
+        digest = file_sha256(source_path)
+        with self._lock:
+            self._hashes[key] = [st.st_mtime_ns, st.st_size, digest]
+            self._index_changed()
+        return digest
+
+    def thumbnail_path(self, digest, size):
+        width, height = size
+        return self.cache_dir / f"{digest}_{width}x{height}.png"
+
+    def get(self, source_path, size):
+        """Return the path of the thumbnail for source_path, generating it if needed"""
+        path = self.thumbnail_path(self.source_hash(source_path), size)
+        if path.exists():
+            # Touch the entry so it counts as recently used, here and by the next run's scan
+            try:
+                os.utime(path)
+            except OSError:
+                pass
+            with self._lock:
+                if self._entries is not None and path.name in self._entries:
+                    self._entries.move_to_end(path.name)
+            return path
+        return self._generate(source_path, size, path)
+
+    def generate(self, source_path, size, digest=None):
+        """Create the thumbnail for source_path ahead of time.
+
+        Passing the content hash, if already known, skips hashing the file and
+        updating the hash index (the hash is recorded on first view instead).
+        """
+        if digest is None:
+            return self.get(source_path, size)
+        path = self.thumbnail_path(digest, size)
+        if path.exists():
+            return path
+        return self._generate(source_path, size, path)
+
+    @timed(log=False)
+    def load(self, source_path, size):
+        """Return the thumbnail for source_path as a loaded PIL image"""
+        from PIL import Image  # Imported on first use, so reading the data never loads PIL
+        try:
+            img = Image.open(self.get(source_path, size))
+        except FileNotFoundError:
+            # Evicted by another thread between lookup and open; create it again
+            img = Image.open(self._generate(source_path, size, self.thumbnail_path(self.source_hash(source_path), size)))
+        with img:
+            img.load()
+            count('images_decoded')
+            return img
+
+    @timed(log=False)
+    def _generate(self, source_path, size, path):
+        from PIL import Image
+        count('images_decoded')
+        with Image.open(source_path) as img:
+            img = img.resize(fit_size(img.width, img.height, *size), Image.Resampling.LANCZOS)
+        if img.mode not in ('RGB', 'RGBA', 'L', 'LA', 'P'):
+            img = img.convert('RGBA')
+
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(prefix='.thumb.', suffix='.tmp', dir=self.cache_dir)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                img.save(f, format='PNG')
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+        with self._lock:
+            written = path.stat().st_size
+            count('bytes_written', written)
+            self._load_entries()
+            self._total_bytes -= self._entries.pop(path.name, 0)  # Replaced behind our back
+            self._entries[path.name] = written
+            self._total_bytes += written
+            self._evict(keep=path.name)
+        return path
+
+    def _load_entries(self):
+        """Scan the cache directory once for the thumbnails' sizes and use order (call with _lock held)"""
+        if self._entries is not None:
+            return
+        try:
+            found = []
+            for entry in os.scandir(self.cache_dir):
+                if entry.is_file() and entry.name.endswith('.png'):
+                    st = entry.stat()
+                    found.append((st.st_mtime_ns, entry.name, st.st_size))
+        except FileNotFoundError:
+            found = []
+        found.sort()
+        self._entries = OrderedDict((name, size) for _, name, size in found)
+        self._total_bytes = sum(self._entries.values())
+
+    def _remove_entry(self, name):
+        self._total_bytes -= self._entries.pop(name)
+        try:
+            os.remove(self.cache_dir / name)
+        except OSError:
+            pass  # Already gone, e.g. removed by another process
+
+    def _evict(self, keep=None):
+        """Remove least recently used thumbnails until the cache fits in max_bytes"""
+        while self._total_bytes > self.max_bytes:
+            name = next((name for name in self._entries if name != keep), None)
+            if name is None:
+                break
+            self._remove_entry(name)
+
+    def invalidate(self, source_path):
+        """Drop all thumbnails of a source image, e.g. when its evidence is removed"""
+        key = self._key(source_path)
+        with self._lock:
+            self._load_index()
+            cached = self._hashes.pop(key, None)
+            if cached is None:
+                return
+            digest = cached[2]
+            self._index_changed()
+            # Keep the thumbnails if another source file still has the same contents
+            if any(entry[2] == digest for entry in self._hashes.values()):
+                return
+            self._load_entries()
+            for name in [name for name in self._entries if name.startswith(f"{digest}_")]:
+                self._remove_entry(name)
@@ -0,0 +1,145 @@
+import os
+import re
+import tempfile
+from pathlib import Path
+
+from instrumentation import timed, count
+
+WEB_IMAGES_DIRNAME = 'web'  # Variant directory, created inside the images directory
+WEB_IMAGE_WIDTHS = (320, 800, 1600)  # Variant widths in pixels; smaller images are never enlarged
+WEB_IMAGE_QUALITY = 82  # Lossy WebP quality; text in screenshots stays readable down to about 75
+WEB_IMAGE_METHOD = 4  # WebP encoder effort, 0 (fast) to 6 (smallest)
+WEB_IMAGE_EXT = '.webp'
+ORIENTATION_TAG = 0x0112
+
+_VARIANT_PATTERN = re.compile(r'^(.+)\.(\d+)w' + re.escape(WEB_IMAGE_EXT) + '$')
+
+
+def _upright_size(img):
+    """Size of an opened image once rotated by its EXIF orientation, without decoding it"""
+    # Only formats whose EXIF sits in the header; PNG would have to decode the image to find it
+    if img.format in ('JPEG', 'MPO', 'TIFF', 'WEBP') and img.getexif().get(ORIENTATION_TAG) in (5, 6, 7, 8):
+        return img.height, img.width
+    return img.size
+
+
+def variant_widths(width):
+    """Widths of the variants of an image `width` pixels wide.
+
+    Every step narrower than the image, plus the image's own width if it is
+    within the largest step, so the biggest variant is never blurrier than
+    the original needs to be.
+    """
+    widths = [step for step in WEB_IMAGE_WIDTHS if step < width]
+    if width <= WEB_IMAGE_WIDTHS[-1]:
+        widths.append(width)
+    return widths
+
+
+class WebImages:
+    """Resized WebP copies of evidence images for the web view's srcset.
+
+    Variants are named after the source file ("<name>.<width>w.webp"), and
+    since stored images are named by their content hash a variant that
+    exists and is newer than its source is up to date. Variants carry no
+    EXIF, ICC or XMP metadata and are rotated upright first, as the
+    orientation tag is dropped with the rest.
+    """
+
+    def __init__(self, directory, url_prefix):
+        self.directory = Path(directory)
+        self.url_prefix = url_prefix.rstrip('/')
+
+    def variant_path(self, source_path, width):
+        return self.directory / f"{Path(source_path).name}.{width}w{WEB_IMAGE_EXT}"
+
+    def _entry(self, source_path, width, source_size):
+        height = max(1, round(source_size[1] * width / source_size[0]))
+        return {'url': f"{self.url_prefix}/{self.variant_path(source_path, width).name}",
+                'width': width, 'height': height}
+
+    def variants(self, source_path):
+        """Evidence 'variants' entries for source_path if all its variants are up to date, else None"""
+        from PIL import Image  # Imported on first use, so reading the data never loads PIL
+        try:
+            source_mtime = os.stat(source_path).st_mtime_ns
+            with Image.open(source_path) as img:  # Reads the header only
+                size = _upright_size(img)
+        except (OSError, Image.DecompressionBombError):
+            return None
+        entries = []
+        for width in variant_widths(size[0]):
+            try:
+                if os.stat(self.variant_path(source_path, width)).st_mtime_ns < source_mtime:
+                    return None
+            except FileNotFoundError:
+                return None
+            entries.append(self._entry(source_path, width, size))
+        return entries
+
+    @timed(log=False)
+    def generate(self, source_path, force=False):
+        """Write the variants of source_path unless they are up to date; returns their evidence entries"""
+        if not force:
+            entries = self.variants(source_path)
+            if entries is not None:
+                return entries
+
+        from PIL import Image, ImageOps
+        count('images_decoded')
+        with Image.open(source_path) as img:
+            img = ImageOps.exif_transpose(img)
+        if img.mode not in ('RGB', 'RGBA'):
+            has_alpha = 'A' in img.getbands() or 'transparency' in img.info
+            img = img.convert('RGBA' if has_alpha else 'RGB')
+
+        self.directory.mkdir(parents=True, exist_ok=True)
+        widths = variant_widths(img.width)
+        replacing = any(self.variant_path(source_path, width).exists() for width in {*WEB_IMAGE_WIDTHS, *widths})
+        entries = []
+        for width in widths:
+            entry = self._entry(source_path, width, img.size)
+            variant = img if width == img.width else img.resize(
+                (width, entry['height']), Image.Resampling.LANCZOS, reducing_gap=3.0)
+            self._write(variant, self.variant_path(source_path, width))
+            entries.append(entry)
+        if replacing:
+            # Drop variants of an older version of the file at widths no longer produced
+            self.remove(source_path, keep={Path(entry['url']).name for entry in entries})
+        return entries
+
+    def _write(self, img, path):
+        fd, tmp_path = tempfile.mkstemp(prefix='.web.', suffix='.tmp', dir=self.directory)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                # No exif/icc_profile/xmp arguments: the variant is written without metadata
+                img.save(f, format='WEBP', quality=WEB_IMAGE_QUALITY, method=WEB_IMAGE_METHOD)
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        count('bytes_written', path.stat().st_size)
+
+    def _entries(self):
+        try:
+            return [entry for entry in os.scandir(self.directory)
+                    if entry.is_file() and _VARIANT_PATTERN.match(entry.name)]
+        except FileNotFoundError:
+            return []
+
+    def remove(self, source_path, keep=()):
+        """Delete the variants of a source image, except the file names in keep"""
+        name = Path(source_path).name
+        for entry in self._entries():
+            if _VARIANT_PATTERN.match(entry.name).group(1) == name and entry.name not in keep:
+                try:
+                    os.remove(entry.path)
+                except OSError:
+                    pass
+
+    def orphans(self, source_dir):
+        """Paths of variants whose source file no longer exists in source_dir"""
+        source_dir = Path(source_dir)
+        return [entry.path for entry in self._entries()
+                if not (source_dir / _VARIANT_PATTERN.match(entry.name).group(1)).exists()]
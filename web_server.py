@@ -0,0 +1,380 @@
+"""Serve the web view, its data and the evidence images with HTTP caching.
+
+    python web_server.py
+    python web_server.py --port 8080 --bind 0.0.0.0
+
+Every response carries a strong ETag derived from its contents (the start
+of their SHA-256, which the web view compares with the graph bundle's
+CSV hashes), so a reload revalidates with If-None-Match and gets an empty 304 back for
+anything unchanged. Files named by the hash of their own contents (the
+evidence images in the BlobStore) are cacheable for a year and are not
+requested again at all; their web variants are not, as re-encoding one
+keeps its name. Text is sent compressed: the gzip and brotli copies that
+graph_bundle.py writes are used when they match the file, anything else
+is gzipped once and kept in memory. Byte ranges are supported, and each
+connection is handled on its own thread.
+
+Nothing is cached across changes on disk. Files are checked on every
+request, and while Nodes.csv or Edges.csv has edits in its journal
+that have not been compacted yet, the CSV is served with them applied.
+"""
+import os
+import re
+import gzip
+import hashlib
+import argparse
+import mimetypes
+import threading
+from collections import OrderedDict
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import urlsplit, unquote
+
+from repository import CsvTable, JOURNAL_SUFFIX
+
+try:
+    import brotli
+except ImportError:  # Optional; .br copies are then never served
+    brotli = None
+
+DEFAULT_PORT = 8000  # The editor's WEB_URL_BASE points here
+SERVED_PATHS = ('index.html', 'favicon.ico', 'Nodes.csv', 'Edges.csv', 'js/', 'css/', 'public/')
+JOURNALED_CSVS = ('Nodes.csv', 'Edges.csv')
+IMMUTABLE_CACHE = 'public, max-age=31536000, immutable'  # Content-hashed files never change
+REVALIDATE_CACHE = 'no-cache'  # Cache, but check the ETag before every use
+COMPRESSIBLE_TYPES = ('text/', 'application/json', 'application/javascript', 'image/svg+xml')
+COMPRESS_CACHE_BYTES = 64 * 1024 * 1024  # Memory for gzipped copies of files without a precompressed one
+COMPRESS_MAX_BYTES = 32 * 1024 * 1024  # Larger files are sent uncompressed rather than gzipped on the fly
+HASH_CHUNK_BYTES = 1024 * 1024
+
+_CONTENT_HASH_NAME = re.compile(r'^[0-9a-f]{64}\.[^.]+$')  # BlobStore names: SHA-256 of the contents, extension
+_RANGE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+mimetypes.add_type('image/webp', '.webp')
+mimetypes.add_type('text/javascript', '.js')
+mimetypes.add_type('text/csv', '.csv')
+
+
+def _content_type(path):
+    content_type = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+    if content_type.startswith('text/') or content_type == 'application/json':
+        content_type += '; charset=utf-8'
+    return content_type
+
+
+def _signature(st):
+    return (st.st_mtime_ns, st.st_size, st.st_ino)
+
+
+def _accepted_encodings(header):
+    """Content codings the client accepts, ignoring those it gave q=0"""
+    accepted = set()
+    for part in (header or '').split(','):
+        coding, _, params = part.strip().partition(';')
+        params = params.replace(' ', '')
+        if coding and params not in ('q=0', 'q=0.0', 'q=0.00', 'q=0.000'):
+            accepted.add(coding.lower())
+    return accepted
+
+
+class Representation:
+    """One way of sending a resource: a file on disk or bytes in memory, possibly compressed"""
+
+    def __init__(self, etag, content_type, cache_control, length, path=None, data=None, encoding=None):
+        self.etag = etag
+        self.content_type = content_type
+        self.cache_control = cache_control
+        self.length = length
+        self.path = path
+        self.data = data
+        self.encoding = encoding
+
+
+class Site:
+    """Maps request paths to representations, caching whatever is derived from file contents.
+
+    Content hashes are kept per file and recomputed only when the file's
+    mtime, size or inode changes; compressed copies are kept in a bounded
+    least recently used cache.
+    """
+
+    def __init__(self, root='.'):
+        self.root = Path(root).resolve()
+        self._lock = threading.Lock()
+        self._digests = {}  # path -> (signature, sha256)
+        self._precompressed = {}  # (path, encoding) -> (source signature, copy signature, matches)
+        self._compressed = OrderedDict()  # (path, signature) -> gzipped bytes
+        self._compressed_bytes = 0
+        self._tables = {name: CsvTable(str(self.root / name), compact_delay=None) for name in JOURNALED_CSVS}
+        self._rendered = {}  # CSV name -> (table version, representation)
+
+    def resolve(self, url_path):
+        """File path for a request path, or None if it is not served"""
+        relative = unquote(url_path).lstrip('/') or 'index.html'
+        parts = relative.split('/')
+        if any(part in ('', '.', '..') or part.startswith('.') for part in parts[:-1]) or parts[-1].startswith('.'):
+            return None
+        if relative.endswith('/'):
+            relative += 'index.html'
+        if not any(relative == allowed or (allowed.endswith('/') and relative.startswith(allowed))
+                   for allowed in SERVED_PATHS):
+            return None
+        path = (self.root / relative).resolve()
+        if self.root not in path.parents or not path.is_file():
+            return None
+        return path
+
+    def _digest(self, path, st):
+        signature = _signature(st)
+        with self._lock:
+            cached = self._digests.get(path)
+        if cached is not None and cached[0] == signature:
+            return cached[1]
+        digest = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(HASH_CHUNK_BYTES), b''):
+                digest.update(chunk)
+        digest = digest.hexdigest()
+        with self._lock:
+            self._digests[path] = (signature, digest)
+        return digest
+
+    def identity(self, path):
+        """The uncompressed representation of a served file"""
+        if path.parent == self.root and path.name in self._tables:
+            rendered = self._render_journaled_csv(path)
+            if rendered is not None:
+                return rendered
+        st = os.stat(path)
+        if _CONTENT_HASH_NAME.match(path.name):
+            # The name already says what is in the file, so it can be cached for good
+            digest = path.name[:64]
+            cache_control = IMMUTABLE_CACHE
+        else:
+            digest = self._digest(path, st)
+            cache_control = REVALIDATE_CACHE
+        return Representation(f'"{digest[:32]}"', _content_type(path.name), cache_control, st.st_size, path=path)
+
+    def _render_journaled_csv(self, path):
+        """The CSV with its pending journal edits applied, or None when the file is up to date"""
+        try:
+            if not os.path.getsize(f"{path}{JOURNAL_SUFFIX}"):
+                return None
+        except FileNotFoundError:
+            return None
+        table = self._tables[path.name]
+        table.refresh()
+        with self._lock:
+            cached = self._rendered.get(path.name)
+            if cached is not None and cached[0] == table.version:
+                return cached[1]
+        data = table.to_csv_bytes()
+        representation = Representation(f'"{hashlib.sha256(data).hexdigest()[:32]}"', _content_type(path.name),
+                                        REVALIDATE_CACHE, len(data), data=data)
+        with self._lock:
+            self._rendered[path.name] = (table.version, representation)
+        return representation
+
+    def _precompressed_copy(self, identity, encoding):
+        """The .gz/.br file next to identity's file if it holds the same contents, else None"""
+        if encoding == 'br' and brotli is None:
+            return None
+        copy_path = Path(f"{identity.path}.{'gz' if encoding == 'gzip' else 'br'}")
+        try:
+            copy_st = os.stat(copy_path)
+        except FileNotFoundError:
+            return None
+        key = (identity.path, encoding)
+        with self._lock:
+            cached = self._precompressed.get(key)
+        if cached is None or cached[:2] != (identity.etag, _signature(copy_st)):
+            # graph_bundle.py writes the copies before the file itself, so mtimes cannot tell a
+            # stale copy from a current one; compare the decompressed contents once instead
+            with open(copy_path, 'rb') as f:
+                data = f.read()
+            data = gzip.decompress(data) if encoding == 'gzip' else brotli.decompress(data)
+            matches = f'"{hashlib.sha256(data).hexdigest()[:32]}"' == identity.etag
+            cached = (identity.etag, _signature(copy_st), matches)
+            with self._lock:
+                self._precompressed[key] = cached
+        if not cached[2]:
+            return None
+        return Representation(f'"{identity.etag[1:-1]}-{encoding}"', identity.content_type, identity.cache_control,
+                              copy_st.st_size, path=copy_path, encoding=encoding)
+
+    def _gzipped(self, identity):
+        """identity gzipped in memory, or None if it is too large to be worth it"""
+        if identity.length > COMPRESS_MAX_BYTES:
+            return None
+        key = (identity.path, identity.etag)
+        with self._lock:
+            data = self._compressed.get(key)
+            if data is not None:
+                self._compressed.move_to_end(key)
+        if data is None:
+            if identity.data is not None:
+                source = identity.data
+            else:
+                with open(identity.path, 'rb') as f:
+                    source = f.read()
+            data = gzip.compress(source, compresslevel=6, mtime=0)
+            with self._lock:
+                if key not in self._compressed:
+                    self._compressed[key] = data
+                    self._compressed_bytes += len(data)
+                while self._compressed_bytes > COMPRESS_CACHE_BYTES and len(self._compressed) > 1:
+                    _, evicted = self._compressed.popitem(last=False)
+                    self._compressed_bytes -= len(evicted)
+        return Representation(f'"{identity.etag[1:-1]}-gzip"', identity.content_type, identity.cache_control,
+                              len(data), data=data, encoding='gzip')
+
+    def compressible(self, identity):
+        return identity.content_type.startswith(COMPRESSIBLE_TYPES)
+
+    def negotiate(self, identity, accept_encoding):
+        """The best representation of identity for a client sending accept_encoding"""
+        if not self.compressible(identity):
+            return identity
+        accepted = _accepted_encodings(accept_encoding)
+        if identity.path is not None:
+            for encoding in ('br', 'gzip'):
+                if encoding in accepted:
+                    copy = self._precompressed_copy(identity, encoding)
+                    if copy is not None:
+                        return copy
+        if 'gzip' in accepted:
+            return self._gzipped(identity) or identity
+        return identity
+
+
+class RequestHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # Keep-alive, so a page load reuses its connections
+    server_version = 'EvidenceServer/1'
+
+    def do_GET(self):
+        self._serve(send_body=True)
+
+    def do_HEAD(self):
+        self._serve(send_body=False)
+
+    def log_message(self, format, *args):
+        if not self.server.quiet:
+            super().log_message(format, *args)
+
+    def _serve(self, send_body):
+        site = self.server.site
+        path = site.resolve(urlsplit(self.path).path)
+        if path is None:
+            self.send_error(HTTPStatus.NOT_FOUND)
+            return
+        try:
+            identity = site.identity(path)
+        except FileNotFoundError:  # Deleted since it was resolved
+            self.send_error(HTTPStatus.NOT_FOUND)
+            return
+
+        byte_range = self._requested_range(identity)
+        if byte_range == 'unsatisfiable':
+            self.send_response(HTTPStatus.REQUESTED_RANGE_NOT_SATISFIABLE)
+            self.send_header('Content-Range', f'bytes */{identity.length}')
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        representation = identity if byte_range else site.negotiate(identity, self.headers.get('Accept-Encoding'))
+
+        if self._not_modified(representation):
+            self.send_response(HTTPStatus.NOT_MODIFIED)
+            self._send_cache_headers(site, representation)
+            self.end_headers()
+            return
+
+        start, end = byte_range or (0, representation.length - 1)
+        self.send_response(HTTPStatus.PARTIAL_CONTENT if byte_range else HTTPStatus.OK)
+        self._send_cache_headers(site, representation)
+        self.send_header('Content-Type', representation.content_type)
+        if representation.encoding:
+            self.send_header('Content-Encoding', representation.encoding)
+        if representation is identity:
+            self.send_header('Accept-Ranges', 'bytes')
+        if byte_range:
+            self.send_header('Content-Range', f'bytes {start}-{end}/{identity.length}')
+        self.send_header('Content-Length', str(end - start + 1))
+        self.end_headers()
+        if send_body and end >= start:
+            self._send_body(representation, start, end - start + 1)
+
+    def _send_cache_headers(self, site, representation):
+        self.send_header('ETag', representation.etag)
+        self.send_header('Cache-Control', representation.cache_control)
+        if site.compressible(representation):
+            self.send_header('Vary', 'Accept-Encoding')
+
+    def _not_modified(self, representation):
+        if_none_match = self.headers.get('If-None-Match')
+        if not if_none_match:
+            return False
+        # If-None-Match uses the weak comparison, so a W/ prefix added by a proxy still matches
+        tags = {tag.strip().removeprefix('W/') for tag in if_none_match.split(',')}
+        return '*' in tags or representation.etag in tags
+
+    def _requested_range(self, identity):
+        """(first, last) byte of a satisfiable single range, 'unsatisfiable', or None for the whole file"""
+        header = self.headers.get('Range')
+        if not header:
+            return None
+        if_range = self.headers.get('If-Range')
+        if if_range and if_range.strip() != identity.etag:
+            return None  # Changed since the client's partial copy; send it all again
+        match = _RANGE.match(header.strip())
+        if not match or match.groups() == ('', ''):
+            return None  # Multiple or malformed ranges: the whole file is a valid answer
+        first, last = match.groups()
+        size = identity.length
+        if first == '':
+            first, last = max(0, size - int(last)), size - 1
+        else:
+            first, last = int(first), min(int(last), size - 1) if last else size - 1
+        if first >= size or first > last:
+            return 'unsatisfiable'
+        return first, last
+
+    def _send_body(self, representation, offset, length):
+        if representation.data is not None:
+            self.wfile.write(representation.data[offset:offset + length])
+            return
+        with open(representation.path, 'rb') as f:
+            self.wfile.flush()
+            # Let the kernel copy the file to the socket where it can
+            self.connection.sendfile(f, offset, length)
+
+
+class WebServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, root='.', quiet=False):
+        super().__init__(address, RequestHandler)
+        self.site = Site(root)
+        self.quiet = quiet
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve the web view and evidence images with HTTP caching")
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT, help=f"Port to listen on (default: {DEFAULT_PORT})")
+    parser.add_argument('--bind', default='127.0.0.1', help="Address to listen on (default: 127.0.0.1)")
+    parser.add_argument('--root', default='.', help="Project directory to serve (default: current directory)")
+    parser.add_argument('--quiet', action='store_true', help="Don't log requests")
+    args = parser.parse_args()
+
+    server = WebServer((args.bind, args.port), args.root, args.quiet)
+    print(f"Serving {server.site.root} at http://{args.bind}:{args.port}/")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()